@@ -4,11 +4,19 @@ import time
 
 from bp5pins import *
 import lamps
+import spibus
 import sr595
 import display
 import analog
+import burst
 import power
+import ocp
+import softstart
+import logicsweep
+import curvetrace
 import bp5io
+import logic
+import sump
 #import nand
 from hexdump import hexdump
 # use hello example for splash screen
@@ -16,6 +24,11 @@ import splash
 import framebuf
 import bouncer
 
+# SPI0 clock rates, per device
+SPI_BAUD_SR = 12_500_000        # 74HC595 at 3.3 V
+SPI_BAUD_DISPLAY = 62_500_000   # ST7789, 16 ns write cycle
+SPI_BAUD_NAND = 62_500_000      # MT29F1G01, peripheral limit
+
 class BP5:
   __doc__ = \
   '''Bus Pirate 5 RP2040 MicroPython proof-of-concept demo.
@@ -23,8 +36,16 @@ class BP5:
     lamps.help()   LED ring class
     disp.help()    TFT display
     adc.help()     analog to digital converter
+    burst.help()   high rate ADC burst capture
     psu.help()     adjustable power supply
-    io.help()      I/O connector pins class
+    ocp.help()     over-current watchdog
+    soft.help()    soft-start and profile engine
+    sweep.help()   logic threshold characterization
+    iv.help()      I-V curve tracer
+    sump.help()    SUMP logic analyzer server on USB serial
+    trig.help()    triggered logic capture, pre-trigger history
+    io.help()      I/O connector pins and logic capture
+    bus.help()     shared SPI0 bus arbiter
     b0..b7         individual I/O pins classes
     sw2            push button (not class, just Pin)
   Functions:
@@ -37,23 +58,28 @@ class BP5:
     print(self.__doc__)
 
   def __init__(self):
-    self.spi = SPI(0, baudrate=16_0000_0000, 
-               firstbit = SPI.MSB,
-               polarity=0, phase=0, # defaults
-               sck=Pin(PIN_SPI_CLK), 
-               mosi=Pin(PIN_SPI_SDO), 
-               miso=Pin(PIN_SPI_SDI)
-            )
+    # SPI0 is shared, each device gets its own clock / mode profile
+    self.bus = spibus.SPIBus()
+    self.spi_sr = self.bus.device('sr', baudrate=SPI_BAUD_SR)
+    self.spi_disp = self.bus.device('display', baudrate=SPI_BAUD_DISPLAY)
+    self.spi_nand = self.bus.device('nand', baudrate=SPI_BAUD_NAND)
     # Create the modules
     self.sw2 = Pin(PIN_BUTTONS, Pin.IN, Pin.PULL_DOWN)
     self.lamps = lamps.Lamps()
-    self.sr = sr595.SR(self.spi)
-    self.disp = display.Display(self.spi, self.sr)
-    self.io = bp5io.BP5IO(self.sr, self.disp)
+    self.sr = sr595.SR(self.spi_sr)
+    self.disp = display.Display(self.spi_disp, self.sr)
+    self.io = logic.Logic(self.sr, self.disp)
     self.adc = analog.Analog(self.sr, self.disp)
-    self.psu = power.Power(self.sr, self.adc)
+    self.burst = burst.Burst(self.adc)
+    self.psu = power.Power(self.sr, self.adc, self.burst)
+    self.ocp = ocp.Watchdog(self.psu)
+    self.soft = softstart.Profile(self.psu)
+    self.sweep = logicsweep.Sweep(self.psu, self.io)
+    self.iv = curvetrace.Tracer(self.psu, self.disp)
+    self.sump = sump.Sump(self.io)
+    self.trig = self.sump.trigger
     # not ready, do not use NAND
-    # self.nand = nand.NAND(self.spi)
+    # self.nand = nand.NAND(self.spi_nand)
     # make it easier to access each bit of the I/O connector
     self.b0 = self.io.bits[0]
     self.b1 = self.io.bits[1]
@@ -0,0 +1,115 @@
+import struct
+
+# Per-channel ADC calibration, gain and offset against a reference:
+#   actual = gain * nominal + offset
+# where nominal is the reading from the nominal scale factors.
+# Stored in a small binary file on the flash drive:
+#   magic 'BPAC', channel count, then per channel
+#   gain in ppm, offset in millionths of the unit (uV or nA)
+# Entries 0..11 are the MUX channels (by MUX number), the last
+# entry is the current sense input.
+
+MAGIC = b'BPAC'
+NCAL = 13
+ISENSE = 12
+FILENAME = 'adc.cal'
+UNITY = 1_000_000
+
+def fit( nominal, actual ):
+  """Least squares gain and offset, actual = gain * nominal + offset"""
+  n = len(nominal)
+  if n != len(actual) or n < 2:
+    raise ValueError('Need two or more pairs of readings')
+  sx = sum(nominal)
+  sy = sum(actual)
+  mx = sx / n
+  my = sy / n
+  sxx = 0.0
+  sxy = 0.0
+  for x, y in zip(nominal, actual):
+    sxx += (x - mx) * (x - mx)
+    sxy += (x - mx) * (y - my)
+  if sxx == 0:
+    raise ValueError('Readings must span more than one value')
+  gain = sxy / sxx
+  offset = my - gain * mx
+  return gain, offset
+
+def residuals( nominal, actual, gain, offset ):
+  """Worst case error after applying gain and offset"""
+  return max( abs(gain * x + offset - y) for x, y in zip(nominal, actual) )
+
+class Calibration:
+  __doc__ = \
+  '''Per-channel ADC gain / offset calibration table.
+  cal = Calibration(FILENAME)
+  Class functions:
+    set(ich, gain, offset)   sets entry, gain and offset (V or mA)
+    get(ich)                 returns (gain, offset) as floats
+    reset(ich)               back to nominal, all entries if None
+    load()                   reads the table, False if none or bad
+    save()                   writes the table to the flash drive
+  Class members:
+    gains          array of gains, ppm
+    offsets        array of offsets, uV or nA'''
+
+  def help(self):
+    print(self.__doc__)
+
+  def __init__(self, filename=FILENAME):
+    self.filename = filename
+    self.gains = [ UNITY ] * NCAL
+    self.offsets = [ 0 ] * NCAL
+
+  def set( self, ich, gain, offset ):
+    self.gains[ich] = int( gain * UNITY + 0.5 )
+    self.offsets[ich] = int( offset * UNITY + (0.5 if offset >= 0 else -0.5) )
+
+  def get( self, ich ):
+    return self.gains[ich] / UNITY, self.offsets[ich] / UNITY
+
+  def reset( self, ich=None ):
+    for i in range(NCAL) if ich is None else (ich,):
+      self.gains[i] = UNITY
+      self.offsets[i] = 0
+
+  def pack( self ):
+    out = bytearray(MAGIC)
+    out.append(NCAL)
+    for i in range(NCAL):
+      out.extend( struct.pack('<ii', self.gains[i], self.offsets[i]) )
+    return out
+
+  def unpack( self, data ):
+    # length first, a short file must not index past the end
+    if len(data) != 5 + 8*NCAL or data[0:4] != MAGIC or data[4] != NCAL:
+      raise ValueError('Not an ADC calibration table')
+    for i in range(NCAL):
+      self.gains[i], self.offsets[i] = struct.unpack_from('<ii', data, 5 + 8*i)
+
+  def load( self ):
+    try:
+      with open(self.filename, 'rb') as f:
+        self.unpack( f.read() )
+    except OSError:
+      return False
+    except ValueError:
+      # truncated or foreign file, boot on the nominal scales
+      self.reset()
+      return False
+    return True
+
+  def save( self ):
+    with open(self.filename, 'wb') as f:
+      f.write( self.pack() )
+
+  def __repr__(self):
+    out = []
+    for i in range(NCAL):
+      gain, offset = self.get(i)
+      out.append( f'{i:2d}:  gain {gain:8.5f}  offset {offset:+8.5f}' )
+    return '\n'.join( out )
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -1,5 +1,11 @@
-from machine import Pin, ADC
+from machine import Pin, ADC, Timer
+from array import array
+import time
 from bp5pins import *
+from ring import Ring
+from worker import Worker
+from stats import Stats
+import adccal
 
 class Analog:
   __doc__ = \
@@ -13,7 +19,36 @@ class Analog:
     deselect()     disables the MUX
     read( ch )     read the ADC after switching the MUX channel
     read()         read the ADC uses currently selected MUX channel
+    scan(buf)      raw counts of all channels into array('H')
+    to_volts(buf)  converts scan() counts to voltages
+    benchmark()    full-scan rates: reference path, read(), scan()
+    start()        starts continuous acquisition into ring, args:
+      channels     list of MUX channels, default all
+      rate         samples per second, default 100
+      depth        ring depth in samples, default 256
+      core1        sample from a worker on core 1, default False
+      stats        keep running statistics, default True
+    stop()         stops continuous acquisition
+    stats()        acquisition statistics, min/max/mean/stddev
+    stats_reset()  restarts the statistics
+  Class members:
+    ring           continuous acquisition ring buffer, see ring.help()
+    cal            calibration table, see cal.help(), cal.save()
+    skipped        acquisition ticks skipped, SPI bus was busy
+    claims         ADC users right now, interrupts leave the ADC alone
     isense()       reads current sense, returns mA (doesn't use MUX)
+    oversample()   integer average of n samples, fixed-point mV, args:
+      channel      MUX channel, default currently selected
+      n            number of samples, power of two, default 16
+      volts        returns float volts instead, default False
+    isense_ua()    integer average of n current samples, uA, args:
+      n            number of samples, power of two, default 16
+      milliamps    returns float mA instead, default False
+    calibrate()    fits channel gain / offset to reference readings, args:
+      channel      MUX channel, or ISENSE for the current sense
+      nominal      list of uncalibrated readings, V or mA
+      actual       list of reference readings, V or mA
+    apply_cal()    recomputes coefficients after editing cal
     strings()      all channel voltages as list of strings
     all()          all channel voltages as numerical values
     print()        prints all channels voltages, args:
@@ -50,6 +85,8 @@ class Analog:
   CURRENT_DETECT  =  9 #  " IDET"
   VREG_OUT        = 10 #  " VREG"
   MUX_VREF_OUT    = 11 #  "MUXVR"
+  # not a MUX channel, calibration index of the current sense
+  ISENSE          = adccal.ISENSE
 
   LBL_BPIO0           = " IO0"
   LBL_BPIO1           = " IO1"
@@ -111,7 +148,23 @@ class Analog:
   # scale factor, current sense, 
   # 0-3.3 V = 0 to 500 mA
   ISENSE_MAX_MILLIAMPS = 500.0
-  ISCALE_FACTOR = ISENSE_MAX_MILLIAMPS * ( ADC_MAX_VOLTS / ADC_MAX_COUNTS )
+  ISCALE_FACTOR = ISENSE_MAX_MILLIAMPS / ADC_MAX_COUNTS
+  #
+  # integer scaling, for the oversampling path:
+  # the ADC is really 12 bits, read_u16() >> 4 gives raw counts
+  ADC_BITS = 12
+  # full scale in mV, fixed-point with MV_FRAC_BITS fraction bits,
+  # i.e. oversample() returns millivolts * 16
+  MV_FULL_SCALE = 6600 # PRESCALE_FACTOR * ADC_MAX_VOLTS
+  MV_FRAC_BITS = 4
+  # full scale in uA is 500_000 = 15625 << 5, split to stay in
+  # small int range (30 bits): decimated values are cut to 15 bits
+  # first, which leaves room for a calibrated gain up to 2
+  UA_FULL_SCALE = 15625
+  UA_FULL_SCALE_SHIFT = 5
+  UA_MAX_BITS = 15
+  OVERSAMPLE = 16
+  MAX_OVERSAMPLE = 1024
 
   # Related Shift Register bits:
   # MASK_AMUX_EN              = 1<<0
@@ -119,48 +172,222 @@ class Analog:
   # MASK_AMUX_S1              = 1<<2
   # MASK_AMUX_S2              = 1<<3
   # MASK_AMUX_S3              = 1<<4
+  MASK_AMUX = 0x1f
 
   def getbit( self, value, bitnum ):
     return int((value & (1<<bitnum)) > 0)
 
+  # shift register AMUX field that selects a channel,
+  # channel number in S3..S0 and enable (active low) cleared
+  def mux_word( self, channel ):
+    return (channel & 0x0f) << self.sr.AMUX_S0
+
   def __init__(self, sr, disp):
     self.sr = sr
     self.disp = disp
     self.amux = ADC(Pin(PIN_ANALOG_MUX))
-    self.isense = ADC(Pin(PIN_CURRENT_SENSE))
+    self.iadc = ADC(Pin(PIN_CURRENT_SENSE))
+    # precomputed AMUX fields, in AIN order, for scan()
+    self.mux_words = array('H', [ self.mux_word(ch) for ch in self.AIN ])
+    # one channel for read(ch), same path
+    self.read_word = array('H', [0])
+    self.read_raw = array('H', [0])
+    # continuous acquisition
+    self.timer = None
+    self.worker = None
+    self.ring = None
+    self.acq_stats = None
+    self.skipped = 0
+    self.claims = 0
+    # calibration, saved table if any, else nominal
+    self.channel = None
+    self.cal = adccal.Calibration()
+    self.cal.load()
+    self.apply_cal()
+
+  # Fold the calibration into per-channel scale factors, so a
+  # calibrated reading costs the same multiply (and add) as the
+  # nominal one. Indexed by MUX channel number, ISENSE last.
+  def apply_cal( self ):
+    self.vscale = []
+    self.voffset = []
+    self.mv_scale = array('i', [0] * adccal.NCAL)
+    self.mv_offset = array('i', [0] * adccal.NCAL)
+    for ich in range(adccal.NCAL):
+      gain = self.cal.gains[ich]
+      offset = self.cal.offsets[ich] # uV or nA
+      if ich == self.ISENSE:
+        fscale = self.ISCALE_FACTOR
+        iscale = self.UA_FULL_SCALE
+        ioffset = offset // 1000
+      else:
+        fscale = self.VSCALE_FACTOR
+        iscale = self.MV_FULL_SCALE
+        ioffset = (offset << self.MV_FRAC_BITS) // 1000
+      self.vscale.append( fscale * gain / adccal.UNITY )
+      self.voffset.append( offset / adccal.UNITY )
+      self.mv_scale[ich] = (iscale * gain + adccal.UNITY // 2) // adccal.UNITY
+      self.mv_offset[ich] = ioffset
+
+  def calibrate( self, channel, nominal, actual ):
+    # undo the current calibration, the fit is against nominal
+    self.cal.reset(channel)
+    gain, offset = adccal.fit( nominal, actual )
+    self.cal.set(channel, gain, offset)
+    self.apply_cal()
+    return gain, offset, adccal.residuals(nominal, actual, gain, offset)
 
   def deselect( self ):
     self.sr.set_bits(self.sr.MASK_AMUX_EN)
     self.sr.send()
 
+  # committed at once, even inside a shift register transaction,
+  # the conversion that follows needs the mux switched
   def select( self, channel ):
-    self.sr.clr_bits(self.sr.MASK_AMUX_S0)
-    self.sr.clr_bits(self.sr.MASK_AMUX_S1)
-    self.sr.clr_bits(self.sr.MASK_AMUX_S2)
-    self.sr.clr_bits(self.sr.MASK_AMUX_S3)
-    if self.getbit( channel, 0 ): self.sr.set_bits(self.sr.MASK_AMUX_S0)
-    if self.getbit( channel, 1 ): self.sr.set_bits(self.sr.MASK_AMUX_S1)
-    if self.getbit( channel, 2 ): self.sr.set_bits(self.sr.MASK_AMUX_S2)
-    if self.getbit( channel, 3 ): self.sr.set_bits(self.sr.MASK_AMUX_S3)
-    # mux enable, active low
-    self.sr.clr_bits(self.sr.MASK_AMUX_EN)
-    self.sr.send()
+    self.sr.put_bits(self.MASK_AMUX, self.mux_word(channel))
+    self.sr.send(now=True)
+    self.channel = channel
 
+  # ADC ownership: conversions are claimed for their duration, so
+  # a hard interrupt (see ocp.Watchdog) can tell that it landed in
+  # the middle of one, and skip its own read instead of changing
+  # AINSEL under it. Claims are taken by the reads below, by a Burst
+  # from arm() to halt(), and by core 1 acquisition while it runs
+  # (its conversions can't be told apart from core 0).
   def read( self, channel=None ):
     if channel is None:
-      val = self.amux.read_u16() * self.VSCALE_FACTOR
+      ich = self.channel
+      self.claims += 1
+      try:
+        raw = self.amux.read_u16()
+      finally:
+        self.claims -= 1
+      if ich is None:
+        val = raw * self.VSCALE_FACTOR
+      else:
+        val = raw * self.vscale[ich] + self.voffset[ich]
     else:
-      self.select(channel)
-      val = self.read()
-      self.deselect()
+      # select, convert and deselect in one bus hold, so continuous
+      # acquisition can't move the mux in between, and pending is
+      # left deselected as it is committed
+      sr = self.sr
+      sr.set_bits(sr.MASK_AMUX_EN)
+      self.read_word[0] = self.mux_word(channel)
+      self.claims += 1
+      try:
+        sr.step(self.MASK_AMUX, self.read_word, self.amux.read_u16,
+                self.read_raw, sr.pending & self.MASK_AMUX)
+      finally:
+        self.claims -= 1
+      self.channel = channel
+      val = self.read_raw[0] * self.vscale[channel] + self.voffset[channel]
     return val
 
+  # Scan all channels, in AIN order, one shift register commit 
+  # per channel and a single deselect at the end. Raw counts go
+  # into buf, an array('H') of NCHAN, allocated if not given.
+  def scan( self, buf=None ):
+    if buf is None: buf = array('H', [0] * self.NCHAN)
+    self.claims += 1
+    try:
+      self.sr.step(self.MASK_AMUX, self.mux_words, self.amux.read_u16, buf)
+    finally:
+      self.claims -= 1
+    self.channel = self.AIN[-1]
+    self.deselect()
+    return buf
+
+  # Continuous acquisition: a timer samples the channel set at a
+  # fixed rate, one frame of raw counts per tick, into the ring.
+  # Everything the tick needs is prepared here, so sampling does
+  # not allocate. Read with ring.window() / ring.consume(n).
+  # With core1=True a worker thread on the second core does the
+  # sampling instead, and display updates on core 0 don't delay it.
+  def start( self, channels=None, rate=100, depth=256, core1=False,
+             stats=True ):
+    self.stop()
+    if channels is None: channels = self.AIN
+    self.acq_channels = tuple(channels)
+    self.acq_words = array('H', [ self.mux_word(ch) for ch in channels ])
+    self.acq_read = self.amux.read_u16
+    self.acq_stats = Stats(len(channels)) if stats else None
+    self.skipped = 0
+    if core1:
+      self.worker = Worker(self.sample, len(channels), rate, depth)
+      self.ring = self.worker.ring
+      self.claims += 1
+      self.worker.start()
+    else:
+      self.ring = Ring(depth, len(channels))
+      self.timer = Timer(freq=rate, mode=Timer.PERIODIC, callback=self.acquire)
+    return self.ring
+
+  def stop( self ):
+    if self.timer is not None:
+      self.timer.deinit()
+      self.timer = None
+      self.deselect()
+    if self.worker is not None:
+      self.worker.stop()
+      self.worker = None
+      self.claims -= 1
+      self.deselect()
+
+  # one frame of the prepared channel set; the timer path claims
+  # the ADC here, core 1 holds a claim for as long as it runs
+  def sample( self, frame ):
+    if self.worker is None:
+      self.claims += 1
+      try:
+        self.sr.step(self.MASK_AMUX, self.acq_words, self.acq_read, frame)
+      finally:
+        self.claims -= 1
+    else:
+      self.sr.step(self.MASK_AMUX, self.acq_words, self.acq_read, frame)
+    self.channel = self.acq_channels[-1]
+    if self.acq_stats is not None:
+      self.acq_stats.update(frame)
+
+  def stats( self ):
+    if self.acq_stats is None: return []
+    out = []
+    for ch, st in zip(self.acq_channels, self.acq_stats.snapshot()):
+      n, lo, hi, mean, std = st
+      scale = self.vscale[ch]
+      offset = self.voffset[ch]
+      out.append(
+        f'{self.LABELS[self.AIN.index(ch)]}: n {n}  '
+        f'min {lo * scale + offset:5.3f}  max {hi * scale + offset:5.3f}  '
+        f'mean {mean * scale + offset:6.4f}  std {std * scale:6.4f}')
+    return out
+
+  def stats_reset( self ):
+    if self.acq_stats is not None:
+      self.acq_stats.reset()
+
+  def acquire( self, timer=None ):
+    # shift register in use by the interrupted code, try next tick
+    if self.sr.held():
+      self.skipped += 1
+      return
+    frame = self.ring.slot()
+    if frame is None: return # overrun, counted by the ring
+    self.sample(frame)
+    self.ring.push()
+
+  # scan() counts, in AIN order, to calibrated voltages
+  def to_volts( self, buf ):
+    vscale = self.vscale
+    voffset = self.voffset
+    return [ buf[i] * vscale[ch] + voffset[ch] for i, ch in enumerate(self.AIN) ]
+
   def strings_disp(self):
     out = []
+    values = self.all()
     for ich in range(self.NCHAN):
       out.append(
         f'{self.LABELS[ich]}: '
-        f'{self.read(self.AIN[ich]):5.3f} '
+        f'{values[ich]:5.3f} '
         f'{self.UNITS[ich]}')
     return out
 
@@ -174,13 +401,123 @@ class Analog:
     return '\n'.join( self.strings() )
 
   def all(self):
-    values = []
-    for ich in range(self.NCHAN):
-      values.append( self.read( self.AIN[ich] ))
-    return values
+    return self.to_volts( self.scan() )
+
+  # The per-channel path all() took before scan(): the AMUX bits
+  # set one at a time, a commit with a fresh buffer and a 2 x 10 usec
+  # latch pulse to select, the same to deselect, and a float per
+  # reading. Kept as the reference for benchmark().
+  def read_reference( self, channel ):
+    sr = self.sr
+    sr.clr_bits(sr.MASK_AMUX_S0)
+    sr.clr_bits(sr.MASK_AMUX_S1)
+    sr.clr_bits(sr.MASK_AMUX_S2)
+    sr.clr_bits(sr.MASK_AMUX_S3)
+    if self.getbit( channel, 0 ): sr.set_bits(sr.MASK_AMUX_S0)
+    if self.getbit( channel, 1 ): sr.set_bits(sr.MASK_AMUX_S1)
+    if self.getbit( channel, 2 ): sr.set_bits(sr.MASK_AMUX_S2)
+    if self.getbit( channel, 3 ): sr.set_bits(sr.MASK_AMUX_S3)
+    sr.clr_bits(sr.MASK_AMUX_EN)
+    self.commit_reference()
+    self.claims += 1
+    try:
+      val = self.amux.read_u16() * self.VSCALE_FACTOR
+    finally:
+      self.claims -= 1
+    sr.set_bits(sr.MASK_AMUX_EN)
+    self.commit_reference()
+    return val
+
+  def commit_reference( self ):
+    sr = self.sr
+    sr.spi.write(bytearray(sr.pending.to_bytes(2,'big')))
+    sr.outputs = sr.pending
+    sr.xfer.value(1)
+    time.sleep_us(10)
+    sr.xfer.value(0)
+    time.sleep_us(10)
+
+  # Full-scan rates of read_reference() per channel, read() per
+  # channel and scan(), in scans per second
+  def benchmark(self, nloops=100, verbose=True):
+    """Compare full-scan rates: reference path, read() and scan()"""
+    rates = []
+    for path in (self.read_reference, self.read):
+      t0 = time.ticks_us()
+      for n in range(nloops):
+        for ich in range(self.NCHAN):
+          path( self.AIN[ich] )
+      rates.append( nloops * 1_000_000 / time.ticks_diff(time.ticks_us(), t0) )
+    buf = array('H', [0] * self.NCHAN)
+    t0 = time.ticks_us()
+    for n in range(nloops):
+      self.to_volts( self.scan(buf) )
+    rates.append( nloops * 1_000_000 / time.ticks_diff(time.ticks_us(), t0) )
+    if verbose:
+      for name, rate in zip(('reference', 'read()', 'scan()'), rates):
+        print(f'{name:>9}: {rate:8.1f} scans/s  {rate / rates[0]:5.1f}x')
+    return rates
 
   def isense( self ):
-    return self.isense.read_u16() * self.ISCALE_FACTOR
+    ich = self.ISENSE
+    self.claims += 1
+    try:
+      raw = self.iadc.read_u16()
+    finally:
+      self.claims -= 1
+    return raw * self.vscale[ich] + self.voffset[ich]
+
+  # Oversampling: n = 2**m raw 12 bit counts are summed as integers,
+  # then decimated by 2**(m - m//2), which leaves m//2 extra bits of
+  # resolution (e.g. 16 bits for n = 256). Scaling to mV or uA is 
+  # done with integer multiply and shift, no floats unless asked.
+  def decimate( self, acc, n ):
+    if n < 1 or n > self.MAX_OVERSAMPLE or n & (n-1):
+      raise ValueError(f'Oversample {n} must be power of two, 1..{self.MAX_OVERSAMPLE}')
+    m = 0
+    while (1 << m) < n: m += 1
+    extra = m >> 1
+    return acc >> (m - extra), self.ADC_BITS + extra
+
+  def accumulate( self, read_u16, n ):
+    acc = 0
+    self.claims += 1
+    try:
+      for i in range(n):
+        acc += read_u16() >> 4
+    finally:
+      self.claims -= 1
+    return acc
+
+  def oversample( self, channel=None, n=OVERSAMPLE, volts=False ):
+    if channel is None:
+      channel = self.channel
+      acc = self.accumulate(self.amux.read_u16, n)
+    else:
+      with self.sr.spi:
+        self.select(channel)
+        acc = self.accumulate(self.amux.read_u16, n)
+        self.deselect()
+    val, frac = self.decimate(acc, n)
+    if channel is None:
+      mv = (val * self.MV_FULL_SCALE) >> (frac - self.MV_FRAC_BITS)
+    else:
+      mv = ((val * self.mv_scale[channel]) >> (frac - self.MV_FRAC_BITS)) \
+           + self.mv_offset[channel]
+    if volts: return mv / (1000 << self.MV_FRAC_BITS)
+    return mv
+
+  def isense_ua( self, n=OVERSAMPLE, milliamps=False ):
+    acc = self.accumulate(self.iadc.read_u16, n)
+    val, frac = self.decimate(acc, n)
+    if frac > self.UA_MAX_BITS:
+      val >>= frac - self.UA_MAX_BITS
+      frac = self.UA_MAX_BITS
+    ich = self.ISENSE
+    ua = ((val * self.mv_scale[ich]) >> (frac - self.UA_FULL_SCALE_SHIFT)) \
+         + self.mv_offset[ich]
+    if milliamps: return ua / 1000
+    return ua
 
   def print(self, clear=True, display=True, console=True):
     """Show the ADC voltages on the screen"""
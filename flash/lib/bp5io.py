@@ -1,4 +1,17 @@
-from machine import Pin, UART, SPI
+from machine import Pin, UART, SPI, mem32
+
+# RP2040 SIO registers, see datasheet section 2.3.1.
+# The SET / CLR / XOR aliases change several bits in one write.
+SIO_BASE = 0xd0000000
+SIO_GPIO_IN = SIO_BASE + 0x004
+SIO_GPIO_OUT = SIO_BASE + 0x010
+SIO_GPIO_OUT_SET = SIO_BASE + 0x014
+SIO_GPIO_OUT_CLR = SIO_BASE + 0x018
+SIO_GPIO_OUT_XOR = SIO_BASE + 0x01c
+SIO_GPIO_OE = SIO_BASE + 0x020
+SIO_GPIO_OE_SET = SIO_BASE + 0x024
+SIO_GPIO_OE_CLR = SIO_BASE + 0x028
+SIO_GPIO_OE_XOR = SIO_BASE + 0x02c
 
 class BP5BIT:
   __doc__ = \
@@ -91,9 +104,12 @@ class BP5BIT:
 class BP5IO:
   __doc__ = \
   '''Manages the I/O connector signals.
-  io = BP5IO( SR )
+  io = BP5IO( SR, DISP, MEM )
     where:
       SR           shift register class
+      DISP         display class
+      MEM          register access, default machine.mem32,
+                   tests/siofake.py off target
   Class functions:
     pullups(en)    enable/disable BP5 global pullups
     cheat()        display I/O pin cheat sheet on display
@@ -102,6 +118,12 @@ class BP5IO:
       baudrate     baudrate, default = 115200 Bd
     make_spi()     returns SPI object after setting pins
       baudrate     clock rate, default = 1 MBd
+    read_port()    reads all 8 I/O bits at once, bit n is IOn
+    write_port()   writes the output bits at once, args:
+      byte         value, bit n is IOn
+      mask         bits to change, default 0xff
+    set_dir(mask)  bits set in mask are outputs, others inputs
+    get_dir()      current direction mask
   Class members:
     bits[0-7]      BP5BIT instances, one per bit'''
 
@@ -152,9 +174,46 @@ class BP5IO:
   SPI_SCLK = bits[6]
   SPI_MOSI = bits[7]
 
-  def __init__(self, sr, disp):
+  # I/O bits 0..7 are GPIO8..15, their level shifter direction
+  # pins are GPIO0..7 (high: output)
+  PORT_SHIFT = 8
+
+  def __init__(self, sr, disp, mem=None):
     self.sr = sr
     self.disp = disp
+    self.mem = mem32 if mem is None else mem
+
+  # Port access, one register access per operation, so all bits
+  # change at the same instant. Assumes the pins are SIO GPIOs,
+  # as left by BP5BIT; make_uart() / make_spi() take some over.
+  def read_port( self ):
+    return (self.mem[SIO_GPIO_IN] >> self.PORT_SHIFT) & 0xff
+
+  def write_port( self, byte, mask=0xff ):
+    mem = self.mem
+    # flip exactly the bits that differ, in a single write
+    mem[SIO_GPIO_OUT_XOR] = \
+      (((mem[SIO_GPIO_OUT] >> self.PORT_SHIFT) ^ byte) & mask) << self.PORT_SHIFT
+
+  def get_dir( self ):
+    return (self.mem[SIO_GPIO_OE] >> self.PORT_SHIFT) & 0xff
+
+  # Never drive against the level shifter: outputs turn on after
+  # their shifter, inputs turn off before it.
+  def set_dir( self, mask ):
+    mem = self.mem
+    old = self.get_dir()
+    to_in = old & ~mask & 0xff
+    to_out = mask & ~old & 0xff
+    if to_in:
+      mem[SIO_GPIO_OE_CLR] = to_in << self.PORT_SHIFT
+      mem[SIO_GPIO_OUT_CLR] = to_in
+    if to_out:
+      mem[SIO_GPIO_OUT_SET] = to_out
+      mem[SIO_GPIO_OE_SET] = to_out << self.PORT_SHIFT
+    for bit in self.bits:
+      if (to_in | to_out) & (1 << bit.iobit):
+        bit.direction = Pin.OUT if mask & (1 << bit.iobit) else Pin.IN
 
   def pullups( self, enable = None ):
     if enable is not None:
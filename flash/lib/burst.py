@@ -0,0 +1,273 @@
+from machine import mem32
+from array import array
+import time
+import rp2
+
+# RP2040 ADC registers, see datasheet section 4.9
+ADC_BASE = 0x4004c000
+ADC_CS = ADC_BASE + 0x00
+ADC_FCS = ADC_BASE + 0x08
+ADC_FIFO = ADC_BASE + 0x0c
+ADC_DIV = ADC_BASE + 0x10
+CS_EN = 1 << 0
+CS_START_MANY = 1 << 3
+CS_AINSEL_SHIFT = 12
+FCS_EN = 1 << 0
+FCS_SHIFT = 1 << 1
+FCS_DREQ_EN = 1 << 3
+FCS_EMPTY = 1 << 8
+FCS_UNDER = 1 << 10
+FCS_OVER = 1 << 11
+FCS_THRESH_SHIFT = 24
+DREQ_ADC = 36
+ADC_CLOCK = 48_000_000
+
+class Burst:
+  __doc__ = \
+  '''High rate ADC burst capture, RP2040 ADC FIFO + DMA.
+  burst = Burst(ADC, NSAMPLES, BITS, MEM, DMA)
+    where:
+      ADC          analog to digital converter class
+      NSAMPLES     samples per burst, default 1024
+      BITS         12 (array 'H') or 8 (bytearray), default 12
+      MEM          register access, default machine.mem32
+      DMA          DMA channel factory, default rp2.DMA
+                   (see tests/adcfake.py for host stand-ins)
+  Class functions:
+    start()        starts a burst, args:
+      channel      MUX channel, or ISENSE for the current sense
+      rate         samples per second, up to 500_000
+      callback     called with this object when the burst is done
+    arm()          same args as start(), does not start converting
+    trigger()      starts an armed burst
+    stop()         aborts a burst in progress
+    busy()         True while the burst is running
+    wait()         waits until done, returns False on timeout
+    mv(i)          sample i in fixed-point mV (or uA for ISENSE)
+    peak()         (index, value) of the largest sample
+    time_us(i)     time of sample i from the start, usec
+    waveform(t0)   summary of the burst from time t0 (ticks_us)
+  Class members:
+    buf            the samples, raw ADC counts'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # ADC inputs of the two analog signals
+  AIN_AMUX = 2   # GPIO28
+  AIN_ISENSE = 3 # GPIO29
+  MAX_RATE = 500_000
+
+  def __init__(self, adc, nsamples=1024, bits=12, mem=None, dma=None):
+    self.adc = adc
+    self.mem = mem32 if mem is None else mem
+    self.new_dma = rp2.DMA if dma is None else dma
+    self.bits = bits
+    if bits == 8:
+      self.buf = bytearray(nsamples)
+    else:
+      self.buf = array('H', bytearray(2 * nsamples))
+    self.nsamples = nsamples
+    self.dma = None
+    self.callback = None
+    self.channel = None
+    self.rate = None
+    self.t_start = None
+    self.ainsel = self.AIN_AMUX
+    self.claimed = False
+
+  def start( self, channel, rate=MAX_RATE, callback=None ):
+    self.arm( channel, rate, callback )
+    self.trigger()
+
+  # arm() sets up the ADC FIFO and DMA, trigger() starts converting.
+  # Split so a capture can start right next to another event, see
+  # Power.enable(capture=True). The ADC is claimed (Analog.claims)
+  # from arm() until halt(): a one-shot read in between would change
+  # AINSEL and take conversions from the FIFO, so the over-current
+  # watchdog skips its samples for the length of the burst.
+  def arm( self, channel, rate=MAX_RATE, callback=None ):
+    self.stop()
+    if rate > self.MAX_RATE or rate < ADC_CLOCK // 65536:
+      raise ValueError(f'Burst rate {rate} out of range')
+    self.channel = channel
+    self.rate = rate
+    self.callback = callback
+    if channel == self.adc.ISENSE:
+      self.ainsel = self.AIN_ISENSE
+    else:
+      self.adc.select(channel)
+      self.ainsel = self.AIN_AMUX
+    # sample period in 1/256 ADC clocks, 96 clocks is 500 kS/s
+    div = (ADC_CLOCK * 256) // rate - 256
+    if not self.claimed:
+      self.adc.claims += 1
+      self.claimed = True
+    mem = self.mem
+    mem[ADC_DIV] = div
+    mem[ADC_CS] = CS_EN | (self.ainsel << CS_AINSEL_SHIFT)
+    fcs = FCS_EN | FCS_DREQ_EN | (1 << FCS_THRESH_SHIFT) | FCS_UNDER | FCS_OVER
+    if self.bits == 8: fcs |= FCS_SHIFT
+    mem[ADC_FCS] = fcs
+    while not mem[ADC_FCS] & FCS_EMPTY:
+      mem[ADC_FIFO]
+    self.dma = self.new_dma()
+    ctrl = self.dma.pack_ctrl(
+      size = 0 if self.bits == 8 else 1,
+      inc_read = False,
+      inc_write = True,
+      treq_sel = DREQ_ADC,
+    )
+    self.dma.irq(self.finish)
+    self.dma.config(read=ADC_FIFO, write=self.buf,
+                    count=self.nsamples, ctrl=ctrl, trigger=True)
+
+  def trigger( self ):
+    self.t_start = time.ticks_us()
+    self.mem[ADC_CS] = CS_EN | CS_START_MANY | (self.ainsel << CS_AINSEL_SHIFT)
+
+  # leave the ADC as ADC.read_u16() expects it, one shot, no FIFO
+  def halt( self ):
+    mem = self.mem
+    mem[ADC_CS] = CS_EN
+    mem[ADC_FCS] = 0
+    while not mem[ADC_FCS] & FCS_EMPTY:
+      mem[ADC_FIFO]
+    mem[ADC_DIV] = 0
+    if self.dma is not None:
+      self.dma.close()
+      self.dma = None
+    if self.channel != self.adc.ISENSE:
+      self.adc.deselect()
+    if self.claimed:
+      self.adc.claims -= 1
+      self.claimed = False
+
+  def finish( self, dma=None ):
+    self.halt()
+    if self.callback is not None:
+      self.callback(self)
+
+  def stop( self ):
+    if self.dma is not None:
+      self.dma.active(0)
+      self.halt()
+
+  def busy( self ):
+    return self.dma is not None and self.dma.active()
+
+  def wait( self, timeout_ms=1000 ):
+    t0 = time.ticks_ms()
+    while self.busy():
+      if time.ticks_diff(time.ticks_ms(), t0) > timeout_ms:
+        return False
+    return True
+
+  # Conversion helpers, calibrated integer scaling as in
+  # Analog.oversample(): fixed-point mV (4 fraction bits) for
+  # MUX channels, uA for the current sense.
+  def scale( self, raw ):
+    ich = self.channel
+    frac = self.bits
+    if ich == self.adc.ISENSE: frac -= self.adc.UA_FULL_SCALE_SHIFT
+    else:                      frac -= self.adc.MV_FRAC_BITS
+    return ((raw * self.adc.mv_scale[ich]) >> frac) + self.adc.mv_offset[ich]
+
+  def mv( self, i ):
+    return self.scale( self.buf[i] )
+
+  def peak( self ):
+    ipeak = 0
+    vpeak = 0
+    buf = self.buf
+    for i in range(self.nsamples):
+      if buf[i] > vpeak:
+        vpeak = buf[i]
+        ipeak = i
+    return ipeak, self.mv(ipeak)
+
+  def time_us( self, i ):
+    return (i * 1_000_000) // self.rate
+
+  def index( self, t_us ):
+    i = (time.ticks_diff(t_us, self.t_start) * self.rate) // 1_000_000
+    return min( max(i, 0), self.nsamples - 1 )
+
+  def waveform( self, t0=None ):
+    return Waveform( self, 0 if t0 is None else self.index(t0) )
+
+  def __repr__(self):
+    state = 'busy' if self.busy() else 'idle'
+    return \
+    f'Burst {self.nsamples} x {self.bits} bits  ch {self.channel}  ' \
+    f'{self.rate} S/s  {state}'
+
+  def __str__(self):
+    return self.__repr__()
+
+class Waveform:
+  __doc__ = \
+  '''Summary of a burst: peak, time to peak and settle time.
+  wave = burst.waveform(T0)
+    where:
+      T0           event time (ticks_us), times are relative to it
+  Class members, values in fixed-point mV or uA as Burst.mv():
+    peak           largest sample
+    final          mean of the last 1/16 of the burst
+    t_peak         time from the event to the peak, usec
+    t_settle       time from the event until the samples stay
+                   within the band around the final value, usec,
+                   None if they never do
+    samples        the burst buffer, overwritten by the next burst'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # settle band, 1/16 of the peak excursion, at least a few
+  # counts of ADC noise
+  BAND_SHIFT = 4
+  MIN_BAND = 8
+
+  def __init__(self, burst, i0):
+    buf = burst.buf
+    n = burst.nsamples
+    ipeak = i0
+    for i in range(i0, n):
+      if buf[i] > buf[ipeak]: ipeak = i
+    ntail = max( n >> 4, 1 )
+    acc = 0
+    for i in range(n - ntail, n):
+      acc += buf[i]
+    final = acc // ntail
+    band = max( abs(buf[ipeak] - final) >> self.BAND_SHIFT, self.MIN_BAND )
+    # last sample outside the band, scanning back from the end
+    iout = n
+    for i in range(n - 1, i0 - 1, -1):
+      if abs(buf[i] - final) > band:
+        iout = i
+        break
+    self.channel = burst.channel
+    self.isense = burst.channel == burst.adc.ISENSE
+    self.peak = burst.mv(ipeak)
+    self.final = burst.scale(final)
+    self.t_peak = burst.time_us(ipeak - i0)
+    if iout == n:   self.t_settle = 0
+    elif iout < n - ntail: self.t_settle = burst.time_us(iout + 1 - i0)
+    else:           self.t_settle = None
+    self.samples = buf
+
+  def __repr__(self):
+    if self.isense:
+      unit = 'mA'
+      scale = 1000
+    else:
+      unit = 'V'
+      scale = 16000
+    settle = 'n/a' if self.t_settle is None else f'{self.t_settle} us'
+    return \
+    f'Peak {self.peak / scale:.3f} {unit} at {self.t_peak} us  ' \
+    f'final {self.final / scale:.3f} {unit}  settle {settle}'
+
+  def __str__(self):
+    return self.__repr__()
+
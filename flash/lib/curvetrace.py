@@ -0,0 +1,167 @@
+from array import array
+import struct
+import time
+import sys
+import st7789py as st7789
+
+class Tracer:
+  __doc__ = \
+  '''I-V curve tracer on the adjustable supply.
+  iv = Tracer(PSU, DISP)
+    where:
+      PSU          power supply class
+      DISP         display class
+  Class functions:
+    trace()        sweeps the output voltage, returns number of points
+      vmin         start voltage, V, default 0.8
+      vmax         end voltage, V, default 5.0
+      limit        current limit, mA, default: as set
+      step         coarse step, mV, default 200
+      plot         plots the curve on the TFT, default False
+    plot()         plots the last trace on the TFT
+    stream()       writes the last trace in binary, args:
+      out          stream, default sys.stdout.buffer
+  Class members:
+    mv, ua         arrays of the points, measured mV and uA
+    n              number of points
+    knee           index of the last point before the limiter took
+                   over, None if it never did
+    elapsed        duration of the last trace, ms'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # The step adapts to the curve: halved when the current changes by
+  # more than 1/8 of the limit between points, doubled (up to the
+  # coarse step) below 1/64. When the output drops more than KNEE_MV
+  # below the setpoint, compared with the previous point, the limiter
+  # has taken over: the limiter is reset and the interval since the
+  # last good point is searched again with half the step, down to
+  # MIN_STEP_MV.
+  MAX_POINTS = 256
+  STEP_MV = 200
+  MIN_STEP_MV = 10
+  KNEE_MV = 50
+  REFINE_SHIFT = 3
+  COARSEN_SHIFT = 6
+  # stream header: magic, point count, knee index (-1 for none),
+  # followed by the mV (u16) and uA (i32) arrays
+  MAGIC = b'BPIV'
+  HEADER = '<4sHh'
+
+  def __init__(self, psu, disp):
+    self.psu = psu
+    self.adc = psu.adc
+    self.disp = disp
+    self.mv = array('H', bytearray(2 * self.MAX_POINTS))
+    self.ua = array('i', bytearray(4 * self.MAX_POINTS))
+    self.n = 0
+    self.knee = None
+    self.elapsed = 0
+
+  # set the output, returns (setpoint - measured, current) in mv16, uA
+  def point( self, mv ):
+    self.psu.voltage( mv / 1000 )
+    mv16 = self.psu.wait_stable()
+    ua = self.adc.isense_ua( self.psu.REG_OVERSAMPLE )
+    self.mv[self.n] = max( mv16 >> 4, 0 )
+    self.ua[self.n] = ua
+    return mv * 16 - mv16, ua
+
+  def trace( self, vmin=0.8, vmax=5.0, limit=None, step=STEP_MV,
+             plot=False ):
+    vsave = self.psu.voltage()
+    if limit is not None: self.psu.current(limit)
+    limit_ua = int( self.psu.current() * 1000 )
+    t0 = time.ticks_ms()
+    self.n = 0
+    self.knee = None
+    self.psu.voltage(vmin)
+    self.psu.reset(wait=False)
+    self.psu.enable()
+    mv = int( vmin * 1000 )
+    mv_max = int( vmax * 1000 )
+    dmv = step
+    last_mv = None
+    last_err = 0
+    last_ua = 0
+    while mv <= mv_max and self.n < self.MAX_POINTS:
+      err, ua = self.point(mv)
+      if last_mv is not None and err - last_err > self.KNEE_MV * 16:
+        if dmv > self.MIN_STEP_MV:
+          # go back to the last good point, finer
+          self.psu.voltage( last_mv / 1000 )
+          self.psu.reset()
+          dmv = max( dmv >> 1, self.MIN_STEP_MV )
+          mv = last_mv + dmv
+          continue
+        # the point past the knee is not kept, the limiter has
+        # cut the output
+        self.knee = self.n - 1
+        break
+      if last_mv is not None:
+        di = abs(ua - last_ua)
+        if di > limit_ua >> self.REFINE_SHIFT:
+          dmv = max( dmv >> 1, self.MIN_STEP_MV )
+        elif di < limit_ua >> self.COARSEN_SHIFT:
+          dmv = min( dmv << 1, step )
+      last_mv = mv
+      last_err = err
+      last_ua = ua
+      self.n += 1
+      mv += dmv
+    self.psu.voltage(vsave)
+    self.psu.reset()
+    self.elapsed = time.ticks_diff( time.ticks_ms(), t0 )
+    if plot: self.plot()
+    return self.n
+
+  def stream( self, out=None ):
+    if out is None: out = sys.stdout.buffer
+    knee = -1 if self.knee is None else self.knee
+    out.write( struct.pack( self.HEADER, self.MAGIC, self.n, knee ) )
+    out.write( memoryview(self.mv)[:self.n] )
+    out.write( memoryview(self.ua)[:self.n] )
+
+  def plot( self ):
+    tft = self.disp.tft
+    self.disp.cls()
+    if self.n < 2: return
+    n = self.n
+    top = self.disp.font.HEIGHT
+    w = tft.width - 1
+    h = tft.height - 1 - top
+    mv0 = self.mv[0]
+    mv1 = max( self.mv[i] for i in range(n) )
+    ua1 = max( max( self.ua[i] for i in range(n) ), 1 )
+    span = max( mv1 - mv0, 1 )
+    tft.hline( 0, tft.height - 1, tft.width, st7789.WHITE )
+    tft.vline( 0, top, h + 1, st7789.WHITE )
+    x0 = y0 = None
+    for i in range(n):
+      x = (self.mv[i] - mv0) * w // span
+      y = top + h - max( self.ua[i], 0 ) * h // ua1
+      if x0 is not None: tft.line( x0, y0, x, y, st7789.YELLOW )
+      x0 = x
+      y0 = y
+    if self.knee is not None:
+      k = self.knee
+      x = (self.mv[k] - mv0) * w // span
+      y = top + h - max( self.ua[k], 0 ) * h // ua1
+      tft.fill_rect( max(x - 2, 0), max(y - 2, top), 5, 5, st7789.RED )
+    self.disp.text( f'{ua1 / 1000:.0f}mA {mv1 / 1000:.2f}V', 0, 0 )
+
+  def strings( self ):
+    out = []
+    for i in range(self.n):
+      mark = '  <== knee' if i == self.knee else ''
+      out.append( f'{self.mv[i] / 1000:6.3f} V  {self.ua[i] / 1000:8.3f} mA{mark}' )
+    out.append( f'{self.n} points in {self.elapsed} ms' )
+    return out
+
+  def __repr__(self):
+    return '\n'.join( self.strings() )
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -14,7 +14,8 @@ class Display:
   def __init__(self, spi, sr, rotation = 0):
     self.sr = sr # shift register
     self.spi = spi
-    self.cs = Pin(PIN_DISPLAY_CS, Pin.OUT)
+    # chip select holds the shared SPI bus for the whole burst
+    self.cs = spi.guard( Pin(PIN_DISPLAY_CS, Pin.OUT, value=1) )
     self.dp = Pin(PIN_DISPLAY_DP, Pin.OUT)
     self.rotation = rotation
     self.width = 240
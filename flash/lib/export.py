@@ -0,0 +1,149 @@
+import struct
+import binascii
+
+# Streaming export of logic captures, as generators of chunks, so a
+# long capture never needs a full text or file copy in RAM. Captures
+# are read through runs(), (value, count) pairs, and rate, as
+# provided by logic.Logic, raw or run-length encoded.
+#
+#   for chunk in export.vcd(io): f.write(chunk)
+#   export.save(export.sigrok(io), 'capture.sr')
+
+CHUNK = 1024
+NBITS = 8
+# VCD identifiers of IO0..IO7
+VCD_IDS = '!"#$%&\'('
+
+def names_of( names ):
+  if names is None: return [ f'IO{i}' for i in range(NBITS) ]
+  return names
+
+def vcd( cap, names=None, module='bp5' ):
+  """VCD text chunks, value changes only, time in ns"""
+  names = names_of(names)
+  rate = cap.rate
+  out = []
+  out.append( '$timescale 1 ns $end\n' )
+  out.append( f'$scope module {module} $end\n' )
+  for i in range(NBITS):
+    out.append( f'$var wire 1 {VCD_IDS[i]} {names[i]} $end\n' )
+  out.append( '$upscope $end\n$enddefinitions $end\n' )
+  size = 0
+  t = 0
+  last = None
+  for val, run in cap.runs():
+    if last is None:
+      changed = 0xff
+      out.append( '#0\n$dumpvars\n' )
+    else:
+      changed = val ^ last
+      out.append( f'#{t * 1_000_000_000 // rate}\n' )
+    for i in range(NBITS):
+      if changed & (1 << i):
+        out.append( f'{(val >> i) & 1}{VCD_IDS[i]}\n' )
+        size += 3
+    if last is None: out.append( '$end\n' )
+    size += 12
+    last = val
+    t += run
+    if size >= CHUNK:
+      yield ''.join(out)
+      out = []
+      size = 0
+  out.append( f'#{t * 1_000_000_000 // rate}\n' )
+  yield ''.join(out)
+
+# sigrok session file: a zip archive, entries stored (no
+# compression) and written in one pass, sizes and CRC in data
+# descriptors after each entry, then the central directory.
+ZIP_LOCAL = 0x04034b50
+ZIP_DESCRIPTOR = 0x08074b50
+ZIP_CENTRAL = 0x02014b50
+ZIP_END = 0x06054b50
+ZIP_VERSION = 20
+ZIP_FLAGS = 0x08 # sizes in the data descriptor
+ZIP_DATE = 0x21  # 1980-01-01
+
+def samples( cap, buf ):
+  """capture samples, one byte each, in chunks of buf"""
+  if not cap.rle:
+    mv = memoryview(cap.buf)
+    for i in range(0, cap.nbytes, len(buf)):
+      yield mv[i:min(i + len(buf), cap.nbytes)]
+    return
+  n = 0
+  for val, run in cap.runs():
+    while run:
+      k = min(run, len(buf) - n)
+      for j in range(n, n + k): buf[j] = val
+      n += k
+      run -= k
+      if n == len(buf):
+        yield buf
+        n = 0
+  if n: yield memoryview(buf)[:n]
+
+def sigrok_metadata( cap, names ):
+  out = [ '[global]\nsigrok version=0.5.1\n\n[device 1]\n' ]
+  out.append( 'capturefile=logic-1\n' )
+  out.append( f'total probes={NBITS}\n' )
+  out.append( f'samplerate={cap.rate} Hz\n' )
+  out.append( 'total analog=0\n' )
+  for i in range(NBITS):
+    out.append( f'probe{i + 1}={names[i]}\n' )
+  out.append( 'unitsize=1\n' )
+  return ''.join(out).encode()
+
+def sigrok( cap, names=None ):
+  """sigrok .sr session file chunks"""
+  names = names_of(names)
+  buf = bytearray(CHUNK)
+  entries = []
+  offset = 0
+  files = (
+    ( b'version', ( b'2', ) ),
+    ( b'metadata', ( sigrok_metadata(cap, names), ) ),
+    ( b'logic-1-1', samples(cap, buf) ),
+  )
+  for name, chunks in files:
+    header = struct.pack( '<IHHHHHIIIHH', ZIP_LOCAL, ZIP_VERSION, ZIP_FLAGS,
+                          0, 0, ZIP_DATE, 0, 0, 0, len(name), 0 )
+    yield header
+    yield name
+    start = offset
+    offset += len(header) + len(name)
+    crc = 0
+    size = 0
+    for chunk in chunks:
+      crc = binascii.crc32(chunk, crc)
+      size += len(chunk)
+      yield chunk
+    crc &= 0xffffffff
+    desc = struct.pack( '<IIII', ZIP_DESCRIPTOR, crc, size, size )
+    yield desc
+    offset += size + len(desc)
+    entries.append( (name, crc, size, start) )
+  cd_start = offset
+  for name, crc, size, start in entries:
+    central = struct.pack( '<IHHHHHHIIIHHHHHII', ZIP_CENTRAL,
+                           ZIP_VERSION, ZIP_VERSION, ZIP_FLAGS, 0, 0,
+                           ZIP_DATE, crc, size, size, len(name),
+                           0, 0, 0, 0, 0, start )
+    yield central
+    yield name
+    offset += len(central) + len(name)
+  yield struct.pack( '<IHHHHIIH', ZIP_END, 0, 0, len(entries),
+                     len(entries), offset - cd_start, cd_start, 0 )
+
+def save( chunks, dest ):
+  """writes chunks to a file name or a stream, returns bytes written"""
+  if isinstance(dest, str):
+    with open(dest, 'wb') as f:
+      return save( chunks, f )
+  n = 0
+  for chunk in chunks:
+    if isinstance(chunk, str): chunk = chunk.encode()
+    n += len(chunk)
+    dest.write(chunk)
+  return n
+
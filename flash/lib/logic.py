@@ -0,0 +1,244 @@
+from machine import Pin, mem32
+import machine
+import micropython
+from micropython import const
+from array import array
+import rp2
+import bp5io
+
+# RP2040 PIO1 registers, see datasheet section 3.7
+PIO1_BASE = 0x50300000
+PIO_FSTAT = PIO1_BASE + 0x004
+PIO_FDEBUG = PIO1_BASE + 0x008
+PIO_RXF0 = PIO1_BASE + 0x020
+FSTAT_RXEMPTY_SHIFT = 8
+FDEBUG_RXSTALL_SHIFT = 0
+DREQ_PIO1_RX0 = 12
+
+# One sample of the 8 I/O bits (GPIO8..15) per PIO cycle, four
+# samples per FIFO word, first sample in the lowest byte.
+@rp2.asm_pio(in_shiftdir=rp2.PIO.SHIFT_RIGHT, autopush=True,
+             push_thresh=32, fifo_join=rp2.PIO.JOIN_RX)
+def pio_sample():
+  in_(pins, 8)
+
+# same, 32 cycles per sample, for rates below the clock divider range
+@rp2.asm_pio(in_shiftdir=rp2.PIO.SHIFT_RIGHT, autopush=True,
+             push_thresh=32, fifo_join=rp2.PIO.JOIN_RX)
+def pio_sample_slow():
+  in_(pins, 8) [31]
+
+# Run-length encoder fed by the PIO FIFO: records of 3 bytes, the
+# sample value then the run length - 1 (u16, little endian). Encodes
+# nwords FIFO words, or stops when buf is full, and returns with the
+# open run kept in info, so a long capture is done in slices and the
+# last run is written by rle_flush(). Arguments in info (viper takes
+# few arguments): buf size, nwords, FSTAT and RXF addresses, RXEMPTY
+# mask, then in/out: bytes used, samples encoded, open run value
+# (RLE_NONE before the first sample) and length (0 once buf is full).
+RLE_NONE = const(256)
+
+@micropython.viper
+def rle_loop(buf: ptr8, info: ptr32):
+  size = info[0]
+  nwords = info[1]
+  stat = ptr32(info[2])
+  fifo = ptr32(info[3])
+  empty = info[4]
+  n = info[5]
+  nsamp = info[6]
+  val = info[7]
+  run = info[8]
+  w = 0
+  while w < nwords:
+    while stat[0] & empty:
+      pass
+    word = fifo[0]
+    w += 1
+    k = 0
+    while k < 32:
+      s = (word >> k) & 0xff
+      k += 8
+      if s == val and run < 65536:
+        run += 1
+        continue
+      if val != RLE_NONE:
+        if n + 3 > size:
+          w = nwords
+          run = 0
+          break
+        buf[n] = val
+        buf[n + 1] = (run - 1) & 0xff
+        buf[n + 2] = (run - 1) >> 8
+        n += 3
+        nsamp += run
+      val = s
+      run = 1
+  info[5] = n
+  info[6] = nsamp
+  info[7] = val
+  info[8] = run
+
+def rle_flush(buf, info):
+  n = info[5]
+  run = info[8]
+  if run > 0 and n + 3 <= info[0]:
+    buf[n] = info[7]
+    buf[n + 1] = (run - 1) & 0xff
+    buf[n + 2] = (run - 1) >> 8
+    info[5] = n + 3
+    info[6] += run
+  info[8] = 0
+
+class Logic(bp5io.BP5IO):
+  __doc__ = \
+  '''Logic analyzer capture on the I/O connector, extends BP5IO.
+  io = Logic( SR, DISP, MEM, DEPTH )
+    where:
+      SR, DISP, MEM  as for BP5IO, see bp5io.BP5IO.__doc__
+      DEPTH        capture buffer size, bytes, default 16384
+  Class functions:
+    capture()      samples the 8 I/O bits, returns the sample count
+      rate         samples per second, default 1_000_000
+      nsamples     samples to take, default: fill the buffer,
+                   with rle RLE_MS of sampling
+      rle          run-length encode while sampling, default False
+    runs()         generator of (value, count) runs of the capture
+    sample(i)      value of sample i
+  Class members:
+    buf            raw samples (one byte each) or RLE records
+    nsamples       samples in the last capture
+    nbytes         bytes of buf used
+    rle            True if buf holds RLE records
+    overrun        True if the encoder fell behind the sampler,
+                   the capture then has gaps'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # Sampling is paced by a PIO state machine reading GPIO8..15.
+  # Raw captures are moved by DMA, one byte per sample. RLE captures
+  # are encoded by a viper loop reading the PIO FIFO: 3 byte records
+  # of value and run length, so slow signals take far more samples
+  # than the buffer has bytes, up to the viper loop speed. The
+  # encoder runs in slices of about RLE_POLL_MS, back in Python in
+  # between so Ctrl-C is seen; the FIFO may overflow at a slice
+  # boundary at the top rates, which shows as overrun.
+  SM_ID = 4 # PIO1, state machine 0
+  DEPTH = 16384
+  DEF_RATE = 1_000_000
+  SLOW_CYCLES = 32
+  RLE_RECORD = 3
+  MAX_RLE_SAMPLES = 0x3ffffffc
+  RLE_MS = 1000
+  RLE_POLL_MS = 50
+
+  def __init__(self, sr, disp, mem=None, depth=DEPTH):
+    super().__init__(sr, disp, mem)
+    self.buf = bytearray(depth & ~3)
+    self.info = array('I', [0] * 9)
+    self.nsamples = 0
+    self.nbytes = 0
+    self.rate = self.DEF_RATE
+    self.rle = False
+    self.overrun = False
+
+  def start_sm( self, rate ):
+    fsys = machine.freq()
+    if rate >= fsys // 65536:
+      prog = pio_sample
+      freq = rate
+    else:
+      prog = pio_sample_slow
+      freq = rate * self.SLOW_CYCLES
+    if freq > fsys or freq < fsys // 65536:
+      raise ValueError(f'Capture rate {rate} out of range')
+    sm = rp2.StateMachine( self.SM_ID, prog, freq=freq,
+                           in_base=Pin(8) )
+    sm.restart()
+    while sm.rx_fifo(): sm.get()
+    # clear the stall flag, write one to clear
+    mem32[PIO_FDEBUG] = 1 << (FDEBUG_RXSTALL_SHIFT + (self.SM_ID & 3))
+    return sm
+
+  def capture( self, rate=DEF_RATE, nsamples=None, rle=False ):
+    if nsamples is None:
+      nsamples = len(self.buf) if not rle else rate * self.RLE_MS // 1000
+    if not rle: nsamples = min( nsamples, len(self.buf) )
+    else: nsamples = min( nsamples, self.MAX_RLE_SAMPLES )
+    nwords = (nsamples + 3) >> 2
+    smi = self.SM_ID & 3
+    self.rate = rate
+    self.rle = rle
+    sm = self.start_sm(rate)
+    if rle:
+      info = self.info
+      info[0] = len(self.buf)
+      info[1] = nwords
+      info[2] = PIO_FSTAT
+      info[3] = PIO_RXF0 + 4 * smi
+      info[4] = 1 << (FSTAT_RXEMPTY_SHIFT + smi)
+      info[5] = 0
+      info[6] = 0
+      info[7] = RLE_NONE
+      info[8] = 0
+      step = max( rate * self.RLE_POLL_MS // 4000, 1 )
+      sm.active(1)
+      while nwords:
+        info[1] = min( step, nwords )
+        nwords -= info[1]
+        rle_loop( self.buf, info )
+        # buffer full
+        if not info[8]: break
+      sm.active(0)
+      rle_flush( self.buf, info )
+      self.nbytes = info[5]
+      self.nsamples = info[6]
+    else:
+      dma = rp2.DMA()
+      ctrl = dma.pack_ctrl( size=2, inc_read=False, inc_write=True,
+                            treq_sel=DREQ_PIO1_RX0 + smi )
+      dma.config( read=PIO_RXF0 + 4 * smi, write=self.buf,
+                  count=nwords, ctrl=ctrl, trigger=True )
+      sm.active(1)
+      while dma.active():
+        pass
+      sm.active(0)
+      dma.close()
+      self.nbytes = nsamples
+      self.nsamples = nsamples
+    self.overrun = bool( mem32[PIO_FDEBUG] &
+                         (1 << (FDEBUG_RXSTALL_SHIFT + smi)) )
+    return self.nsamples
+
+  def runs( self ):
+    buf = self.buf
+    if self.rle:
+      for i in range(0, self.nbytes, self.RLE_RECORD):
+        yield buf[i], buf[i + 1] + (buf[i + 2] << 8) + 1
+      return
+    if not self.nbytes: return
+    val = buf[0]
+    run = 0
+    for i in range(self.nbytes):
+      if buf[i] == val:
+        run += 1
+      else:
+        yield val, run
+        val = buf[i]
+        run = 1
+    yield val, run
+
+  def sample( self, i ):
+    if not self.rle: return self.buf[i]
+    for val, run in self.runs():
+      if i < run: return val
+      i -= run
+    raise IndexError('Sample past the end of the capture')
+
+  def capture_string( self ):
+    mode = 'RLE' if self.rle else 'raw'
+    gaps = '  OVERRUN' if self.overrun else ''
+    return f'Capture {self.nsamples} samples at {self.rate} S/s  ' \
+           f'{mode} {self.nbytes}/{len(self.buf)} bytes{gaps}'
+
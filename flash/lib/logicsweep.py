@@ -0,0 +1,113 @@
+import time
+
+class Sweep:
+  __doc__ = \
+  '''Logic threshold characterization, per-pin VIH / VIL.
+  sweep = Sweep(PSU, IO)
+    where:
+      PSU          power supply class
+      IO           I/O connector class
+  Class functions:
+    run()          finds the thresholds, returns list of (vih, vil)
+                   per I/O bit, in V, None if no transition found
+      vmin         low end of the sweep, V, default 0.8
+      vmax         high end of the sweep, V, default 5.0
+      resolution   threshold resolution, mV, default 10
+      pins         mask of I/O bits to characterize, default 0xff
+      stimulus     function setting the stimulus level in V,
+                   default VREG, psu.voltage(v, wait=True)
+  Class members:
+    results        list of (vih, vil) from the last run
+    trials         stimulus levels tried in the last run
+    elapsed        duration of the last run, ms'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # All pins are searched at once. Each trial sets one stimulus
+  # level, at the middle of the widest open interval, and one port
+  # read narrows the interval of every pin that contains that level.
+  # Inputs have hysteresis, so a VIH trial always approaches the
+  # level from vmin and a VIL trial from vmax.
+
+  def __init__(self, psu, io):
+    self.psu = psu
+    self.io = io
+    self.results = [ None ] * 8
+    self.trials = 0
+    self.elapsed = 0
+
+  def set_vreg( self, volts ):
+    self.psu.voltage( volts, wait=True )
+
+  def trial( self, mv, rising ):
+    self.stimulus( (self.mv_min if rising else self.mv_max) / 1000 )
+    self.stimulus( mv / 1000 )
+    self.trials += 1
+    return self.io.read_port()
+
+  # bisect all pins in mask for the level where they read as at the
+  # far end of the sweep, returns per pin threshold in mV
+  def search( self, mask, far, rising, res ):
+    lo = [ self.mv_min ] * 8
+    hi = [ self.mv_max ] * 8
+    while True:
+      # widest open interval, its middle is the next level
+      wide = res
+      ibit = -1
+      for i in range(8):
+        if mask & (1 << i) and hi[i] - lo[i] > wide:
+          wide = hi[i] - lo[i]
+          ibit = i
+      if ibit < 0: break
+      mv = (lo[ibit] + hi[ibit]) >> 1
+      port = self.trial( mv, rising )
+      # bits now reading the far end value have switched
+      switched = ~(port ^ far)
+      for i in range(8):
+        if mask & (1 << i) and lo[i] < mv < hi[i]:
+          # rising: switched above the threshold, falling: below
+          if bool(switched & (1 << i)) == rising: hi[i] = mv
+          else:                                   lo[i] = mv
+    return [ (lo[i] + hi[i]) >> 1 for i in range(8) ]
+
+  def run( self, vmin=0.8, vmax=5.0, resolution=10, pins=0xff,
+           stimulus=None ):
+    self.stimulus = self.set_vreg if stimulus is None else stimulus
+    vsave = self.psu.voltage()
+    self.mv_min = int( vmin * 1000 )
+    self.mv_max = int( vmax * 1000 )
+    self.trials = 0
+    t0 = time.ticks_ms()
+    # pins reading differently at both ends have a transition
+    self.stimulus(vmin)
+    port_lo = self.io.read_port()
+    self.stimulus(vmax)
+    port_hi = self.io.read_port()
+    mask = (port_lo ^ port_hi) & pins
+    vih = self.search( mask, port_hi, True, resolution )
+    vil = self.search( mask, port_lo, False, resolution )
+    self.results = []
+    for i in range(8):
+      if mask & (1 << i):
+        self.results.append( (vih[i] / 1000, vil[i] / 1000) )
+      else:
+        self.results.append( None )
+    self.elapsed = time.ticks_diff( time.ticks_ms(), t0 )
+    if stimulus is None: self.stimulus(vsave)
+    return self.results
+
+  def strings( self ):
+    out = []
+    for i, r in enumerate(self.results):
+      if r is None: out.append( f'IO{i}:  no transition' )
+      else:         out.append( f'IO{i}:  VIH {r[0]:5.3f} V  VIL {r[1]:5.3f} V' )
+    out.append( f'{self.trials} trials in {self.elapsed} ms' )
+    return out
+
+  def __repr__(self):
+    return '\n'.join( self.strings() )
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -0,0 +1,137 @@
+from machine import Timer
+from array import array
+import micropython
+import time
+
+class Watchdog:
+  __doc__ = \
+  '''Software over-current watchdog for the adjustable supply.
+  ocp = Watchdog(PSU)
+    where:
+      PSU          power supply class
+  Class functions:
+    start()        starts watching, args:
+      limit        trip threshold, mA
+      rate         samples per second, default 5000
+      hard         sample from a hard interrupt, default True
+    stop()         stops watching
+    rearm()        restores the limiter, resets and re-enables VREG
+    log()          trip log, one line per trip
+  Class members:
+    tripped        True after a trip, until rearm()
+    ntrips         number of trips since start()
+    skipped        samples skipped, ADC claimed by other code'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # A trip works in two stages. From the sampling interrupt, the
+  # hardware current limit PWM is pulled to zero, which makes the
+  # limiter cut VREG within a PWM period, without touching the SPI
+  # bus (the interrupted code may be in the middle of a transfer).
+  # A scheduled callback then sets CURRENT_EN through the shift
+  # register, so the output stays off after the limit is restored.
+  # Both latencies are measured from the over-threshold sample.
+  #
+  # The hard interrupt can land in the middle of a foreground
+  # conversion (Analog.read(), oversample(), scan(), ...), and
+  # read_u16() sets AINSEL, so sampling then would corrupt the
+  # foreground reading. The sample is skipped instead while the ADC
+  # is claimed (Analog.claims), at most one conversion late for
+  # short reads. A Burst claims the ADC from arm() to halt(): the
+  # watchdog is blind for the burst (about 10 ms for an inrush
+  # capture at 100 kS/s), and likewise while core 1 acquisition
+  # runs. The hardware current limiter still protects the output,
+  # and the burst itself records the current.
+  LOG_SIZE = 16
+
+  def __init__(self, psu):
+    self.psu = psu
+    self.adc = psu.adc
+    self.timer = None
+    self.tripped = False
+    self.ntrips = 0
+    self.skipped = 0
+    self.threshold = 0xffff
+    self.t_sample = 0
+    self.t_cut = 0
+    self.sample = 0
+    self.shutdown_ref = self.shutdown # no allocation in the interrupt
+    # trip log, preallocated: time (ms), reading (raw counts),
+    # limiter cut and shift register commit latencies (us)
+    self.log_ms = array('I', [0] * self.LOG_SIZE)
+    self.log_raw = array('H', [0] * self.LOG_SIZE)
+    self.log_cut_us = array('I', [0] * self.LOG_SIZE)
+    self.log_off_us = array('I', [0] * self.LOG_SIZE)
+
+  def start( self, limit, rate=5000, hard=True ):
+    self.stop()
+    # threshold in raw read_u16 counts, using the calibration
+    ich = self.adc.ISENSE
+    counts = (limit - self.adc.voffset[ich]) / self.adc.vscale[ich]
+    self.threshold = min( max( int(counts), 0 ), 0xffff )
+    self.limit = limit
+    self.read_u16 = self.adc.iadc.read_u16
+    self.duty_iadj = self.psu.pwm_iadj.duty_u16()
+    self.tripped = False
+    self.ntrips = 0
+    self.skipped = 0
+    self.timer = Timer(freq=rate, mode=Timer.PERIODIC,
+                       callback=self.check, hard=hard)
+
+  def stop( self ):
+    if self.timer is not None:
+      self.timer.deinit()
+      self.timer = None
+
+  def check( self, timer=None ):
+    if self.tripped: return
+    if self.adc.claims:
+      self.skipped += 1
+      return
+    raw = self.read_u16()
+    if raw <= self.threshold: return
+    t_sample = time.ticks_us()
+    self.psu.pwm_iadj.duty_u16(0)
+    self.t_cut = time.ticks_us()
+    self.t_sample = t_sample
+    self.sample = raw
+    self.tripped = True
+    micropython.schedule(self.shutdown_ref, None)
+
+  def shutdown( self, arg=None ):
+    self.psu.disable()
+    t_off = time.ticks_us()
+    i = self.ntrips % self.LOG_SIZE
+    self.log_ms[i] = time.ticks_ms()
+    self.log_raw[i] = self.sample
+    self.log_cut_us[i] = time.ticks_diff(self.t_cut, self.t_sample)
+    self.log_off_us[i] = time.ticks_diff(t_off, self.t_sample)
+    self.ntrips += 1
+
+  def rearm( self ):
+    self.psu.pwm_iadj.duty_u16(self.duty_iadj)
+    self.psu.reset()
+    self.psu.enable()
+    self.tripped = False
+
+  def log( self ):
+    out = []
+    first = max(0, self.ntrips - self.LOG_SIZE)
+    ich = self.adc.ISENSE
+    for n in range(first, self.ntrips):
+      i = n % self.LOG_SIZE
+      ma = self.log_raw[i] * self.adc.vscale[ich] + self.adc.voffset[ich]
+      out.append(
+        f'Trip {n}: {self.log_ms[i]:>8d} ms  {ma:6.1f} mA  '
+        f'cut {self.log_cut_us[i]} us  off {self.log_off_us[i]} us')
+    return out
+
+  def __repr__(self):
+    state = 'watching' if self.timer is not None else 'stopped'
+    if self.tripped: state = 'TRIPPED'
+    return f'OCP {state}  trips {self.ntrips}  skipped {self.skipped}'
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -1,4 +1,6 @@
-from machine import Pin, PWM
+from machine import Pin, PWM, Timer
+from array import array
+import struct
 import time
 from bp5pins import *
 
@@ -35,24 +37,58 @@ from bp5pins import *
 class Power:
   __doc__ = \
   '''Adjustable Power Supply management class.
-  psu = Power(SR, ADC)
+  psu = Power(SR, ADC, BURST)
     where:
       SR           shift register class
       ADC          analog to digital converter class
+      BURST        ADC burst capture class, optional
   Class functions:
     enable()             enable VREG output
+    enable(capture=True) enable and capture the inrush, returns waveform
+      channel              ADC channel, default current sense
+      rate                 samples per second, default 100_000
     disable()            disable VREG output
-    reset()              resets current limiter
+    reset()              resets current limiter, waits for VREG to settle
+      wait                 wait for VREG to settle, default True
     enable_override()    enable current limiter override
     disable_override()   disable current limiter override
     voltage()            get voltage, V
     voltage(voltage)     set voltage, V
+    voltage(v, closed=True)  set voltage, closed loop via ADC
+    voltage(v, wait=True)    set voltage, wait for VREG to settle
+    wait_stable()        waits until VREG settles, returns the mean mv16,
+                         time taken in settle_ms, settled False on timeout
+      tolerance            band around the mean of the readings, mV, default 2
+      timeout              ms, default 250
+      n                    consecutive readings in band, at least, default 3
+      dwell                ms the readings span, at least, default 10
+    regulate(voltage)    closed loop setpoint, returns measured V
+      tolerance            band around setpoint, mV, default 5
+      maxiter              max correction steps, default 8
+    track(enable)        background closed loop tracking on / off
+    meter(enable)        background energy meter on / off
+      period_ms            sampling period, default 100
+    meter_reset()        zeroes the energy meter
+    snapshot()           energy meter readings, tuple of integers:
+                           uptime ms, metered ms, samples, uWh, uAs,
+                           average uW, peak uW
+    pack_snapshot()      same, packed in 36 bytes
+    energy()             show energy meter readings
     current()            get current, mA
     current(current)     set current, mA
     measure()            measure voltage (V) and current (mA)
     setpoint()           show voltage (V) and current (mA) setpoint
     control()            show control bits ENABLE and OVERRIDE
-    ramp()               ramps power supply for calibration testing'''
+    ramp()               ramps power supply, builds calibration table
+      save                 stores the table on the flash drive, default True
+      verbose              prints each point, default True
+    load_table()         loads the stored calibration tables
+    clear_table()        back to the linear model
+    calibrate_current(ohms)  calibrates the current limit, known load
+      currents             load currents to try, mA
+      save                 stores the table on the flash drive, default True
+      verbose              prints each point, default True
+    clear_current_cal()  back to the nominal current limit scale'''
 
   def help(self):
     print(self.__doc__)
@@ -86,34 +122,237 @@ class Power:
   DEF_VOLTAGE = 5.0
   DEF_CURRENT = 250
 
-  def __init__(self, sr, adc):
+  # inrush capture at enable(capture=True), 1024 samples is ~10 ms
+  CAPTURE_RATE = 100_000
+
+  # Closed loop regulation. VREG_OUT is read with the oversampled
+  # integer ADC path, fixed-point mV with 4 fraction bits (mv16).
+  REG_OVERSAMPLE = 64
+  REG_TOLERANCE_MV = 5
+  REG_MAX_ITER = 8
+  # model slope, PWM duty counts per mv16, negative:
+  # raising the duty lowers the output
+  REG_SLOPE = -VSCALE_FACTOR_COUNTS / (VSCALE_FACTOR_VOLTS * 16000)
+  # background tracking, PI gains as shifts of the mv16 error,
+  # about 1/2 and 1/4 of the model slope
+  TRACK_PERIOD_MS = 50
+  TRACK_DEADBAND = 16 # 1 mV
+  TRACK_KP_SHIFT = 1
+  TRACK_KI_SHIFT = 2
+  TRACK_MAX_INTEGRAL = 64 * 1024
+  # energy meter, VREG_OUT (mv16) and current sense (uA) sampled at
+  # a fixed period and integrated (trapezoid) in integer accumulators.
+  # Everything in the tick stays in small int range (30 bits), so it
+  # never allocates: power is mV * (uA >> 3) / 125, with readings
+  # clamped well above the supply's range, and the accumulated
+  # energy (uW * ms) and charge (uA * ms) carry into whole units,
+  # uWh then mWh, and mAs. dt is taken in slices of METER_MAX_DT.
+  METER_PERIOD_MS = 100
+  METER_OVERSAMPLE = 16
+  METER_MAX_MV = 8000
+  METER_MAX_UA = 600_000
+  METER_MAX_DT = 128 # ms, 4.8 W * 128 ms + 1 uWh < 2**30 uW * ms
+  UW_MS_PER_UWH = 3_600_000
+  UA_MS_PER_MAS = 1_000_000
+  SNAPSHOT_FORMAT = '<IIIQQII'
+
+  # Calibrated PWM duty vs measured output table, built by ramp().
+  # Kept sorted by increasing mV (decreasing duty) for bisection.
+  # File: magic 'BPVR', point count, then (duty u16, mv16 i32) pairs
+  VREG_CAL_FILE = 'vreg.cal'
+  VREG_CAL_MAGIC = b'BPVR'
+  RAMP_POINTS = 33
+  # at the top of the ramp the regulator runs out of headroom and
+  # the output flattens; points inside this band are dropped
+  RAMP_FLAT_MV = 10
+
+  # Settle detection, see wait_stable()
+  SETTLE_MV = 2
+  SETTLE_COUNT = 3
+  SETTLE_DWELL_MS = 10
+  SETTLE_TIMEOUT_MS = 250
+  RESET_PULSE_MS = 10
+
+  # Current limit correction table, built by calibrate_current() with
+  # a known resistive load: limiter PWM duty vs measured trip current,
+  # both increasing. File as for VREG, (duty u16, uA i32) pairs.
+  ILIM_CAL_FILE = 'ilim.cal'
+  ILIM_CAL_MAGIC = b'BPIL'
+  ILIM_CAL_MA = ( 25, 50, 75, 100, 150, 200, 300, 400 )
+  ILIM_BISECT = 12 # steps, 16 duty counts resolution
+
+  def vout2duty( self, vout ):
+    tmv = self.table_mv
+    if tmv is None:
+      return int( self.VSCALE_FACTOR_COUNTS * self.vout2vpwm(vout) )
+    mv16 = int( vout * 16000 )
+    # bisect for the segment holding mv16, clamped to the ends
+    lo = 0
+    hi = len(tmv) - 1
+    if mv16 <= tmv[lo]: return self.table_duty[lo]
+    if mv16 >= tmv[hi]: return self.table_duty[hi]
+    while hi - lo > 1:
+      mid = (lo + hi) >> 1
+      if tmv[mid] <= mv16: lo = mid
+      else:                hi = mid
+    d0 = self.table_duty[lo]
+    d1 = self.table_duty[hi]
+    return d0 + (d1 - d0) * (mv16 - tmv[lo]) // (tmv[hi] - tmv[lo])
+
+  def duty2vout( self, df16 ):
+    tduty = self.table_duty
+    if tduty is None:
+      return self.vpwm2vout( df16 / self.VSCALE_FACTOR_COUNTS )
+    # duty decreases along the table
+    lo = 0
+    hi = len(tduty) - 1
+    if df16 >= tduty[lo]: return self.table_mv[lo] / 16000
+    if df16 <= tduty[hi]: return self.table_mv[hi] / 16000
+    while hi - lo > 1:
+      mid = (lo + hi) >> 1
+      if tduty[mid] >= df16: lo = mid
+      else:                  hi = mid
+    v0 = self.table_mv[lo]
+    v1 = self.table_mv[hi]
+    d0 = tduty[lo]
+    return (v0 + (v1 - v0) * (d0 - df16) / (d0 - tduty[hi])) / 16000
+
+  # Calibration table files: magic, point count, then
+  # (duty u16, value i32) pairs
+  def read_table( self, filename, magic ):
+    try:
+      with open(filename, 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None, None
+    # a truncated file is as good as none
+    if len(data) < 5 or data[0:4] != magic: return None, None
+    n = data[4]
+    if len(data) != 5 + 6*n: return None, None
+    duties = array('H', [0] * n)
+    values = array('i', [0] * n)
+    for i in range(n):
+      duties[i], values[i] = struct.unpack_from('<Hi', data, 5 + 6*i)
+    return duties, values
+
+  def write_table( self, filename, magic, duties, values ):
+    out = bytearray(magic)
+    out.append( len(values) )
+    for i in range(len(values)):
+      out.extend( struct.pack('<Hi', duties[i], values[i]) )
+    with open(filename, 'wb') as f:
+      f.write(out)
+
+  # The bisection and interpolation need strictly monotonic tables:
+  # values increasing, duties increasing (direction 1) or decreasing
+  # (direction -1). Equal neighbours would divide by zero.
+  def monotonic( self, duties, values, direction ):
+    if values is None or len(values) < 2: return False
+    if len(duties) != len(values): return False
+    for i in range(1, len(values)):
+      if values[i] <= values[i-1]: return False
+      if (duties[i] - duties[i-1]) * direction <= 0: return False
+    return True
+
+  # tables failing the check, e.g. from an older ramp(), are ignored
+  def load_table( self ):
+    duties, mvs = self.read_table( self.VREG_CAL_FILE, self.VREG_CAL_MAGIC )
+    if not self.monotonic( duties, mvs, -1 ): duties, mvs = None, None
+    self.table_duty, self.table_mv = duties, mvs
+    duties, uas = self.read_table( self.ILIM_CAL_FILE, self.ILIM_CAL_MAGIC )
+    if not self.monotonic( duties, uas, 1 ): duties, uas = None, None
+    self.ilim_duty, self.ilim_ua = duties, uas
+    return self.table_mv is not None
+
+  def save_table( self ):
+    if not self.monotonic( self.table_duty, self.table_mv, -1 ):
+      raise ValueError('VREG calibration table is not monotonic')
+    self.write_table( self.VREG_CAL_FILE, self.VREG_CAL_MAGIC,
+                      self.table_duty, self.table_mv )
+
+  def clear_table( self ):
+    self.table_duty = None
+    self.table_mv = None
+
+  def vreg_duty( self, df16 ):
+    if df16 > self.MAX_DUTY_COUNTS - 1: df16 = self.MAX_DUTY_COUNTS - 1
+    if df16 < 0: df16 = 0
+    self.pwm_vreg.duty_u16(df16)
+    return df16
+
+  def measure_mv16( self ):
+    return self.adc.oversample( self.adc.VREG_OUT, self.REG_OVERSAMPLE )
+
+  def __init__(self, sr, adc, burst=None):
     self.pwm_vreg = PWM( Pin(PIN_VREG_ADJUST),    freq=10000, duty_u16=0)
     self.pwm_iadj = PWM( Pin(PIN_CURRENT_ADJUST), freq=10000, duty_u16=0)
     self.sr = sr
     self.adc = adc
-    self.sr.set_bits(self.sr.MASK_CURRENT_EN)
-    self.sr.clr_bits(self.sr.MASK_CURRENT_RESET)
-    self.sr.clr_bits(self.sr.MASK_CURRENT_EN_OVERRIDE)
-    self.sr.send()
-    self.voltage(self.DEF_VOLTAGE)
-    self.current(self.DEF_CURRENT)
-    self.enable()
-
-
-  def enable( self ):
-    self.sr.clr_bits(self.sr.MASK_CURRENT_EN)
-    self.sr.send()
+    self.burst = burst
+    self.target = None # closed loop setpoint, mv16
+    self.duty_ff = 0   # duty found by regulate()
+    self.integral = 0
+    self.iterations = 0
+    self.tracker = None
+    self.settle_ms = 0
+    self.settled = True
+    self.meter_timer = None
+    self.meter_reset()
+    self.table_duty = None
+    self.table_mv = None
+    self.ilim_duty = None
+    self.ilim_ua = None
+    self.load_table()
+    # one shift register commit for the whole setup
+    with self.sr:
+      self.sr.set_bits(self.sr.MASK_CURRENT_EN)
+      self.sr.clr_bits(self.sr.MASK_CURRENT_RESET)
+      self.sr.clr_bits(self.sr.MASK_CURRENT_EN_OVERRIDE)
+      self.sr.send()
+      self.voltage(self.DEF_VOLTAGE)
+      self.current(self.DEF_CURRENT)
+      self.enable()
+
+
+  # With capture, the burst is armed first and triggered while the
+  # SPI bus is already held, right before the CURRENT_EN commit.
+  # Waveform times count from the end of that commit. There is no
+  # inrush to capture if VREG is already on, that is refused.
+  def enable( self, capture=False, channel=None, rate=CAPTURE_RATE ):
+    if not capture:
+      self.sr.clr_bits(self.sr.MASK_CURRENT_EN)
+      self.sr.send()
+      return None
+    if self.burst is None:
+      raise RuntimeError('Inrush capture needs a Burst, see Power()')
+    if self.sr.depth:
+      raise RuntimeError('Inrush capture inside a shift register transaction')
+    if not self.sr.outputs & self.sr.MASK_CURRENT_EN:
+      raise RuntimeError('Inrush capture with VREG already enabled, disable() first')
+    if channel is None: channel = self.adc.ISENSE
+    # arm() commits the MUX select for MUX channels, so CURRENT_EN
+    # is only cleared once the bus is held for the real commit
+    self.burst.arm( channel, rate )
+    with self.sr.spi:
+      self.sr.clr_bits(self.sr.MASK_CURRENT_EN)
+      self.burst.trigger()
+      # committed even if nothing else changed, t_commit must be real
+      self.sr.send(force=True)
+      t_commit = time.ticks_us()
+    self.burst.wait()
+    return self.burst.waveform(t_commit)
 
   def disable( self ):
     self.sr.set_bits(self.sr.MASK_CURRENT_EN)
     self.sr.send()
 
-  def reset( self ):
+  def reset( self, wait=True ):
     self.sr.set_bits(self.sr.MASK_CURRENT_RESET)
     self.sr.send()
-    time.sleep_ms(10)
+    time.sleep_ms(self.RESET_PULSE_MS)
     self.sr.clr_bits(self.sr.MASK_CURRENT_RESET)
     self.sr.send()
+    if wait: self.wait_stable()
 
   def enable_override( self ):
     self.sr.set_bits(self.sr.MASK_CURRENT_EN_OVERRIDE)
@@ -124,33 +363,254 @@ class Power:
     self.sr.send()
 
 
-  def voltage( self, voltage=None ):
+  def voltage( self, voltage=None, closed=False, wait=False ):
     if voltage is not None:
       if voltage > self.MAX_VOUT: voltage = self.MAX_VOUT
       if voltage < 0: voltage = 0
-      vpwm = self.vout2vpwm(voltage) 
-      df16 = int( self.VSCALE_FACTOR_COUNTS * vpwm )
-      if df16 > self.MAX_DUTY_COUNTS: df16 = self.MAX_DUTY_COUNTS
-      if df16 < 0: df16 = 0
-      self.pwm_vreg.duty_u16(df16)
+      if closed:
+        self.regulate(voltage)
+      else:
+        self.duty_ff = self.vreg_duty( self.vout2duty(voltage) )
+        self.target = int( voltage * 16000 )
+        self.integral = 0
+        if wait: self.wait_stable()
     # return voltage setpoint
-    df16 = self.pwm_vreg.duty_u16()
-    vpwm = df16 / self.VSCALE_FACTOR_COUNTS
-    vout = self.vpwm2vout( vpwm )
-    return vout
+    return self.duty2vout( self.pwm_vreg.duty_u16() )
+
+  # Closed loop setpoint: start from the model duty, then secant
+  # steps on the measured output, first one with the model slope.
+  # Stops inside the tolerance band or after maxiter steps.
+  def regulate( self, voltage, tolerance=REG_TOLERANCE_MV,
+                maxiter=REG_MAX_ITER ):
+    target = int( voltage * 16000 )
+    tol = tolerance * 16
+    slope = self.REG_SLOPE
+    d0 = self.vreg_duty( self.vout2duty(voltage) )
+    v0 = self.wait_stable()
+    self.iterations = 0
+    while abs(target - v0) > tol and self.iterations < maxiter:
+      self.iterations += 1
+      d1 = self.vreg_duty( d0 + int( (target - v0) * slope ) )
+      v1 = self.wait_stable()
+      # secant update, unless noise gives a slope of the wrong sign
+      if d1 != d0 and v1 != v0:
+        secant = (d1 - d0) / (v1 - v0)
+        if secant < 0: slope = secant
+      d0 = d1
+      v0 = v1
+    self.target = target
+    self.duty_ff = d0
+    self.integral = 0
+    return v0 / 16000
+
+  # Background tracking: a timer compares VREG_OUT with the setpoint
+  # and applies a PI correction on top of the regulate() duty, so the
+  # output follows load changes.
+  def track( self, enable=True, period_ms=TRACK_PERIOD_MS ):
+    if self.tracker is not None:
+      self.tracker.deinit()
+      self.tracker = None
+    if enable:
+      if self.target is None: self.target = int( self.voltage() * 16000 )
+      self.integral = 0
+      self.tracker = Timer(period=period_ms, mode=Timer.PERIODIC,
+                           callback=self.track_step)
+
+  def track_step( self, timer=None ):
+    # shift register in use by the interrupted code, try next tick
+    if self.sr.held(): return
+    err = self.target - self.measure_mv16()
+    if -self.TRACK_DEADBAND <= err <= self.TRACK_DEADBAND: return
+    integral = self.integral + err
+    if integral > self.TRACK_MAX_INTEGRAL: integral = self.TRACK_MAX_INTEGRAL
+    if integral < -self.TRACK_MAX_INTEGRAL: integral = -self.TRACK_MAX_INTEGRAL
+    self.integral = integral
+    # duty goes down to raise the output
+    self.vreg_duty( self.duty_ff - (err >> self.TRACK_KP_SHIFT)
+                    - (integral >> self.TRACK_KI_SHIFT) )
+
+  def meter( self, enable=True, period_ms=METER_PERIOD_MS ):
+    if self.meter_timer is not None:
+      self.meter_timer.deinit()
+      self.meter_timer = None
+    if enable:
+      self.t_last = None
+      self.meter_timer = Timer(period=period_ms, mode=Timer.PERIODIC,
+                               callback=self.meter_step)
+
+  def meter_reset( self ):
+    self.energy_frac = 0 # uW * ms, below 1 uWh
+    self.energy_uwh = 0  # below 1 mWh
+    self.energy_mwh = 0
+    self.charge_frac = 0 # uA * ms, below 1 mAs
+    self.charge_mas = 0
+    self.metered_ms = 0  # below 1 s
+    self.metered_s = 0
+    self.samples = 0
+    self.skipped = 0
+    self.peak_uw = 0
+    self.p_last = 0
+    self.i_last = 0
+    self.t_last = None
+
+  def meter_step( self, timer=None ):
+    # shift register in use by the interrupted code, try next tick
+    if self.sr.held():
+      self.skipped += 1
+      return
+    n = self.METER_OVERSAMPLE
+    mv16 = self.adc.oversample( self.adc.VREG_OUT, n )
+    ua = self.adc.isense_ua( n )
+    t = time.ticks_ms()
+    mv = mv16 >> 4
+    if mv < 0: mv = 0
+    if mv > self.METER_MAX_MV: mv = self.METER_MAX_MV
+    if ua < 0: ua = 0
+    if ua > self.METER_MAX_UA: ua = self.METER_MAX_UA
+    uw = (mv * (ua >> 3)) // 125
+    if uw > self.peak_uw: self.peak_uw = uw
+    if self.t_last is not None:
+      self.meter_integrate( (uw + self.p_last) >> 1, (ua + self.i_last) >> 1,
+                            time.ticks_diff( t, self.t_last ) )
+    self.t_last = t
+    self.p_last = uw
+    self.i_last = ua
+    self.samples += 1
+
+  # add average power p (uW) and current i (uA) over dt ms
+  def meter_integrate( self, p, i, dt ):
+    ms = self.metered_ms + dt
+    if ms >= 1000:
+      self.metered_s += ms // 1000
+      ms %= 1000
+    self.metered_ms = ms
+    while dt > 0:
+      step = dt if dt < self.METER_MAX_DT else self.METER_MAX_DT
+      dt -= step
+      e = self.energy_frac + p * step
+      if e >= self.UW_MS_PER_UWH:
+        uwh = self.energy_uwh + e // self.UW_MS_PER_UWH
+        e %= self.UW_MS_PER_UWH
+        if uwh >= 1000:
+          self.energy_mwh += uwh // 1000
+          uwh %= 1000
+        self.energy_uwh = uwh
+      self.energy_frac = e
+      q = self.charge_frac + i * step
+      if q >= self.UA_MS_PER_MAS:
+        self.charge_mas += q // self.UA_MS_PER_MAS
+        q %= self.UA_MS_PER_MAS
+      self.charge_frac = q
+
+  # joins the carried parts, long ints are fine out here
+  def snapshot( self ):
+    ms = self.metered_s * 1000 + self.metered_ms
+    uwh = self.energy_mwh * 1000 + self.energy_uwh
+    uas = self.charge_mas * 1000 + self.charge_frac // 1000
+    avg = (uwh * self.UW_MS_PER_UWH + self.energy_frac) // ms if ms else 0
+    return ( time.ticks_ms(), ms, self.samples, uwh, uas, avg, self.peak_uw )
+
+  def pack_snapshot( self ):
+    return struct.pack( self.SNAPSHOT_FORMAT, *self.snapshot() )
+
+  def energy( self ):
+    t, ms, n, uwh, uas, avg, peak = self.snapshot()
+    return f'Energy: {uwh / 1000:.3f} mWh  {uas / 1000:.3f} mAs  ' \
+           f'avg {avg / 1000:.1f} mW  peak {peak / 1000:.1f} mW  ' \
+           f'over {ms / 1000:.1f} s  ({n} samples, {self.skipped} skipped)'
+
+  # piecewise linear through (xs, ys), extrapolating the end segments
+  def interp( self, xs, ys, x ):
+    lo = 0
+    hi = len(xs) - 1
+    if x <= xs[lo]:   hi = 1
+    elif x >= xs[hi]: lo = hi - 1
+    while hi - lo > 1:
+      mid = (lo + hi) >> 1
+      if xs[mid] <= x: lo = mid
+      else:            hi = mid
+    return ys[lo] + (ys[hi] - ys[lo]) * (x - xs[lo]) / (xs[hi] - xs[lo])
+
+  def ma2duty( self, current ):
+    if current > self.MAX_IADJ_MA: current = self.MAX_IADJ_MA
+    if current < 0: current = 0
+    if self.ilim_ua is None:
+      df16 = int( current * self.ISCALE_FACTOR )
+    else:
+      df16 = int( self.interp( self.ilim_ua, self.ilim_duty, current * 1000 ) )
+    if df16 > self.MAX_DUTY_COUNTS - 1: df16 = self.MAX_DUTY_COUNTS - 1
+    if df16 < 0: df16 = 0
+    return df16
 
   def current( self, current=None ):
     if current is not None:
-      if current > self.MAX_IADJ_MA: current = self.MAX_IADJ_MA
-      if current < 0: current = 0
-      df16 = int( current * self.ISCALE_FACTOR )
-      if df16 > self.MAX_DUTY_COUNTS: df16 = self.MAX_DUTY_COUNTS
-      if df16 < 0: df16 = 0
-      self.pwm_iadj.duty_u16(df16)
+      self.pwm_iadj.duty_u16( self.ma2duty(current) )
     # return current setpoint
     df16 = self.pwm_iadj.duty_u16()
-    iadj = df16 / self.ISCALE_FACTOR
-    return iadj
+    if self.ilim_ua is None:
+      return df16 / self.ISCALE_FACTOR
+    return max( self.interp( self.ilim_duty, self.ilim_ua, df16 ) / 1000, 0 )
+
+  # For each load current (set through the output voltage across the
+  # known load), bisect the limiter duty between tripping and holding,
+  # with CURRENT_RESET before each trial. A trip shows as VREG_OUT
+  # collapsing below half of its untripped value.
+  # VREG is left enabled or not as it was found, the bisection
+  # itself needs it on.
+  def calibrate_current( self, ohms, currents=ILIM_CAL_MA,
+                         save=True, verbose=True ):
+    dsave = self.pwm_vreg.duty_u16()
+    isave = self.pwm_iadj.duty_u16()
+    was_off = self.sr.pending & self.sr.MASK_CURRENT_EN
+    top = self.MAX_DUTY_COUNTS - 1
+    duties = []
+    uas = []
+    t0 = time.ticks_ms()
+    try:
+      for ma in currents:
+        vout = ma * ohms / 1000
+        if vout < self.MIN_VOUT or vout > self.MAX_VOUT: continue
+        self.pwm_iadj.duty_u16(top)
+        self.voltage(vout)
+        self.reset(wait=False)
+        self.enable()
+        mv16 = self.wait_stable()
+        ua = self.adc.isense_ua( self.REG_OVERSAMPLE )
+        lo = 0    # trips
+        hi = top  # holds
+        for i in range(self.ILIM_BISECT):
+          mid = (lo + hi) >> 1
+          self.pwm_iadj.duty_u16(mid)
+          self.reset(wait=False)
+          if self.wait_stable() < (mv16 >> 1): lo = mid
+          else:                                hi = mid
+        if verbose:
+          print(f'Load {ua/1000:>6.1f} mA  trips at duty {hi:>5d}  '
+                f'nominal {hi/self.ISCALE_FACTOR:>6.1f} mA')
+        if uas and ( ua <= uas[-1] or hi <= duties[-1] ): continue
+        duties.append(hi)
+        uas.append(ua)
+    finally:
+      self.pwm_iadj.duty_u16(isave)
+      self.vreg_duty(dsave)
+      if was_off:
+        self.disable()
+        self.reset(wait=False)
+      else:
+        self.reset()
+    if verbose:
+      print(f'Calibration took {time.ticks_diff(time.ticks_ms(), t0)} ms')
+    if len(uas) < 2:
+      raise RuntimeError('Current limit calibration needs two or more points')
+    self.ilim_duty = array('H', duties)
+    self.ilim_ua = array('i', uas)
+    if save:
+      self.write_table( self.ILIM_CAL_FILE, self.ILIM_CAL_MAGIC,
+                        self.ilim_duty, self.ilim_ua )
+
+  def clear_current_cal( self ):
+    self.ilim_duty = None
+    self.ilim_ua = None
 
   def measure(self):
     meas_voltage = self.adc.read( self.adc.VREG_OUT )
@@ -177,26 +637,88 @@ class Power:
   def __str__(self):
     return self.__repr__()
 
-  def ramp(self):
-    # ramp Vpwm from 0 to 3.3 steps of 0.1 V
-    vsave = self.voltage()
+  # Ramp Vpwm from 0 to 3.2 V in steps of 0.1 V, measuring the output
+  # at each step as soon as it has settled, and keep the results as
+  # the calibration table used by voltage(). Points on the flat top
+  # end are dropped; any other reading out of order rejects the ramp
+  # and the previous table is kept.
+  def ramp(self, save=True, verbose=True):
+    dsave = self.pwm_vreg.duty_u16()
     isave = self.current()
-    for i in range(33):
+    n = self.RAMP_POINTS
+    duties = array('H', [0] * n)
+    mvs = array('i', [0] * n)
+    t0 = time.ticks_ms()
+    for i in range(n):
       # calculate Vpwm and corresponding Vout
       vpwm = float(i)/10.0
       vout = self.vpwm2vout(vpwm)
       # set the PWM voltage
-      df16 = int( self.VSCALE_FACTOR_COUNTS * vpwm )
-      if df16 > self.MAX_DUTY_COUNTS: df16 = self.MAX_DUTY_COUNTS
-      if df16 < 0: df16 = 0
-      self.pwm_vreg.duty_u16(df16)
-      time.sleep_ms(250)
-      # read the actual voltage
-      vadc = self.adc.read(self.adc.VREG_OUT)
-      print(f'Vpwm {vpwm:>5.2f}  Vout {vout:>5.2f}  Vadc {vadc:>5.2f}')
+      df16 = self.vreg_duty( int( self.VSCALE_FACTOR_COUNTS * vpwm ) )
+      mv16 = self.wait_stable()
+      # table runs by increasing mV, decreasing duty
+      duties[n-1-i] = df16
+      mvs[n-1-i] = mv16
+      if verbose:
+        print(f'Vpwm {vpwm:>5.2f}  Vout {vout:>5.2f}  Vadc {mv16/16000:>5.3f}')
+    if verbose:
+      print(f'Ramp took {time.ticks_diff(time.ticks_ms(), t0)} ms')
     # reset the previous voltage / current
-    self.voltage(vsave)
+    self.vreg_duty(dsave)
     self.current(isave)
+    top = n
+    for i in range(1, n):
+      if mvs[i] <= mvs[i-1]:
+        top = i
+        break
+    if top < n:
+      flat = mvs[top-1] + self.RAMP_FLAT_MV * 16
+      for i in range(top, n):
+        if mvs[i] > flat:
+          raise RuntimeError(f'Ramp not monotonic at {mvs[i]/16000:.3f} V')
+      duties = duties[:top]
+      mvs = mvs[:top]
+    if not self.monotonic( duties, mvs, -1 ):
+      raise RuntimeError('Ramp needs two or more distinct points')
+    self.table_duty = duties
+    self.table_mv = mvs
+    if save: self.save_table()
+
+  # Settle detection: VREG_OUT is read back to back, and a run of
+  # readings is kept while all of them lie within tolerance (mV) of
+  # the run's mean; a reading that breaks the band starts a new run.
+  # Settled once the run holds n readings and spans dwell ms, so a
+  # slow drift, with small steps from one reading to the next, can't
+  # pass. Returns the mean of the run (mv16); the time it took is
+  # kept in settle_ms, and settled is False after a timeout.
+  def wait_stable( self, tolerance=SETTLE_MV, timeout=SETTLE_TIMEOUT_MS,
+                   n=SETTLE_COUNT, dwell=SETTLE_DWELL_MS ):
+    tol = tolerance * 16
+    t0 = time.ticks_ms()
+    mv16 = self.measure_mv16()
+    t_run = time.ticks_ms()
+    acc = lo = hi = mv16
+    count = 1
+    self.settled = True
+    while True:
+      mv16 = self.measure_mv16()
+      t = time.ticks_ms()
+      acc += mv16
+      count += 1
+      if mv16 < lo: lo = mv16
+      if mv16 > hi: hi = mv16
+      # min and max within tol of the mean acc / count
+      if hi * count - acc > tol * count or acc - lo * count > tol * count:
+        t_run = t
+        acc = lo = hi = mv16
+        count = 1
+      elif count >= n and time.ticks_diff(t, t_run) >= dwell:
+        break
+      if time.ticks_diff(t, t0) > timeout:
+        self.settled = False
+        break
+    self.settle_ms = time.ticks_diff(time.ticks_ms(), t0)
+    return acc // count
 
   def testme(self):
     vplist = [ 0, 1, 2, 3, 3.3, ]
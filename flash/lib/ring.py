@@ -0,0 +1,86 @@
+from array import array
+from struct import calcsize
+
+class Ring:
+  __doc__ = \
+  '''Preallocated ring buffer of fixed size frames.
+  ring = Ring(DEPTH, WIDTH, TYPECODE)
+    where:
+      DEPTH        number of frames
+      WIDTH        elements per frame, e.g. one per ADC channel
+      TYPECODE     array typecode, default 'H'
+  Producer functions (no allocation):
+    slot()         view of the next free frame, None if full
+    push()         publishes the frame filled through slot()
+  Consumer functions:
+    available()    number of frames ready to read
+    window()       memoryview of the oldest ready frames
+    consume(n)     releases n frames read through window()
+    latest()       view of the most recent frame
+    clear()        discards all frames
+  Class members:
+    overruns       frames dropped because the ring was full'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # Single producer, single consumer: head is only written by
+  # the producer and tail only by the consumer, so neither side
+  # needs a lock. One frame is always left empty to tell a full
+  # ring from an empty one.
+
+  def __init__(self, depth, width=1, typecode='H'):
+    self.depth = depth + 1
+    self.width = width
+    self.buf = array(typecode,
+                     bytearray(self.depth * width * calcsize(typecode)))
+    self.mv = memoryview(self.buf)
+    # per-frame views made once, so the producer never allocates
+    self.frames = [ self.mv[i*width:(i+1)*width]
+                    for i in range(self.depth) ]
+    self.head = 0
+    self.tail = 0
+    self.overruns = 0
+
+  def slot(self):
+    head = self.head + 1
+    if head == self.depth: head = 0
+    if head == self.tail:
+      self.overruns += 1
+      return None
+    return self.frames[self.head]
+
+  def push(self):
+    head = self.head + 1
+    if head == self.depth: head = 0
+    self.head = head
+
+  def available(self):
+    return (self.head - self.tail) % self.depth
+
+  def window(self, nframes=None):
+    count = self.available()
+    if self.tail + count > self.depth: count = self.depth - self.tail
+    if nframes is not None and nframes < count: count = nframes
+    w = self.width
+    return self.mv[self.tail*w:(self.tail+count)*w]
+
+  def consume(self, nframes):
+    self.tail = (self.tail + nframes) % self.depth
+
+  def latest(self):
+    if self.head == self.tail: return None
+    return self.frames[(self.head - 1) % self.depth]
+
+  def clear(self):
+    self.tail = self.head
+    self.overruns = 0
+
+  def __repr__(self):
+    return \
+    f'Ring {self.available()}/{self.depth-1} frames x {self.width}  ' \
+    f'overruns {self.overruns}'
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -0,0 +1,179 @@
+from machine import Timer
+from array import array
+
+class Profile:
+  __doc__ = \
+  '''Soft-start and profile engine for the adjustable supply.
+  prof = Profile(PSU)
+    where:
+      PSU          power supply class
+  Profile builders, values in V (or mA with current=True):
+    linear(v0, v1, ms)       straight ramp from v0 to v1
+    scurve(v0, v1, ms)       smooth ramp, zero slope at both ends
+    stepped(levels, dwell)   list of levels, dwell ms each
+    table(values)            arbitrary list of values
+      step                   ms per point, 1 or more, default 1
+      current                profile the current limit, default False
+  Class functions:
+    play()         plays the profile in the background, args:
+      abort        over-current abort threshold, mA, default none
+      enable       enables VREG at the first point, default True
+      callback     called with this object when done or aborted
+    stop()         stops playing, the output stays where it is
+    busy()         True while playing
+    peak()         highest current sense reading, mA
+  Class members:
+    index          points played so far
+    aborted        True if stopped by an over-current reading'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # Profiles are converted to PWM duty counts when built, so the
+  # timer callback only writes one duty value and checks one raw
+  # current sense reading against a precomputed count threshold.
+  # On abort the output is cut at once through the limiter PWM,
+  # the shift register commit (CURRENT_EN) waits for the SPI bus.
+  # Once VREG is off the current limit from before play() is put
+  # back, so the next enable() is not stuck at zero.
+  # While the ADC is claimed by other code (Analog.claims, e.g. a
+  # Burst), the profile keeps playing without the current check.
+
+  def __init__(self, psu):
+    self.psu = psu
+    self.adc = psu.adc
+    self.timer = None
+    self.duty = array('H')
+    self.pwm = psu.pwm_vreg
+    self.step = 1
+    self.index = 0
+    self.aborted = False
+    self.disabled = False
+    self.threshold = 0xffff
+    self.raw_peak = 0
+    self.callback = None
+    self.duty_iadj = 0
+
+  def points( self, ms, step ):
+    if step < 1:
+      raise ValueError('Step must be 1 ms or more')
+    return max( ms // step, 1 )
+
+  def build( self, values, step, current ):
+    if step < 1:
+      raise ValueError('Step must be 1 ms or more')
+    n = len(values)
+    self.duty = array('H', bytearray(2 * n))
+    if current:
+      conv = self.psu.ma2duty
+      self.pwm = self.psu.pwm_iadj
+    else:
+      conv = self.psu.vout2duty
+      self.pwm = self.psu.pwm_vreg
+    for i in range(n):
+      self.duty[i] = min( max( conv( values[i] ), 0 ), 0xffff )
+    self.step = step
+    return self
+
+  def linear( self, v0, v1, ms, step=1, current=False ):
+    n = self.points( ms, step )
+    return self.build( [ v0 + (v1 - v0) * i / n for i in range(n + 1) ],
+                       step, current )
+
+  def scurve( self, v0, v1, ms, step=1, current=False ):
+    n = self.points( ms, step )
+    values = []
+    for i in range(n + 1):
+      t = i / n
+      values.append( v0 + (v1 - v0) * t * t * (3 - 2 * t) )
+    return self.build( values, step, current )
+
+  def stepped( self, levels, dwell, step=1, current=False ):
+    n = self.points( dwell, step )
+    values = []
+    for v in levels:
+      values.extend( [v] * n )
+    return self.build( values, step, current )
+
+  def table( self, values, step=1, current=False ):
+    return self.build( values, step, current )
+
+  def play( self, abort=None, enable=True, callback=None ):
+    self.stop()
+    if not len(self.duty):
+      raise RuntimeError('Profile is empty, build one first')
+    ich = self.adc.ISENSE
+    if abort is None:
+      self.threshold = 0xffff
+    else:
+      counts = (abort - self.adc.voffset[ich]) / self.adc.vscale[ich]
+      self.threshold = min( max( int(counts), 0 ), 0xffff )
+    self.read_u16 = self.adc.iadc.read_u16
+    self.callback = callback
+    self.index = 1
+    self.aborted = False
+    self.disabled = False
+    self.raw_peak = 0
+    self.duty_iadj = self.psu.pwm_iadj.duty_u16()
+    self.pwm.duty_u16( self.duty[0] )
+    if enable: self.psu.enable()
+    if len(self.duty) == 1:
+      self.done()
+      return
+    self.timer = Timer(period=self.step, mode=Timer.PERIODIC,
+                       callback=self.tick)
+
+  def tick( self, timer=None ):
+    if self.aborted:
+      # still waiting to commit CURRENT_EN
+      self.shutdown()
+      return
+    if not self.adc.claims:
+      raw = self.read_u16()
+      if raw > self.raw_peak: self.raw_peak = raw
+      if raw > self.threshold:
+        self.psu.pwm_iadj.duty_u16(0)
+        self.aborted = True
+        self.shutdown()
+        return
+    self.pwm.duty_u16( self.duty[self.index] )
+    self.index += 1
+    if self.index >= len(self.duty):
+      self.done()
+
+  def shutdown( self ):
+    sr = self.psu.sr
+    if sr.held(): return
+    self.psu.disable()
+    self.psu.pwm_iadj.duty_u16( self.duty_iadj )
+    self.disabled = True
+    self.done()
+
+  def done( self ):
+    self.stop()
+    if self.callback is not None:
+      self.callback(self)
+
+  def stop( self ):
+    if self.timer is not None:
+      self.timer.deinit()
+      self.timer = None
+
+  def busy( self ):
+    return self.timer is not None
+
+  def peak( self ):
+    ich = self.adc.ISENSE
+    return self.raw_peak * self.adc.vscale[ich] + self.adc.voffset[ich]
+
+  def __repr__(self):
+    if self.aborted:  state = 'aborted'
+    elif self.busy(): state = 'playing'
+    else:             state = 'idle'
+    return \
+    f'Profile {len(self.duty)} points x {self.step} ms  ' \
+    f'at {self.index}  {state}  peak {self.peak():.1f} mA'
+
+  def __str__(self):
+    return self.__repr__()
+
@@ -0,0 +1,250 @@
+from machine import Pin, SPI
+from bp5pins import *
+try:
+  import _thread
+except ImportError:
+  _thread = None
+
+# The SPI0 bus is shared by the shift register, the TFT display
+# and the NAND flash. Each part has its own maximum clock rate and
+# mode, so the bus arbiter keeps one profile per device and only
+# re-initializes the peripheral when a different device takes over.
+#
+# A device holds the bus for the length of one write, or for the
+# length of a burst:
+#   with dev:              explicit burst, e.g. SR write + latch
+#   dev.guard(cs_pin)      burst lasts while the chip select is low
+# From the other core, a request just waits for the burst to end.
+# From the same thread (e.g. a timer callback), a request during a
+# chip select burst parks the burst: CS is driven high for the
+# duration, the chip ignores the traffic, and CS is restored after.
+# Any other overlap is a collision and raises RuntimeError, callers
+# in callbacks should check dev.busy() first. busy() is False for
+# the device's own holds: a callback that must not interleave with
+# the code it interrupted checks dev.held() instead.
+
+class SPIDevice:
+  __doc__ = \
+  '''One device profile on the shared SPI bus.
+  dev = bus.device(NAME, BAUDRATE, POLARITY, PHASE)
+  Class functions:
+    write(buf)                  same as machine.SPI
+    read(nbytes, write)         same as machine.SPI
+    readinto(buf, write)        same as machine.SPI
+    write_readinto(wbuf, rbuf)  same as machine.SPI
+    busy()                      True if another device holds the bus
+    held()                      True if any device holds the bus
+    guard(pin)                  wraps chip select pin, holds bus while low
+  Use "with dev as spi:" to hold the bus across several transfers.'''
+
+  def help(self):
+    print(self.__doc__)
+
+  def __init__(self, bus, name, baudrate, polarity=0, phase=0):
+    self.bus = bus
+    self.name = name
+    self.baudrate = baudrate
+    self.polarity = polarity
+    self.phase = phase
+
+  def __repr__(self):
+    return \
+    f'{self.name}: {self.baudrate} Bd  ' \
+    f'polarity {self.polarity}  phase {self.phase}'
+
+  def __str__(self):
+    return self.__repr__()
+
+  # "with dev as spi:" gives the raw peripheral, configured
+  # for this device and held for the whole block
+  def __enter__(self):
+    self.bus.acquire(self)
+    return self.bus.spi
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.bus.release()
+
+  def busy(self):
+    return self.bus.busy(self)
+
+  def held(self):
+    return self.bus.depth > 0
+
+  def guard(self, pin):
+    return GuardPin(self, pin)
+
+  def write(self, buf):
+    self.bus.acquire(self)
+    try:
+      self.bus.spi.write(buf)
+    finally:
+      self.bus.release()
+
+  def read(self, nbytes, write=0x00):
+    self.bus.acquire(self)
+    try:
+      return self.bus.spi.read(nbytes, write)
+    finally:
+      self.bus.release()
+
+  def readinto(self, buf, write=0x00):
+    self.bus.acquire(self)
+    try:
+      self.bus.spi.readinto(buf, write)
+    finally:
+      self.bus.release()
+
+  def write_readinto(self, wbuf, rbuf):
+    self.bus.acquire(self)
+    try:
+      self.bus.spi.write_readinto(wbuf, rbuf)
+    finally:
+      self.bus.release()
+
+
+class GuardPin:
+  # Chip select stand-in: the bus is held from the moment the
+  # pin is driven low until it is driven high again. Drivers such
+  # as st7789py leave CS low across a command and its data, and
+  # don't always pair off() with on(), so holding is idempotent.
+
+  def __init__(self, dev, pin):
+    self.dev = dev
+    self.pin = pin
+    self.held = False
+
+  def off(self):
+    if not self.held:
+      self.dev.bus.acquire(self.dev)
+      self.dev.bus.guard = self
+      self.held = True
+    self.pin.off()
+
+  def on(self):
+    self.pin.on()
+    if self.held:
+      self.held = False
+      if self.dev.bus.guard is self:
+        self.dev.bus.guard = None
+      self.dev.bus.release()
+
+  def value(self, val=None):
+    if val is None: return self.pin.value()
+    if val: self.on()
+    else:   self.off()
+
+  def __call__(self, val=None):
+    return self.value(val)
+
+
+class SPIBus:
+  __doc__ = \
+  '''Arbiter for the shared SPI0 bus.
+  bus = SPIBus()
+  Class functions:
+    device(name, baudrate, polarity, phase)   adds a device profile
+    busy(dev)      True if another device holds the bus
+    stats()        reconfiguration counters
+    clear_stats()  zeroes the counters
+  Class members:
+    devices        dictionary of device profiles by name'''
+
+  def help(self):
+    print(self.__doc__)
+
+  def __init__(self, id=0,
+               sck=PIN_SPI_CLK, mosi=PIN_SPI_SDO, miso=PIN_SPI_SDI):
+    self.spi = SPI(id,
+               firstbit = SPI.MSB,
+               sck=Pin(sck),
+               mosi=Pin(mosi),
+               miso=Pin(miso)
+            )
+    self.devices = {}
+    self.active = None    # device the peripheral is configured for
+    self.holder = None    # device holding the bus
+    self.owner = None     # thread holding the bus
+    self.depth = 0        # nesting level of the current hold
+    self.guard = None     # chip select of the burst holding the bus
+    self.parked = None    # chip select burst parked by another device
+    self.reconfigs = 0
+    self.avoided = 0
+    self.collisions = 0
+    self.lock = _thread.allocate_lock() if _thread else None
+
+  def device(self, name, baudrate, polarity=0, phase=0):
+    dev = SPIDevice(self, name, baudrate, polarity, phase)
+    self.devices[name] = dev
+    return dev
+
+  def ident(self):
+    return _thread.get_ident() if _thread else 0
+
+  def busy(self, dev):
+    if self.depth == 0: return False
+    if self.owner != self.ident(): return True
+    if dev is self.active or dev is self.holder: return False
+    return not self.parkable()
+
+  def parkable(self):
+    return self.guard is not None and self.parked is None \
+           and self.depth == 1
+
+  def acquire(self, dev):
+    me = self.ident()
+    if self.depth and self.owner == me:
+      if dev is not self.active and dev is not self.holder:
+        if not self.parkable():
+          self.collisions += 1
+          raise RuntimeError(
+            f'SPI bus collision, {dev.name} during {self.active.name}')
+        self.parked = self.guard
+        self.parked.pin.on()
+      self.configure(dev)
+      self.depth += 1
+      return
+    if self.lock: self.lock.acquire()
+    self.owner = me
+    self.holder = dev
+    self.depth = 1
+    # only a fresh hold counts, nested ones never reconfigure
+    if not self.configure(dev): self.avoided += 1
+
+  def release(self):
+    self.depth -= 1
+    if self.parked is not None and self.depth == 1:
+      self.parked.pin.off()
+      self.parked = None
+    elif self.depth == 0:
+      self.owner = None
+      self.holder = None
+      self.guard = None
+      if self.lock: self.lock.release()
+
+  # True if the peripheral had to be reconfigured
+  def configure(self, dev):
+    if self.active is dev: return False
+    self.spi.init(baudrate=dev.baudrate,
+                  polarity=dev.polarity, phase=dev.phase)
+    self.active = dev
+    self.reconfigs += 1
+    return True
+
+  def stats(self):
+    return \
+    f'Reconfigs {self.reconfigs}  Avoided {self.avoided}  ' \
+    f'Collisions {self.collisions}'
+
+  def clear_stats(self):
+    self.reconfigs = 0
+    self.avoided = 0
+    self.collisions = 0
+
+  def __repr__(self):
+    out = [ f'{dev}' for dev in self.devices.values() ]
+    out.append( self.stats() )
+    return '\n'.join( out )
+
+  def __str__(self):
+    return self.__repr__()
+
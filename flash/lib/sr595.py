@@ -83,8 +83,25 @@ class SR:
   # temporary buffer used to construct an new output value
   pending = outputs
 
+  # transaction support, see begin() / commit() below
+  # depth      nesting level of open transactions
+  # requests   send() calls absorbed by the open transaction
+  # saved      total sends saved by batching since power up
+  depth = 0
+  requests = 0
+  saved = 0
+
+  # traffic counters, see stats()
+  # commits      SPI writes with latch pulse actually performed
+  # suppressed   send() calls skipped, outputs already up to date
+  # latch_us     total time spent shifting and latching, usec
+  commits = 0
+  suppressed = 0
+  latch_us = 0
+
   def __init__(self, _spi):
     self.spi = _spi
+    self.buff = bytearray(2) # reused by send(), no allocation
     self.oena = Pin(PIN_SHIFT_EN, Pin.OUT, value=1)
     self.xfer = Pin(PIN_SHIFT_LATCH, Pin.OUT, value=0)
 
@@ -106,7 +123,7 @@ class SR:
     self.set_bits( self.MASK_AMUX_S1 )
     self.set_bits( self.MASK_DISPLAY_RESET )
     self.set_bits( self.MASK_CURRENT_EN )
-    self.send()
+    self.send(force=True)
 
   def __repr__(self):
     #print( 'oena:', self.oena.value(), 'xfer:', self.xfer.value() )
@@ -121,8 +138,9 @@ class SR:
   def __str__(self):
     self.__repr__()
 
+  # None while a change to the bit is not committed yet
   def get_bit( self, ibit ):
-    if self.outputs != self.pending: return None
+    if (self.outputs ^ self.pending) & (1 << ibit): return None
     return (self.outputs & (1 << ibit)) >> ibit
   def set_bit( self, ibit ):
     self.pending = self.pending | (1 << ibit )
@@ -133,6 +151,9 @@ class SR:
     self.pending = self.pending | masks
   def clr_bits( self, masks ):
     self.pending = self.pending & ~masks
+  # replace a whole field, e.g. all the AMUX bits at once
+  def put_bits( self, masks, bits ):
+    self.pending = (self.pending & ~masks) | (bits & masks)
 
   # functions to do weird bit craziness
   # Bit reverse an 8 bit value
@@ -152,10 +173,118 @@ class SR:
       ibuff.append( self.rbit8(v) )
     return ibuff
   
-  def send(self):
-    self.spi.write(bytearray(self.pending.to_bytes(2,'big')))
-    self.outputs = self.pending
-    self.transfer()
+  # Transactions gather bit changes from any number of callers
+  # and commit them with one SPI write and one latch pulse:
+  #   with sr:
+  #     adc.select(ch)
+  #     psu.enable()
+  # Calls to send() made inside the transaction are deferred
+  # until the outermost transaction ends. send(now=True) commits
+  # at once all the same, along with the changes made so far, for
+  # callers that need the hardware state before going on, e.g.
+  # Analog.select() before a conversion.
+  def begin(self):
+    self.depth += 1
+    return self
+
+  def commit(self):
+    if self.depth == 0: return
+    self.depth -= 1
+    if self.depth > 0: return
+    if self.requests:
+      self.saved += self.requests - 1
+      self.requests = 0
+      self.send()
+
+  def __enter__(self):
+    return self.begin()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.commit()
+
+  # Redundant commits, where the pending bits already match the
+  # outputs, are skipped unless forced.
+  def send(self, force=False, now=False):
+    if self.depth and not now:
+      self.requests += 1
+      return
+    if self.pending == self.outputs and not force:
+      self.suppressed += 1
+      return
+    t0 = time.ticks_us()
+    # hold the shared bus from shifting until the latch pulse,
+    # other traffic in between would be latched instead
+    with self.spi as spi:
+      self.buff[0] = self.pending >> 8
+      self.buff[1] = self.pending & 0xff
+      spi.write(self.buff)
+      self.outputs = self.pending
+      self.transfer()
+      self.latch_us += time.ticks_diff(time.ticks_us(), t0)
+      self.commits += 1
+
+  # True if another device is in the middle of a bus burst,
+  # a commit right now would collide with it
+  def busy(self):
+    return self.spi.busy()
+
+  # True if the shift register must not be touched from a callback:
+  # a transaction is open, or any device holds the bus, including
+  # the shift register itself in the code the callback interrupted
+  # (e.g. Analog.read(ch) between select and read_u16)
+  def held(self):
+    return self.depth > 0 or self.spi.held()
+
+  # Step a field through a sequence of values, calling sample()
+  # after each commit and storing the result in buf[i]. The bus
+  # is held for the whole sequence, so each step only costs the
+  # 2 byte write and the latch pulse.
+  # step() may run on core 1 (see worker.py) while core 0 changes
+  # pending with unlocked read-modify-writes, so it never writes
+  # pending: the stepped field is left as the hardware state only
+  # (outputs, updated under the bus lock), and the next send()
+  # commits pending whole, field included.
+  # after, if given, is one more field value committed at the end
+  # of the sequence without sampling, e.g. the AMUX deselect.
+  def step(self, masks, words, sample, buf, after=None):
+    if not len(words): return buf
+    t0 = time.ticks_us()
+    b = self.buff
+    xfer = self.xfer
+    with self.spi as spi:
+      base = self.pending & ~masks
+      for i in range(len(words)):
+        val = base | (words[i] & masks)
+        b[0] = val >> 8
+        b[1] = val & 0xff
+        spi.write(b)
+        xfer(1)
+        xfer(0)
+        buf[i] = sample()
+      n = len(words)
+      if after is not None:
+        val = base | (after & masks)
+        b[0] = val >> 8
+        b[1] = val & 0xff
+        spi.write(b)
+        xfer(1)
+        xfer(0)
+        n += 1
+      self.outputs = val
+      self.latch_us += time.ticks_diff(time.ticks_us(), t0)
+      self.commits += n
+    return buf
+
+  def stats(self):
+    return \
+    f'Commits {self.commits}  Suppressed {self.suppressed}  ' \
+    f'Batched {self.saved}  Latch {self.latch_us} us'
+
+  def clear_stats(self):
+    self.commits = 0
+    self.suppressed = 0
+    self.saved = 0
+    self.latch_us = 0
 
   def send_raw(self, val16):
     val = val16 % 0xffff
@@ -171,9 +300,9 @@ class SR:
     self.oena.value(1)
     return self.oena.value()
 
+  # the 74HC595 needs a latch pulse of tens of nsec, 
+  # toggling the pin from Python is already much longer
   def transfer(self):
     self.xfer.value(1)
-    time.sleep_us(10)
     self.xfer.value(0)
-    time.sleep_us(10)
 
@@ -0,0 +1,112 @@
+import math
+
+class Stats:
+  __doc__ = \
+  '''Streaming per-channel statistics of integer samples.
+  st = Stats(NCHAN)
+  Class functions:
+    update(frame)  adds one frame, one sample per channel
+    snapshot()     list of (n, min, max, mean, stddev) per channel
+    reset()        zeroes all channels, takes effect at next update
+  Class members:
+    seq            update sequence number, odd while updating'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # Welford's running update keeps a float mean and M2, which cost
+  # a float allocation per sample on the RP2040. Here the sums are
+  # exact integers instead: of the raw 12 bit counts (read_u16() >> 4),
+  # taken relative to the first sample of each channel, so each
+  # square is under 2**24. To stay in MicroPython's small int range
+  # (30 bits) for any run length, each sum is kept in two words, and
+  # the low word carries into the high word once it passes CARRY.
+  # The high words grow by one per CARRY, i.e. at most one per
+  # sample, so the count (2**30 samples, 124 days at 100 Hz) runs
+  # out first. update() never allocates; snapshot() joins the words
+  # and does the arithmetic in long ints and floats.
+  #
+  # The producer (timer callback or core 1) is the only writer.
+  # reset() only raises a flag that the producer honours, and
+  # snapshot() retries until it reads a stable sequence number.
+  CARRY_BITS = 24
+  CARRY = 1 << CARRY_BITS
+  CARRY_MASK = CARRY - 1
+
+  def __init__(self, nchan):
+    self.nchan = nchan
+    self.seq = 0
+    self.clear = False
+    self.zero()
+
+  def zero(self):
+    n = self.nchan
+    self.count = [0] * n
+    self.kval = [0] * n
+    self.vmin = [0] * n
+    self.vmax = [0] * n
+    self.sum = [0] * n
+    self.sum_hi = [0] * n
+    self.sumsq = [0] * n
+    self.sumsq_hi = [0] * n
+
+  def reset(self):
+    self.clear = True
+
+  def update(self, frame):
+    self.seq += 1
+    if self.clear:
+      self.zero()
+      self.clear = False
+    count = self.count
+    kval = self.kval
+    vmin = self.vmin
+    vmax = self.vmax
+    ssum = self.sum
+    sumsq = self.sumsq
+    carry = self.CARRY
+    for i in range(self.nchan):
+      x = frame[i]
+      if count[i] == 0:
+        kval[i] = x >> 4
+        vmin[i] = x
+        vmax[i] = x
+      elif x < vmin[i]: vmin[i] = x
+      elif x > vmax[i]: vmax[i] = x
+      d = (x >> 4) - kval[i]
+      count[i] += 1
+      s = ssum[i] + d
+      if s >= carry or s <= -carry:
+        self.sum_hi[i] += s >> self.CARRY_BITS
+        s &= self.CARRY_MASK
+      ssum[i] = s
+      sq = sumsq[i] + d * d
+      if sq >= carry:
+        self.sumsq_hi[i] += sq >> self.CARRY_BITS
+        sq &= self.CARRY_MASK
+      sumsq[i] = sq
+    self.seq += 1
+
+  # mean and stddev in read_u16() counts, raw counts * 16
+  def snapshot(self):
+    while True:
+      seq = self.seq
+      if seq & 1: continue
+      raw = [ ( self.count[i], self.kval[i], self.vmin[i], self.vmax[i],
+                self.sum[i], self.sum_hi[i], self.sumsq[i],
+                self.sumsq_hi[i] )
+              for i in range(self.nchan) ]
+      if seq == self.seq and not self.clear: break
+      if self.clear: return [ (0, 0, 0, 0.0, 0.0) ] * self.nchan
+    out = []
+    for n, k, lo, hi, s, s_hi, sq, sq_hi in raw:
+      if n == 0:
+        out.append( (0, 0, 0, 0.0, 0.0) )
+        continue
+      s += s_hi << self.CARRY_BITS
+      sq += sq_hi << self.CARRY_BITS
+      mean = (k + s / n) * 16
+      # exact in long ints, only the quotient is rounded
+      var = (n * sq - s * s) / (n * (n - 1)) if n > 1 else 0.0
+      out.append( (n, lo, hi, mean, 16 * math.sqrt(var)) )
+    return out
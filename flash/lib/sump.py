@@ -0,0 +1,200 @@
+import sys
+import struct
+import select
+import micropython
+import machine
+import trigger
+
+# SUMP commands, see the OpenBench Logic Sniffer protocol
+CMD_RESET = 0x00
+CMD_RUN = 0x01
+CMD_ID = 0x02
+CMD_METADATA = 0x04
+CMD_XON = 0x11
+CMD_XOFF = 0x13
+CMD_DIVIDER = 0x80
+CMD_COUNTS = 0x81
+CMD_FLAGS = 0x82
+CMD_TRIGGER_MASK = 0xc0   # + 4 * stage
+CMD_TRIGGER_VALUE = 0xc1
+CMD_TRIGGER_CONFIG = 0xc2
+CTRL_C = 0x03
+# flags: channel groups 0..3 disabled, one bit each
+FLAGS_GROUPS_SHIFT = 2
+
+class Sump:
+  __doc__ = \
+  '''SUMP / OpenLogicSniffer protocol server on the USB serial port.
+  sump = Sump(IO, IN, OUT)
+    where:
+      IO           logic capture class, logic.Logic
+      IN, OUT      byte streams, default the USB serial port
+  Class functions:
+    serve()        answers SUMP commands until three ^C bytes
+                   (0x03) in a row, e.g. from a terminal
+  Class members:
+    rate           sample rate set by the client
+    read_count     samples per capture set by the client
+    delay_count    samples after the trigger set by the client
+    trigger_mask   stage 0 trigger mask, bit n is IOn
+    trigger_value  stage 0 trigger value'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # Data goes back in CHUNK byte writes, last sample first as the
+  # protocol wants, one byte per enabled channel group (only group 0
+  # carries data, the board has 8 channels).
+  # While waiting for a trigger, the input is polled between slices
+  # of the wait: anything from the client (a reset to abort, or the
+  # ^C bytes) ends the capture without data, and is then read as
+  # usual. Inputs that can't be polled wait for the trigger only.
+  CLOCK = 100_000_000
+  CHUNK = 512
+  NAME = b'Bus Pirate 5 MicroPython'
+  PROBES = 8
+
+  def __init__(self, io, fin=None, fout=None):
+    self.io = io
+    self.fin = fin
+    self.fout = fout
+    self.chunk = bytearray(self.CHUNK)
+    self.trigger = trigger.Trigger(io)
+    self.poll = None
+    self.reset()
+
+  def reset(self):
+    self.rate = self.CLOCK // 100
+    self.read_count = len(self.io.buf)
+    self.delay_count = self.read_count
+    self.flags = 0
+    self.trigger_mask = 0
+    self.trigger_value = 0
+    self.trigger_config = 0
+
+  def serve(self):
+    usb = self.fin is None
+    fin = sys.stdin.buffer if usb else self.fin
+    fout = sys.stdout.buffer if usb else self.fout
+    self.out = fout
+    try:
+      self.poll = select.poll()
+      self.poll.register(fin, select.POLLIN)
+    except (AttributeError, OSError, TypeError, ValueError):
+      self.poll = None
+    # 0x03 is a SUMP byte like any other
+    if usb: micropython.kbd_intr(-1)
+    try:
+      nctrl = 0
+      while nctrl < 3:
+        cmd = fin.read(1)
+        if not cmd: break
+        cmd = cmd[0]
+        nctrl = nctrl + 1 if cmd == CTRL_C else 0
+        if cmd & 0x80:
+          self.long_command( cmd, fin.read(4) )
+        else:
+          self.short_command( cmd )
+    finally:
+      if usb: micropython.kbd_intr(CTRL_C)
+
+  def short_command( self, cmd ):
+    if cmd == CMD_ID:
+      self.out.write(b'1ALS')
+    elif cmd == CMD_METADATA:
+      self.out.write( self.metadata() )
+    elif cmd == CMD_RUN:
+      self.run()
+    # reset, XON / XOFF and anything else: nothing to do
+
+  def long_command( self, cmd, arg ):
+    val = struct.unpack('<I', arg)[0]
+    if cmd == CMD_DIVIDER:
+      self.rate = self.CLOCK // ((val & 0xffffff) + 1)
+    elif cmd == CMD_COUNTS:
+      self.read_count = ((val & 0xffff) + 1) * 4
+      self.delay_count = ((val >> 16) + 1) * 4
+    elif cmd == CMD_FLAGS:
+      self.flags = val
+    elif cmd == CMD_TRIGGER_MASK:
+      self.trigger_mask = val & 0xff
+    elif cmd == CMD_TRIGGER_VALUE:
+      self.trigger_value = val & 0xff
+    elif cmd == CMD_TRIGGER_CONFIG:
+      self.trigger_config = val
+    # other trigger stages: not supported, ignored
+
+  def metadata( self ):
+    out = bytearray()
+    out.append(0x01)
+    out.extend(self.NAME)
+    out.append(0x00)
+    out.extend( struct.pack('>BI', 0x20, self.PROBES) )
+    out.extend( struct.pack('>BI', 0x21, len(self.io.buf)) )
+    out.extend( struct.pack('>BI', 0x23, min(machine.freq(), self.CLOCK)) )
+    out.extend( struct.pack('>BI', 0x24, 2) )
+    out.append(0x00)
+    return out
+
+  def groups( self ):
+    n = 0
+    for g in range(4):
+      if not self.flags & (1 << (FLAGS_GROUPS_SHIFT + g)): n += 1
+    return max(n, 1)
+
+  def run( self ):
+    io = self.io
+    n = min( self.read_count, len(io.buf) )
+    # clamp to what the PIO clock divider can do
+    fsys = machine.freq()
+    rate = min( max( self.rate, fsys // (65536 * io.SLOW_CYCLES) + 1 ), fsys )
+    if self.trigger_mask:
+      # stage 0 pattern, delay count is the post-trigger window
+      self.trigger.pattern( self.trigger_mask, self.trigger_value )
+      self.trigger.capture( rate=rate, nsamples=n, post=self.delay_count,
+                            abort=self.waiting )
+      # aborted by the client
+      if self.trigger.index is None: return
+    else:
+      io.capture( rate=rate, nsamples=n )
+    self.send( io.nsamples )
+
+  # True if the client sent something
+  def waiting( self ):
+    return self.poll is not None and bool( self.poll.poll(0) )
+
+  def send( self, n ):
+    buf = self.io.buf
+    chunk = self.chunk
+    ngroups = self.groups()
+    per = self.CHUNK // ngroups
+    i = n
+    while i > 0:
+      k = min(i, per)
+      if ngroups == 1:
+        reverse_copy( chunk, buf, i - k, k )
+      else:
+        for j in range(k):
+          chunk[j * ngroups] = buf[i - 1 - j]
+          for g in range(1, ngroups):
+            chunk[j * ngroups + g] = 0
+      self.out.write( memoryview(chunk)[:k * ngroups] )
+      i -= k
+    # samples the client asked for but the buffer did not hold,
+    # sent as the oldest ones
+    pad = self.read_count - n
+    if pad > 0:
+      for j in range(self.CHUNK): chunk[j] = 0
+    while pad > 0:
+      k = min(pad, per)
+      self.out.write( memoryview(chunk)[:k * ngroups] )
+      pad -= k
+
+# dst[0:n] = src[start:start+n] reversed
+@micropython.viper
+def reverse_copy(dst: ptr8, src: ptr8, start: int, n: int):
+  j = start + n - 1
+  for i in range(n):
+    dst[i] = src[j]
+    j -= 1
+
@@ -0,0 +1,304 @@
+import micropython
+from micropython import const
+from array import array
+import logic
+
+# trigger modes
+MODE_MATCH = const(0)  # stage 0 matches
+MODE_STAGES = const(1) # stage 0 matches, then stage 1
+MODE_PULSE = const(2)  # stage 0 held for wmin..wmax samples, then released
+
+# parameter block of trigger_loop(), indices
+P_SIZE = const(0)
+P_POST = const(1)
+P_FSTAT = const(2)
+P_RXF = const(3)
+P_EMPTY = const(4)
+P_MODE = const(5)
+P_M0 = const(6)   # stage 0: sample & M0 == V0 and previous & PM0 == PV0
+P_V0 = const(7)
+P_PM0 = const(8)
+P_PV0 = const(9)
+P_M1 = const(10)  # stage 1, same
+P_V1 = const(11)
+P_PM1 = const(12)
+P_PV1 = const(13)
+P_WMIN = const(14)
+P_WMAX = const(15)
+P_LIMIT = const(16) # stop waiting for the trigger at this total, 0 never
+P_END = const(17)   # in/out: next write index in the ring
+P_TOTAL = const(18) # in/out: samples taken
+P_TRIG = const(19)  # out: sample number of the trigger, -1 if none
+P_STAGE = const(20) # in/out: trigger state, for resuming a wait
+P_WIDTH = const(21)
+P_PREV = const(22)
+P_FDEBUG = const(23)
+P_STALL = const(24)
+P_LOST = const(25)  # in/out: samples may be missing up to this total
+NPARAM = const(26)
+
+# Samples from the PIO FIFO into buf used as a ring, evaluating the
+# trigger on every sample with the precomputed masks, then takes
+# POST more samples. Same cost per sample whatever the trigger.
+# Without a trigger it returns at the first FIFO word at or past
+# LIMIT, with the ring and trigger state saved in p to resume.
+@micropython.viper
+def trigger_loop(buf: ptr8, p: ptr32):
+  size = p[P_SIZE]
+  stat = ptr32(p[P_FSTAT])
+  fifo = ptr32(p[P_RXF])
+  dbg = ptr32(p[P_FDEBUG])
+  stall = p[P_STALL]
+  empty = p[P_EMPTY]
+  mode = p[P_MODE]
+  m0 = p[P_M0]
+  v0 = p[P_V0]
+  pm0 = p[P_PM0]
+  pv0 = p[P_PV0]
+  m1 = p[P_M1]
+  v1 = p[P_V1]
+  pm1 = p[P_PM1]
+  pv1 = p[P_PV1]
+  wmin = p[P_WMIN]
+  wmax = p[P_WMAX]
+  limit = p[P_LIMIT]
+  i = p[P_END]
+  total = p[P_TOTAL]
+  stage = p[P_STAGE]
+  width = p[P_WIDTH]
+  prev = p[P_PREV]
+  lost = p[P_LOST]
+  trig = -1
+  remaining = -1
+  # the PIO stalled since the last call: samples missing from here
+  if dbg[0] & stall:
+    dbg[0] = stall
+    lost = total
+  run = 1
+  while run:
+    if remaining < 0 and limit > 0 and total >= limit:
+      break
+    while stat[0] & empty:
+      pass
+    word = fifo[0]
+    k = 0
+    while k < 32:
+      s = (word >> k) & 0xff
+      k += 8
+      buf[i] = s
+      i += 1
+      if i == size: i = 0
+      total += 1
+      if remaining >= 0:
+        remaining -= 1
+        if remaining <= 0:
+          run = 0
+          break
+      else:
+        fire = 0
+        if total == 1:
+          # the first sample only seeds prev: a line already high is
+          # no rising edge, and a pulse already in progress (width
+          # left at -1) is not measured
+          if (s & m0) != v0: width = 0
+        elif mode == MODE_PULSE:
+          if (s & m0) == v0:
+            if width >= 0: width += 1
+          else:
+            if width >= wmin and width <= wmax and width > 0: fire = 1
+            width = 0
+        elif stage == 0:
+          if (s & m0) == v0 and (prev & pm0) == pv0:
+            if mode == MODE_STAGES: stage = 1
+            else:                   fire = 1
+        else:
+          if (s & m1) == v1 and (prev & pm1) == pv1: fire = 1
+        if fire:
+          trig = total - 1
+          remaining = p[P_POST]
+          if remaining <= 0:
+            run = 0
+            break
+      prev = s
+  if dbg[0] & stall:
+    dbg[0] = stall
+    lost = total
+  p[P_END] = i
+  p[P_TOTAL] = total
+  p[P_TRIG] = trig
+  p[P_STAGE] = stage
+  p[P_WIDTH] = width
+  p[P_PREV] = prev
+  p[P_LOST] = lost
+
+# buf[a:b] reversed in place
+@micropython.viper
+def reverse(buf: ptr8, a: int, b: int):
+  b -= 1
+  while a < b:
+    t = buf[a]
+    buf[a] = buf[b]
+    buf[b] = t
+    a += 1
+    b -= 1
+
+class Trigger:
+  __doc__ = \
+  '''Triggered logic capture with pre-trigger history.
+  trig = Trigger(IO)
+    where:
+      IO           logic capture class, logic.Logic
+  Trigger setup, bits are I/O bit numbers:
+    edge(bit, rising=True)             edge on one bit
+    pattern(mask, value)               bits in mask equal value
+    pattern_edge(mask, value, bit, rising=True)
+                                       pattern, then edge
+    pulse(bit, level=1, wmin=1, wmax=65535)
+                                       pulse of wmin..wmax samples
+  Class functions:
+    capture()      waits for the trigger, returns the sample count
+      rate         samples per second, default 1_000_000
+      nsamples     capture window, default the whole buffer
+      post         samples after the trigger, default half the window
+      timeout_ms   gives up after this long without a trigger,
+                   default 0: wait forever
+      abort        function called about every 50 ms while waiting,
+                   True gives up, default none
+  Class members:
+    index          trigger sample in the capture, None if none
+    pre            samples kept before the trigger
+  The capture lands in IO like IO.capture(), see io.help().'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # The PIO paces the sampling, as for Logic.capture(). A viper loop
+  # reads the FIFO, keeps the samples in the capture buffer used as
+  # a ring, and tests each one against precomputed masks: a sample
+  # matches a stage when (sample & M) == V and (previous & PM) == PV,
+  # which covers levels, patterns and edges. The first sample has
+  # no previous one and is not evaluated. After the trigger, the
+  # post-trigger samples complete the ring, which is then rotated so
+  # the oldest sample comes first. The loop speed bounds the rate; a
+  # PIO stall (samples lost) is reported as IO.overrun.
+  #
+  # The wait is cut in slices of about POLL_MS, back in Python in
+  # between so Ctrl-C and abort() are seen. The PIO keeps sampling
+  # between slices and the ring carries on, so the pre-trigger
+  # history spans slices; samples the FIFO could not hold between
+  # slices only count as an overrun if they fall inside the
+  # captured window.
+  POLL_MS = 50
+  # totals are rebased past this, long waits stay in 32 bits
+  REBASE = 1 << 29
+
+  def __init__(self, io):
+    self.io = io
+    self.p = array('i', [0] * NPARAM)
+    self.index = None
+    self.pre = 0
+    self.pattern(0, 0)
+
+  def stage( self, n, mask, value, pmask=0, pvalue=0 ):
+    base = P_M0 if n == 0 else P_M1
+    p = self.p
+    p[base] = mask & 0xff
+    p[base + 1] = value & mask & 0xff
+    p[base + 2] = pmask & 0xff
+    p[base + 3] = pvalue & pmask & 0xff
+
+  def edge_masks( self, bit, rising ):
+    m = 1 << bit
+    return (m, m, m, 0) if rising else (m, 0, m, m)
+
+  def edge( self, bit, rising=True ):
+    self.p[P_MODE] = MODE_MATCH
+    self.stage( 0, *self.edge_masks(bit, rising) )
+
+  def pattern( self, mask, value ):
+    self.p[P_MODE] = MODE_MATCH
+    self.stage( 0, mask, value )
+
+  def pattern_edge( self, mask, value, bit, rising=True ):
+    self.p[P_MODE] = MODE_STAGES
+    self.stage( 0, mask, value )
+    self.stage( 1, *self.edge_masks(bit, rising) )
+
+  def pulse( self, bit, level=1, wmin=1, wmax=65535 ):
+    self.p[P_MODE] = MODE_PULSE
+    self.stage( 0, 1 << bit, level << bit )
+    self.p[P_WMIN] = wmin
+    self.p[P_WMAX] = wmax
+
+  def capture( self, rate=logic.Logic.DEF_RATE, nsamples=None, post=None,
+               timeout_ms=0, abort=None ):
+    io = self.io
+    n = len(io.buf) if nsamples is None else min( nsamples, len(io.buf) )
+    if post is None: post = n >> 1
+    # the trigger sample itself stays in the window
+    post = min( max(post, 0), n - 1 )
+    smi = io.SM_ID & 3
+    p = self.p
+    p[P_SIZE] = n
+    p[P_POST] = post
+    p[P_FSTAT] = logic.PIO_FSTAT
+    p[P_RXF] = logic.PIO_RXF0 + 4 * smi
+    p[P_EMPTY] = 1 << (logic.FSTAT_RXEMPTY_SHIFT + smi)
+    p[P_FDEBUG] = logic.PIO_FDEBUG
+    p[P_STALL] = 1 << (logic.FDEBUG_RXSTALL_SHIFT + smi)
+    p[P_END] = 0
+    p[P_TOTAL] = 0
+    p[P_STAGE] = 0
+    p[P_WIDTH] = -1
+    p[P_PREV] = 0
+    p[P_LOST] = 0
+    limit = min( int(timeout_ms * rate) // 1000, 0x7fffffff )
+    step = max( rate * self.POLL_MS // 1000, 4 )
+    waited = 0
+    sm = io.start_sm(rate)
+    sm.active(1)
+    while True:
+      left = limit - waited if limit else 0
+      size = step if not left or step < left else left
+      start = p[P_TOTAL]
+      p[P_LIMIT] = start + size if size else 0
+      trigger_loop( io.buf, p )
+      waited += p[P_TOTAL] - start
+      if p[P_TRIG] >= 0: break
+      if limit and waited >= limit: break
+      if abort is not None and abort(): break
+      if p[P_TOTAL] > self.REBASE:
+        d = p[P_TOTAL] - 2 * n
+        p[P_TOTAL] -= d
+        p[P_LOST] = max( p[P_LOST] - d, 0 )
+    sm.active(0)
+    total = p[P_TOTAL]
+    end = p[P_END]
+    # oldest sample first
+    if total > n:
+      reverse( io.buf, 0, end )
+      reverse( io.buf, end, n )
+      reverse( io.buf, 0, n )
+    m = min(total, n)
+    first = total - m
+    io.overrun = p[P_LOST] > first
+    io.rate = rate
+    io.rle = False
+    io.nbytes = m
+    io.nsamples = m
+    if p[P_TRIG] < 0:
+      self.index = None
+      self.pre = 0
+    else:
+      self.index = p[P_TRIG] - first
+      self.pre = self.index
+    return m
+
+  def __repr__(self):
+    if self.index is None: return 'Trigger: not fired'
+    return f'Trigger at sample {self.index}  pre {self.pre}  ' \
+           f'post {self.io.nsamples - self.index - 1}'
+
+  def __str__(self):
+    return self.__repr__()
+
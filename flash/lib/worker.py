@@ -0,0 +1,89 @@
+import _thread
+try:
+  from time import ticks_us, ticks_diff, ticks_add, sleep_us, sleep_ms
+except ImportError:
+  # CPython, where the ring handoff is tested with threads
+  from time import perf_counter_ns, sleep
+  def ticks_us(): return perf_counter_ns() // 1000
+  def ticks_diff(a, b): return a - b
+  def ticks_add(a, b): return a + b
+  def sleep_us(us): sleep(us / 1_000_000)
+  def sleep_ms(ms): sleep(ms / 1000)
+from ring import Ring
+
+class Worker:
+  __doc__ = \
+  '''Acquisition loop running on the second core (core 1).
+  worker = Worker(SAMPLE, WIDTH, RATE, DEPTH)
+    where:
+      SAMPLE       function filling one frame, sample(frame)
+      WIDTH        elements per frame
+      RATE         frames per second
+      DEPTH        ring depth in frames
+  Class functions:
+    start()        starts the loop on core 1
+    stop()         stops the loop, waits for it to end
+    running()      True while the loop runs
+  Class members:
+    ring           ring buffer of frames, see ring.help()
+    late           frames started behind schedule'''
+
+  def help(self):
+    print(self.__doc__)
+
+  # The worker is the only producer of the ring and core 0 the
+  # only consumer, so frames are handed over without locks.
+  # Shared peripherals are still serialized by their owners,
+  # e.g. the SPI bus lock around shift register commits.
+
+  def __init__(self, sample, width, rate=1000, depth=1024, typecode='H'):
+    self.sample = sample
+    self.period = 1_000_000 // rate
+    self.ring = Ring(depth, width, typecode)
+    self.late = 0
+    self.run_flag = False
+    self.done = True
+
+  def start(self):
+    if not self.done: return
+    self.run_flag = True
+    self.done = False
+    _thread.start_new_thread(self.loop, ())
+
+  def stop(self):
+    self.run_flag = False
+    while not self.done:
+      sleep_ms(1)
+
+  def running(self):
+    return not self.done
+
+  def loop(self):
+    # done must end up True whatever happens, stop() waits for it
+    try:
+      ring = self.ring
+      sample = self.sample
+      period = self.period
+      t_next = ticks_us()
+      while self.run_flag:
+        frame = ring.slot()
+        if frame is not None:
+          sample(frame)
+          ring.push()
+        t_next = ticks_add(t_next, period)
+        wait = ticks_diff(t_next, ticks_us())
+        if wait > 0:
+          sleep_us(wait)
+        else:
+          self.late += 1
+          t_next = ticks_us()
+    finally:
+      self.done = True
+
+  def __repr__(self):
+    state = 'running' if self.running() else 'stopped'
+    return f'Worker {state}  {self.ring}  late {self.late}'
+
+  def __str__(self):
+    return self.__repr__()
+
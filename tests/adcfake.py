@@ -0,0 +1,128 @@
+# Host stand-in for the RP2040 ADC registers and a DMA channel
+# paced by the ADC FIFO, used in place of machine.mem32 and rp2.DMA,
+# e.g. Burst(adc, mem=fake, dma=fake.dma). Addresses and bits as in
+# burst.py. Conversions happen as the DMA channel is polled (busy(),
+# wait()), a few per poll, as if time went by between polls.
+
+ADC_BASE = 0x4004c000
+CS_START_MANY = 1 << 3
+CS_AINSEL_SHIFT = 12
+FCS_SHIFT = 1 << 1
+FCS_EMPTY = 1 << 8
+FCS_FULL = 1 << 9
+FCS_UNDER = 1 << 10
+FCS_OVER = 1 << 11
+FCS_LEVEL_SHIFT = 16
+
+class ADCFake:
+  __doc__ = \
+  '''RP2040 ADC register fake, indexed like machine.mem32.
+  fake = ADCFake(SOURCE)
+    where:
+      SOURCE       function(ainsel, i), 12 bit value of conversion i
+  Class functions:
+    dma()          DMA channel fake, same calls as rp2.DMA
+    convert(n)     runs n conversions into the FIFO, if started
+  Class members:
+    cs, fcs, div   CS, FCS and DIV registers
+    fifo           conversions not read yet
+    conversions    conversions so far'''
+
+  def help(self):
+    print(self.__doc__)
+
+  FIFO_DEPTH = 4
+  PER_POLL = 3 # conversions per DMA poll
+
+  def __init__(self, source):
+    self.source = source
+    self.cs = 0
+    self.fcs = 0
+    self.div = 0
+    self.fifo = []
+    self.conversions = 0
+
+  def __getitem__(self, addr):
+    reg = addr - ADC_BASE
+    if reg == 0x00: return self.cs
+    if reg == 0x08:
+      n = len(self.fifo)
+      fcs = self.fcs | (n << FCS_LEVEL_SHIFT)
+      if n == 0: fcs |= FCS_EMPTY
+      if n == self.FIFO_DEPTH: fcs |= FCS_FULL
+      return fcs
+    if reg == 0x0c:
+      if self.fifo: return self.fifo.pop(0)
+      self.fcs |= FCS_UNDER
+      return 0
+    if reg == 0x10: return self.div
+    raise ValueError(f'ADC register 0x{addr:08x} not emulated')
+
+  def __setitem__(self, addr, value):
+    reg = addr - ADC_BASE
+    if reg == 0x00: self.cs = value
+    # UNDER and OVER are write one to clear
+    elif reg == 0x08:
+      flags = self.fcs & (FCS_UNDER | FCS_OVER) & ~value
+      self.fcs = (value & ~(FCS_UNDER | FCS_OVER)) | flags
+    elif reg == 0x10: self.div = value
+    else: raise ValueError(f'ADC register 0x{addr:08x} not emulated')
+
+  def convert(self, n):
+    if not self.cs & CS_START_MANY: return
+    ainsel = (self.cs >> CS_AINSEL_SHIFT) & 7
+    for i in range(n):
+      val = self.source(ainsel, self.conversions) & 0xfff
+      self.conversions += 1
+      if self.fcs & FCS_SHIFT: val >>= 4
+      if len(self.fifo) == self.FIFO_DEPTH:
+        self.fcs |= FCS_OVER
+      else:
+        self.fifo.append(val)
+
+  def dma(self):
+    return DMAFake(self)
+
+class DMAFake:
+  # One channel moving the ADC FIFO into a buffer, the calls
+  # Burst makes on rp2.DMA.
+
+  def __init__(self, adc):
+    self.adc = adc
+    self.handler = None
+    self.write = None
+    self.count = 0
+    self.index = 0
+    self.enabled = False
+    self.closed = False
+
+  def pack_ctrl(self, **kwargs):
+    return kwargs
+
+  def irq(self, handler=None):
+    self.handler = handler
+
+  def config(self, read=None, write=None, count=0, ctrl=None, trigger=False):
+    self.write = write
+    self.count = count
+    self.index = 0
+    self.enabled = trigger
+
+  def active(self, value=None):
+    if value is not None:
+      self.enabled = bool(value)
+      return self.enabled
+    if not self.enabled: return False
+    adc = self.adc
+    adc.convert(adc.PER_POLL)
+    while adc.fifo and self.index < self.count:
+      self.write[self.index] = adc.fifo.pop(0)
+      self.index += 1
+    if self.index == self.count:
+      self.enabled = False
+      if self.handler is not None: self.handler(self)
+    return self.enabled
+
+  def close(self):
+    self.enabled = False
+    self.closed = True
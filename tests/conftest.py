@@ -0,0 +1,210 @@
+# Host (CPython) test support: the modules in flash/lib are written
+# for MicroPython on the RP2040. The few MicroPython-only modules and
+# time functions they import are stood in for here, with just enough
+# behaviour for the code under test: the board hardware itself is
+# modelled by the fakes below, or by the injectable register fakes
+# next to this file (siofake.py, adcfake.py).
+
+import builtins
+import os
+import sys
+import time
+import types
+
+import pytest
+
+LIB = os.path.join(os.path.dirname(__file__), '..', 'flash', 'lib')
+sys.path.insert(0, os.path.abspath(LIB))
+
+# MicroPython time extensions
+T0 = time.perf_counter_ns()
+def ticks_us(): return (time.perf_counter_ns() - T0) // 1000
+def ticks_ms(): return (time.perf_counter_ns() - T0) // 1_000_000
+def ticks_diff(a, b): return a - b
+def ticks_add(a, b): return a + b
+def sleep_us(us): time.sleep(us / 1_000_000)
+def sleep_ms(ms): time.sleep(ms / 1000)
+for f in (ticks_us, ticks_ms, ticks_diff, ticks_add, sleep_us, sleep_ms):
+  if not hasattr(time, f.__name__): setattr(time, f.__name__, f)
+
+# viper pointer annotations
+for name in ('ptr8', 'ptr16', 'ptr32'):
+  if not hasattr(builtins, name): setattr(builtins, name, lambda x: x)
+
+# --- machine ---------------------------------------------------------
+machine = types.ModuleType('machine')
+
+class Pin:
+  IN = 0
+  OUT = 1
+  OPEN_DRAIN = 2
+  PULL_UP = 1
+  PULL_DOWN = 2
+  def __init__(self, id, mode=None, pull=None, value=None):
+    self.id = id
+    self.v = value or 0
+  def init(self, *args, **kwargs): pass
+  def on(self): self.value(1)
+  def off(self): self.value(0)
+  def value(self, v=None):
+    if v is None: return self.v
+    self.v = 1 if v else 0
+  def __call__(self, v=None): return self.value(v)
+
+class SPI:
+  MSB = 0
+  def __init__(self, id, **kwargs):
+    self.writes = 0
+    self.last = b''
+  def init(self, **kwargs): pass
+  def write(self, buf):
+    self.writes += 1
+    self.last = bytes(buf)
+
+class ADC:
+  # read_u16() returns ADC.sources[gpio](), 0 if none set
+  sources = {}
+  def __init__(self, pin):
+    self.gpio = pin.id if isinstance(pin, Pin) else pin
+  def read_u16(self):
+    source = ADC.sources.get(self.gpio)
+    return source() if source else 0
+
+class PWM:
+  def __init__(self, pin, freq=0, duty_u16=0):
+    self.duty = duty_u16
+  def duty_u16(self, duty=None):
+    if duty is None: return self.duty
+    self.duty = duty
+
+class Timer:
+  PERIODIC = 1
+  ONE_SHOT = 0
+  def __init__(self, *args, **kwargs):
+    self.callback = kwargs.get('callback')
+  def init(self, **kwargs): self.callback = kwargs.get('callback')
+  def deinit(self): self.callback = None
+
+class UART:
+  def __init__(self, *args, **kwargs): pass
+
+class Mem32(dict):
+  def __missing__(self, addr): return 0
+
+machine.Pin = Pin
+machine.SPI = SPI
+machine.ADC = ADC
+machine.PWM = PWM
+machine.Timer = Timer
+machine.UART = UART
+machine.mem32 = Mem32()
+machine.freq = lambda: 125_000_000
+sys.modules.setdefault('machine', machine)
+
+# --- micropython -----------------------------------------------------
+micropython = types.ModuleType('micropython')
+micropython.const = lambda x: x
+micropython.viper = lambda f: f
+micropython.native = lambda f: f
+micropython.schedule = lambda f, arg: f(arg)
+micropython.kbd_intr = lambda c: None
+sys.modules.setdefault('micropython', micropython)
+
+# --- rp2 -------------------------------------------------------------
+rp2 = types.ModuleType('rp2')
+class PIO:
+  SHIFT_LEFT = 0
+  SHIFT_RIGHT = 1
+  JOIN_RX = 2
+rp2.PIO = PIO
+rp2.asm_pio = lambda **kwargs: (lambda f: f)
+rp2.StateMachine = None
+rp2.DMA = None
+sys.modules.setdefault('rp2', rp2)
+
+
+# --- board -----------------------------------------------------------
+class Board:
+  # Shift register, SPI0 arbiter and Analog, with the AMUX input
+  # following the shift register word last written: volts[ch] gives
+  # the read_u16() value of MUX channel ch, isense the current sense.
+  def __init__(self):
+    import spibus
+    import sr595
+    import analog
+    from bp5pins import PIN_ANALOG_MUX, PIN_CURRENT_SENSE
+    self.volts = [0] * 16
+    self.isense = 0
+    self.bus = spibus.SPIBus()
+    self.spi_sr = self.bus.device('sr', baudrate=12_500_000)
+    self.sr = sr595.SR(self.spi_sr)
+    ADC.sources[PIN_ANALOG_MUX] = self.amux
+    ADC.sources[PIN_CURRENT_SENSE] = lambda: self.isense
+    self.adc = analog.Analog(self.sr, None)
+
+  def word(self):
+    last = self.bus.spi.last
+    return (last[0] << 8) | last[1] if last else 0
+
+  def amux(self):
+    word = self.word()
+    if word & 1: return 0 # AMUX_EN, active low
+    return self.volts[(word >> 1) & 0x0f]
+
+@pytest.fixture
+def board(tmp_path, monkeypatch):
+  # calibration files land in a scratch directory
+  monkeypatch.chdir(tmp_path)
+  return Board()
+
+# --- PIO capture -----------------------------------------------------
+class PIOFake:
+  # FSTAT, FDEBUG and the RX FIFO of the capture state machine,
+  # samples packed four to a FIFO word, first in the lowest byte;
+  # addresses reach it through the ptr32 of the pio fixture
+  SM_ID = 4
+  SLOW_CYCLES = 32
+
+  def __init__(self, samples, size=16):
+    import logic
+    self.FSTAT = logic.PIO_FSTAT
+    self.FDEBUG = logic.PIO_FDEBUG
+    samples = samples + [0] * (-len(samples) % 4)
+    self.words = [ sum(samples[i + k] << (8 * k) for k in range(4))
+                   for i in range(0, len(samples), 4) ]
+    self.fdebug = 0
+    self.buf = bytearray(size)
+
+  # logic.Logic stand-in
+  def start_sm(self, rate):
+    self.fdebug = 0
+    return self
+  def active(self, on): pass
+
+  def __getitem__(self, addr):
+    if addr == self.FDEBUG: return self.fdebug
+    if addr == self.FSTAT:
+      if not self.words: raise RuntimeError('samples ran out')
+      return 0
+    return self.words.pop(0)
+
+  def __setitem__(self, addr, value):
+    if addr == self.FDEBUG: self.fdebug &= ~value
+
+class Reg:
+  def __init__(self, pio, addr):
+    self.pio = pio
+    self.addr = addr
+  def __getitem__(self, i): return self.pio[self.addr]
+  def __setitem__(self, i, value): self.pio[self.addr] = value
+
+@pytest.fixture
+def pio(monkeypatch):
+  box = []
+  def ptr32(x):
+    return Reg(box[0], x) if isinstance(x, int) else x
+  monkeypatch.setattr(builtins, 'ptr32', ptr32)
+  def make(samples, size=16):
+    box[:] = [ PIOFake(samples, size) ]
+    return box[0]
+  return make
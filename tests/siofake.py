@@ -0,0 +1,50 @@
+# Host stand-in for the RP2040 SIO GPIO registers, used in place of
+# machine.mem32, e.g. BP5IO(sr, disp, mem=SIOFake()).
+# Addresses as in bp5io.py. GPIO_IN reads the driven level of
+# output pins and the 'pins' member for the others.
+
+SIO_BASE = 0xd0000000
+GPIO_MASK = 0x3fffffff # GPIO0..29
+
+class SIOFake:
+  __doc__ = \
+  '''RP2040 SIO GPIO register fake, indexed like machine.mem32.
+  mem = SIOFake()
+  Class members:
+    out            GPIO_OUT register
+    oe             GPIO_OE register
+    pins           levels driven from outside, on input pins
+    writes         register writes so far
+    log            (address, value) of each write, in order'''
+
+  def help(self):
+    print(self.__doc__)
+
+  def __init__(self):
+    self.out = 0
+    self.oe = 0
+    self.pins = 0
+    self.writes = 0
+    self.log = []
+
+  def __getitem__(self, addr):
+    reg = addr - SIO_BASE
+    if reg == 0x004: return (self.out & self.oe) | (self.pins & ~self.oe & GPIO_MASK)
+    if reg == 0x010: return self.out
+    if reg == 0x020: return self.oe
+    raise ValueError(f'SIO register 0x{addr:08x} not emulated')
+
+  def __setitem__(self, addr, value):
+    reg = addr - SIO_BASE
+    value &= GPIO_MASK
+    self.writes += 1
+    self.log.append((addr, value))
+    if   reg == 0x010: self.out = value
+    elif reg == 0x014: self.out |= value
+    elif reg == 0x018: self.out &= ~value
+    elif reg == 0x01c: self.out ^= value
+    elif reg == 0x020: self.oe = value
+    elif reg == 0x024: self.oe |= value
+    elif reg == 0x028: self.oe &= ~value
+    elif reg == 0x02c: self.oe ^= value
+    else: raise ValueError(f'SIO register 0x{addr:08x} not emulated')
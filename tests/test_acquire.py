@@ -0,0 +1,31 @@
+def test_acquire_fills_ring(board):
+  adc = board.adc
+  for ch in range(12): board.volts[ch] = 100 * ch
+  ring = adc.start(channels=(adc.VUSB, adc.VREG_OUT), rate=100, depth=8)
+  for i in range(3): adc.timer.callback(adc.timer)
+  assert ring.available() == 3
+  assert list(ring.window(1)) == [ 800, 1000 ]
+  adc.stop()
+
+def test_tick_during_read_is_skipped(board):
+  # a timer tick landing between select and read_u16 of read(ch)
+  # must not move the mux under it
+  adc = board.adc
+  for ch in range(12): board.volts[ch] = 1000 + ch
+  ring = adc.start(channels=(adc.VUSB,), rate=100, depth=8)
+  amux = board.amux
+  def tick_then_read():
+    adc.acquire()
+    return amux()
+  board.volts[adc.VREG_OUT] = 4000
+  from machine import ADC
+  from bp5pins import PIN_ANALOG_MUX
+  ADC.sources[PIN_ANALOG_MUX] = tick_then_read
+  assert adc.read(adc.VREG_OUT) == 4000 * adc.vscale[adc.VREG_OUT]
+  n = adc.oversample(adc.VREG_OUT, n=4)
+  assert n == adc.oversample(adc.VREG_OUT, n=4)
+  assert adc.skipped > 0 and ring.available() == 0
+  ADC.sources[PIN_ANALOG_MUX] = amux
+  adc.acquire()
+  assert ring.available() == 1
+  adc.stop()
@@ -0,0 +1,88 @@
+import os
+import pytest
+import adccal
+
+RAMP = os.path.join(os.path.dirname(__file__), '..', 'docs',
+                    'power_supply_ramp.txt')
+
+# docs/power_supply_ramp.txt: PWM model output (Vout) against the
+# ADC reading of VREG_OUT (Vadc), 10 mV resolution
+def ramp():
+  nominal = []
+  actual = []
+  with open(RAMP) as f:
+    for line in f:
+      words = line.split()
+      if words[:1] != [ 'Vpwm' ]: continue
+      nominal.append( float(words[3]) )
+      actual.append( float(words[5]) )
+  return nominal, actual
+
+def test_fit_ramp():
+  nominal, actual = ramp()
+  assert len(nominal) == 33
+  before = adccal.residuals(nominal, actual, 1.0, 0.0)
+  gain, offset = adccal.fit(nominal, actual)
+  after = adccal.residuals(nominal, actual, gain, offset)
+  assert before == pytest.approx(0.03, abs=0.001)
+  assert after < 0.014
+  assert gain == pytest.approx(1.0, abs=0.01)
+  assert 0.0 < offset < 0.03
+
+def test_fit_exact():
+  nominal = [ 0.5, 1.0, 2.0, 4.0 ]
+  actual = [ 1.02 * x - 0.015 for x in nominal ]
+  gain, offset = adccal.fit(nominal, actual)
+  assert gain == pytest.approx(1.02)
+  assert offset == pytest.approx(-0.015)
+  assert adccal.residuals(nominal, actual, gain, offset) < 1e-9
+
+def test_fit_rejects():
+  with pytest.raises(ValueError):
+    adccal.fit([ 1.0 ], [ 1.0 ])
+  with pytest.raises(ValueError):
+    adccal.fit([ 1.0, 1.0 ], [ 1.0, 2.0 ])
+  with pytest.raises(ValueError):
+    adccal.fit([ 1.0, 2.0 ], [ 1.0 ])
+
+def test_table_round_trip(tmp_path):
+  cal = adccal.Calibration(str(tmp_path / 'adc.cal'))
+  assert not cal.load()
+  cal.set(3, 1.0125, -0.0042)
+  cal.set(adccal.ISENSE, 0.98, 1.5)
+  cal.save()
+  assert os.path.getsize(cal.filename) == 5 + 8 * adccal.NCAL
+  back = adccal.Calibration(cal.filename)
+  assert back.load()
+  assert back.gains == cal.gains and back.offsets == cal.offsets
+  assert back.get(3) == pytest.approx((1.0125, -0.0042))
+
+@pytest.mark.parametrize('cut', [ 0, 3, 5, 40 ])
+def test_bad_table_falls_back(tmp_path, cut):
+  cal = adccal.Calibration(str(tmp_path / 'adc.cal'))
+  cal.set(3, 1.0125, -0.0042)
+  cal.save()
+  with open(cal.filename, 'r+b') as f:
+    f.truncate(cut)
+  cal.set(4, 1.5, 0.5)
+  assert not cal.load()
+  assert cal.gains == [ adccal.UNITY ] * adccal.NCAL
+  assert cal.offsets == [ 0 ] * adccal.NCAL
+
+def test_foreign_table(tmp_path):
+  cal = adccal.Calibration(str(tmp_path / 'adc.cal'))
+  with open(cal.filename, 'wb') as f:
+    f.write(b'BPXX' + bytes(1 + 8 * adccal.NCAL))
+  assert not cal.load()
+
+def test_apply_cal(board):
+  adc = board.adc
+  nominal, actual = ramp()
+  gain, offset, worst = adc.calibrate(adc.VREG_OUT, nominal, actual)
+  assert worst < 0.014
+  # calibrated integer and float paths agree
+  board.volts[adc.VREG_OUT] = 2048 << 4
+  volts = adc.read(adc.VREG_OUT)
+  assert volts == pytest.approx(3.3 * gain + offset, abs=1e-4)
+  mv16 = adc.oversample(adc.VREG_OUT, 16)
+  assert mv16 / 16000 == pytest.approx(volts, abs=1e-3)
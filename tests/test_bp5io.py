@@ -0,0 +1,58 @@
+import pytest
+
+from machine import Pin
+
+import bp5io
+import siofake
+
+@pytest.fixture
+def io(board):
+  yield bp5io.BP5IO(board.sr, None, mem=siofake.SIOFake())
+  # the BP5BIT objects are shared by the class
+  for bit in bp5io.BP5IO.bits: bit.direction = Pin.IN
+
+def test_read_port(io):
+  mem = io.mem
+  # IO0..7 are GPIO8..15, the direction pins below stay out of it
+  mem.pins = 0xa5 << 8 | 0x3c
+  assert io.read_port() == 0xa5
+  io.set_dir(0x0f)
+  io.write_port(0x03)
+  # outputs read back their driven level
+  assert io.read_port() == 0xa3
+
+def test_write_port_mask(io):
+  mem = io.mem
+  io.set_dir(0xff)
+  io.write_port(0xf0)
+  assert mem.out >> 8 == 0xf0
+  writes = mem.writes
+  # only the masked bits change, in one write
+  io.write_port(0x0f, mask=0x3c)
+  assert mem.writes == writes + 1
+  assert mem.out >> 8 == 0xcc
+  io.write_port(0x00, mask=0x00)
+  assert mem.out >> 8 == 0xcc
+  # direction pins untouched by port writes
+  assert mem.out & 0xff == 0xff
+
+def test_set_dir_order(io):
+  mem = io.mem
+  io.set_dir(0x0f)
+  # shifter first, then the GPIO output enable
+  assert mem.log == [ (bp5io.SIO_GPIO_OUT_SET, 0x0f),
+                      (bp5io.SIO_GPIO_OE_SET, 0x0f << 8) ]
+  assert io.get_dir() == 0x0f
+  assert [ b.direction for b in io.bits ] == [ Pin.OUT ] * 4 + [ Pin.IN ] * 4
+  mem.log.clear()
+  io.set_dir(0x3c)
+  # GPIO output enable off first, then the shifter back to input
+  assert mem.log == [ (bp5io.SIO_GPIO_OE_CLR, 0x03 << 8),
+                      (bp5io.SIO_GPIO_OUT_CLR, 0x03),
+                      (bp5io.SIO_GPIO_OUT_SET, 0x30),
+                      (bp5io.SIO_GPIO_OE_SET, 0x30 << 8) ]
+  assert io.get_dir() == 0x3c
+  assert mem.out & 0xff == 0x3c
+  mem.log.clear()
+  io.set_dir(0x3c)
+  assert mem.log == []
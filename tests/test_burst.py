@@ -0,0 +1,85 @@
+import pytest
+import adcfake
+import burst
+
+# inrush on the current sense: rises to a peak at sample 20, then
+# halves its excursion every sample down to the final level, 12 bit
+def inrush(i):
+  if i < 20: return 200 + i * 140
+  return 1000 + (2050 >> (i - 20))
+
+def make(board, source, nsamples=256, bits=12):
+  fake = adcfake.ADCFake(source)
+  b = burst.Burst(board.adc, nsamples, bits, mem=fake, dma=fake.dma)
+  return fake, b
+
+def test_arm_waits_for_trigger(board):
+  fake, b = make(board, lambda ainsel, i: i)
+  b.arm(board.adc.ISENSE, rate=100_000)
+  assert fake.div == 48_000_000 * 256 // 100_000 - 256
+  assert (fake.cs >> burst.CS_AINSEL_SHIFT) & 7 == b.AIN_ISENSE
+  assert not fake.cs & burst.CS_START_MANY
+  # armed, not converting
+  for i in range(10): assert b.busy()
+  assert fake.conversions == 0
+  b.trigger()
+  assert b.wait()
+  assert list(b.buf) == list(range(256))
+
+def test_halt_restores_one_shot(board):
+  done = []
+  fake, b = make(board, lambda ainsel, i: 0x123)
+  b.start(board.adc.VREG_OUT, rate=500_000, callback=done.append)
+  # the mux was switched for the burst
+  assert board.word() & 0x1f == board.adc.mux_word(board.adc.VREG_OUT)
+  assert (fake.cs >> burst.CS_AINSEL_SHIFT) & 7 == b.AIN_AMUX
+  assert b.wait()
+  assert done == [ b ]
+  assert b.dma is None
+  assert fake.cs == burst.CS_EN and fake.fcs & ~burst.FCS_EMPTY == 0
+  assert fake.div == 0 and fake.fifo == []
+  # and deselected after
+  assert board.word() & board.sr.MASK_AMUX_EN
+
+def test_stop_aborts(board):
+  fake, b = make(board, lambda ainsel, i: i)
+  b.start(board.adc.ISENSE)
+  b.busy()
+  b.stop()
+  assert not b.busy()
+  assert fake.cs == burst.CS_EN
+
+def test_eight_bits(board):
+  fake, b = make(board, lambda ainsel, i: i << 4, nsamples=100, bits=8)
+  b.start(board.adc.ISENSE)
+  assert b.wait()
+  assert isinstance(b.buf, bytearray)
+  assert list(b.buf) == [ i & 0xff for i in range(100) ]
+
+def test_rate_range(board):
+  fake, b = make(board, lambda ainsel, i: 0)
+  with pytest.raises(ValueError):
+    b.arm(board.adc.ISENSE, rate=600_000)
+  with pytest.raises(ValueError):
+    b.arm(board.adc.ISENSE, rate=500)
+
+def test_waveform(board):
+  adc = board.adc
+  fake, b = make(board, lambda ainsel, i: inrush(i))
+  b.start(adc.ISENSE, rate=100_000)
+  assert b.wait()
+  wave = b.waveform()
+  assert wave.isense
+  assert wave.t_peak == 200 # sample 20 at 10 usec
+  assert wave.peak == b.mv(20)
+  assert wave.peak == pytest.approx(3050 * 500_000 / 4096, abs=200)
+  assert wave.final == b.scale(1000)
+  # within 1/16 of the excursion (128) from sample 24 on
+  assert wave.t_settle == 240
+  assert b.peak() == (20, wave.peak)
+
+def test_waveform_never_settles(board):
+  fake, b = make(board, lambda ainsel, i: 1000 + (i % 2) * 1500)
+  b.start(board.adc.ISENSE)
+  assert b.wait()
+  assert b.waveform().t_settle is None
@@ -0,0 +1,65 @@
+import adcfake
+import burst
+from ocp import Watchdog
+from power import Power
+
+def setup(board):
+  psu = Power(board.sr, board.adc)
+  ocp = Watchdog(psu)
+  ocp.start(limit=100)
+  return psu, ocp
+
+def test_trip(board):
+  psu, ocp = setup(board)
+  board.isense = 0x8000 # 250 mA
+  ocp.check()
+  assert ocp.tripped and ocp.ntrips == 1
+  assert psu.pwm_iadj.duty_u16() == 0
+  assert board.sr.outputs & board.sr.MASK_CURRENT_EN
+
+def test_skips_inside_foreground_reads(board):
+  # the watchdog interrupt fires in the middle of each conversion
+  psu, ocp = setup(board)
+  adc = board.adc
+  board.isense = 0x8000
+  reads = []
+  def amux():
+    ocp.check()
+    reads.append(adc.claims)
+    return board.amux()
+  machine_adc = type(adc.amux)
+  machine_adc.sources[adc.amux.gpio] = amux
+  adc.read(adc.VREG_OUT)
+  adc.oversample(adc.VREG_OUT, 16)
+  adc.scan()
+  assert not ocp.tripped
+  assert ocp.skipped == len(reads) == 1 + 16 + adc.NCHAN
+  assert adc.claims == 0
+  ocp.check()
+  assert ocp.tripped
+
+def test_skips_during_burst(board):
+  psu, ocp = setup(board)
+  board.isense = 0x8000
+  fake = adcfake.ADCFake(lambda ainsel, i: 100)
+  b = burst.Burst(board.adc, 64, mem=fake, dma=fake.dma)
+  b.arm(board.adc.ISENSE, rate=100_000)
+  ocp.check()
+  b.trigger()
+  while b.busy(): ocp.check()
+  # AINSEL left alone for the whole burst
+  assert not ocp.tripped and ocp.skipped > 2
+  assert list(b.buf) == [ 100 ] * 64
+  assert board.adc.claims == 0
+  ocp.check()
+  assert ocp.tripped
+
+def test_claim_released_on_error(board):
+  adc = board.adc
+  def fail(): raise KeyboardInterrupt
+  type(adc.amux).sources[adc.amux.gpio] = fail
+  try:
+    adc.oversample(adc.VREG_OUT)
+  except KeyboardInterrupt:
+    pass
+  assert adc.claims == 0
@@ -0,0 +1,24 @@
+import pytest
+
+@pytest.mark.parametrize('n', [ 1, 4, 16, 64, 256, 512, 1024 ])
+def test_isense_ua_full_scale(board, n):
+  adc = board.adc
+  board.isense = 0xfff0 # 12 bit full scale
+  ua = adc.isense_ua(n)
+  assert abs(ua - 4095 * 500_000 / 4096) < 16
+  # largest product of the integer path stays a small int
+  assert ((1 << adc.UA_MAX_BITS) - 1) * 2 * adc.UA_FULL_SCALE < 1 << 30
+  assert ua == pytest.approx(adc.isense() * 1000, abs=16)
+
+@pytest.mark.parametrize('n', [ 1, 16, 256, 1024 ])
+def test_oversample_mv16(board, n):
+  adc = board.adc
+  board.volts[adc.VREG_OUT] = 2048 << 4 # half scale, 3.3 V
+  mv16 = adc.oversample(adc.VREG_OUT, n)
+  assert mv16 == 3300 * 16
+
+def test_oversample_rejects(board):
+  with pytest.raises(ValueError):
+    board.adc.oversample(board.adc.VUSB, n=48)
+  with pytest.raises(ValueError):
+    board.adc.isense_ua(2048)
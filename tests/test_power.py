@@ -0,0 +1,243 @@
+import pytest
+
+from power import Power
+
+@pytest.fixture
+def psu(board):
+  return Power(board.sr, board.adc)
+
+def ramp_readings(psu, monkeypatch, volts):
+  readings = iter( [ int(v * 16000) for v in volts ] )
+  monkeypatch.setattr(psu, 'wait_stable', lambda: next(readings))
+
+def nominal(psu):
+  return [ psu.vpwm2vout(i / 10) for i in range(psu.RAMP_POINTS) ]
+
+def test_ramp_table(psu, monkeypatch):
+  ramp_readings(psu, monkeypatch, nominal(psu))
+  psu.ramp(verbose=False)
+  assert len(psu.table_mv) == psu.RAMP_POINTS
+  assert psu.monotonic(psu.table_duty, psu.table_mv, -1)
+  duty = psu.vout2duty(3.3)
+  assert psu.duty2vout(duty) == pytest.approx(3.3, abs=0.001)
+  psu.clear_table()
+  assert psu.load_table()
+  assert list(psu.table_mv) == sorted(int(v * 16000) for v in nominal(psu))
+
+def test_ramp_drops_flat_top(psu, monkeypatch):
+  # output saturates at 4.6 V for the lowest PWM settings
+  volts = [ min(v, 4.6) for v in nominal(psu) ]
+  ramp_readings(psu, monkeypatch, volts)
+  psu.ramp(verbose=False)
+  assert psu.table_mv[-1] == 4.6 * 16000
+  assert psu.table_mv[-2] < psu.table_mv[-1]
+  assert len(psu.table_mv) < psu.RAMP_POINTS
+  # no division by zero on the flat part
+  assert psu.vout2duty(4.6) == psu.table_duty[-1]
+  assert psu.vout2duty(4.8) == psu.table_duty[-1]
+
+def test_ramp_rejects_out_of_order(psu, monkeypatch):
+  volts = nominal(psu)
+  volts[10] = volts[11]
+  ramp_readings(psu, monkeypatch, volts)
+  with pytest.raises(RuntimeError):
+    psu.ramp(verbose=False)
+  assert psu.table_mv is None
+  assert not psu.load_table()
+
+def test_load_ignores_bad_table(psu):
+  psu.write_table( psu.VREG_CAL_FILE, psu.VREG_CAL_MAGIC,
+                   [ 3000, 2000, 1000 ], [ 16000, 16000, 32000 ] )
+  assert not psu.load_table()
+  assert psu.table_mv is None
+  psu.write_table( psu.ILIM_CAL_FILE, psu.ILIM_CAL_MAGIC,
+                   [ 1000, 1000 ], [ 25000, 50000 ] )
+  psu.load_table()
+  assert psu.ilim_ua is None
+  psu.table_duty = [ 1, 2 ]
+  psu.table_mv = [ 16000, 32000 ]
+  with pytest.raises(ValueError):
+    psu.save_table()
+
+@pytest.mark.parametrize('cut', [ 0, 3, 5, 10, 22 ])
+def test_load_ignores_truncated_table(psu, cut):
+  psu.write_table( psu.VREG_CAL_FILE, psu.VREG_CAL_MAGIC,
+                   [ 3000, 2000, 1000 ], [ 16000, 24000, 32000 ] )
+  assert psu.load_table()
+  with open(psu.VREG_CAL_FILE, 'r+b') as f:
+    f.truncate(cut)
+  assert psu.read_table( psu.VREG_CAL_FILE, psu.VREG_CAL_MAGIC ) == (None, None)
+  assert not psu.load_table()
+
+def capture_psu(board):
+  import adcfake
+  import burst
+  fake = adcfake.ADCFake(lambda ainsel, i: 1000)
+  b = burst.Burst(board.adc, 64, mem=fake, dma=fake.dma)
+  return Power(board.sr, board.adc, b), b
+
+def test_capture_from_off(board):
+  psu, b = capture_psu(board)
+  psu.disable()
+  commits = board.sr.commits
+  wave = psu.enable(capture=True)
+  assert wave is not None
+  assert board.sr.commits == commits + 1
+  assert not board.word() & board.sr.MASK_CURRENT_EN
+  assert list(b.buf) == [ 1000 ] * 64
+
+def test_capture_mux_channel(board, monkeypatch):
+  import adcfake
+  import burst
+  fake = adcfake.ADCFake(lambda ainsel, i: 1000)
+  b = burst.Burst(board.adc, 64, mem=fake, dma=fake.dma)
+  psu = Power(board.sr, board.adc, b)
+  psu.disable()
+  # MUX off, so arm() has a select to commit
+  board.adc.deselect()
+  spi = board.bus.spi
+  seen = []
+  write = spi.write
+  def spy(buf):
+    write(buf)
+    seen.append((board.word(), bool(fake.cs & adcfake.CS_START_MANY)))
+  monkeypatch.setattr(spi, 'write', spy)
+  adc = board.adc
+  assert psu.enable(capture=True, channel=adc.VREG_OUT) is not None
+  en = board.sr.MASK_CURRENT_EN
+  # the MUX select leaves VREG off, the next commit enables it with
+  # the burst already running
+  select, commit = seen[0], seen[1]
+  assert select[0] & en and not select[0] & board.sr.MASK_AMUX_EN
+  assert select[0] & adc.MASK_AMUX == adc.mux_word(adc.VREG_OUT)
+  assert not select[1]
+  assert not commit[0] & en and commit[1]
+  assert all( not word & en for word, started in seen[1:] )
+
+def test_capture_refused_when_on(board):
+  psu, b = capture_psu(board)
+  # Power() leaves VREG enabled
+  commits = board.sr.commits
+  with pytest.raises(RuntimeError):
+    psu.enable(capture=True)
+  assert board.sr.commits == commits
+  assert b.dma is None and board.adc.claims == 0
+
+METER_FIELDS = ( 'energy_frac', 'energy_uwh', 'energy_mwh', 'charge_frac',
+                 'charge_mas', 'metered_ms', 'metered_s', 'peak_uw',
+                 'p_last', 'i_last' )
+
+def test_meter_stays_small(psu, board, monkeypatch):
+  import time
+  now = [ 0 ]
+  monkeypatch.setattr(time, 'ticks_ms', lambda: now[0])
+  adc = board.adc
+  board.volts[adc.VREG_OUT] = 0xfff0 # beyond the supply's range
+  board.isense = 0xfff0
+  psu.meter_reset()
+  psu.meter_step()
+  mv16 = adc.oversample(adc.VREG_OUT, psu.METER_OVERSAMPLE)
+  ua = adc.isense_ua(psu.METER_OVERSAMPLE)
+  uw = min(mv16 >> 4, psu.METER_MAX_MV) * (min(ua, psu.METER_MAX_UA) >> 3) // 125
+  total = 0
+  for dt in [ 100 ] * 5000 + [ 60_000, 1, 250 ]:
+    now[0] += dt
+    psu.meter_step()
+    total += dt
+    for name in METER_FIELDS:
+      assert getattr(psu, name) < 1 << 30, name
+  t, ms, n, uwh, uas, avg, peak = psu.snapshot()
+  assert (ms, n, peak, avg) == (total, 5004, uw, uw)
+  assert uwh == uw * total // 3_600_000
+  assert uas == min(ua, psu.METER_MAX_UA) * total // 1000
+
+def test_meter_small_load(psu, board, monkeypatch):
+  import time
+  now = [ 0 ]
+  monkeypatch.setattr(time, 'ticks_ms', lambda: now[0])
+  adc = board.adc
+  board.volts[adc.VREG_OUT] = 2048 << 4 # 3.3 V
+  board.isense = 0x0830 # about 8 mA
+  psu.meter_reset()
+  for i in range(37):
+    psu.meter_step()
+    now[0] += 100
+  t, ms, n, uwh, uas, avg, peak = psu.snapshot()
+  ua = adc.isense_ua(psu.METER_OVERSAMPLE)
+  assert ms == 3600
+  assert avg == pytest.approx(3.3 * ua, rel=0.002)
+  assert uwh == avg * 3600 // 3_600_000
+  assert uas == ua * 3600 // 1000
+
+def settle(psu, monkeypatch, readings, step_ms=1):
+  # one reading per step_ms, mv16 from readings(i)
+  import time
+  now = [ 0 ]
+  i = [ 0 ]
+  monkeypatch.setattr(time, 'ticks_ms', lambda: now[0])
+  def measure():
+    now[0] += step_ms
+    i[0] += 1
+    return readings(i[0] - 1)
+  monkeypatch.setattr(psu, 'measure_mv16', measure)
+  return psu.wait_stable(), i[0]
+
+def test_settle_noisy_flat(psu, monkeypatch):
+  mv16, reads = settle(psu, monkeypatch,
+                       lambda i: 48000 + (16 if i & 1 else -16))
+  assert psu.settled
+  assert abs(mv16 - 48000) <= 16
+  assert psu.settle_ms >= psu.SETTLE_DWELL_MS
+  assert reads == psu.SETTLE_DWELL_MS + 1
+
+def test_settle_waits_out_slow_drift(psu, monkeypatch):
+  # 1 mV per reading, inside the 2 mV band reading to reading,
+  # then flat from reading 100
+  mv16, reads = settle(psu, monkeypatch,
+                       lambda i: 48000 + 16 * min(i, 100))
+  assert psu.settled
+  assert reads > 100
+  assert mv16 == 48000 + 1600
+
+def test_settle_timeout(psu, monkeypatch):
+  mv16, reads = settle(psu, monkeypatch, lambda i: 48000 + 16 * i)
+  assert not psu.settled
+  assert psu.settle_ms > psu.SETTLE_TIMEOUT_MS
+
+def trip_model(psu, board, monkeypatch, ohms, gain):
+  # resistive load, the limiter trips above gain x its nominal
+  # current, VREG_OUT collapsing to 0.1 V
+  def load_ma(): return psu.voltage() / ohms * 1000
+  def wait_stable():
+    held = load_ma() <= gain * psu.pwm_iadj.duty_u16() / psu.ISCALE_FACTOR
+    on = not board.sr.pending & board.sr.MASK_CURRENT_EN
+    return int(psu.voltage() * 16000) if held and on else 1600
+  monkeypatch.setattr(psu, 'wait_stable', wait_stable)
+  monkeypatch.setattr(board.adc, 'isense_ua', lambda n: int(load_ma() * 1000))
+
+@pytest.mark.parametrize('off', [ True, False ])
+def test_calibrate_current(psu, board, monkeypatch, off):
+  trip_model(psu, board, monkeypatch, 10, 1.25)
+  if off: psu.disable()
+  dsave = psu.pwm_vreg.duty_u16()
+  isave = psu.pwm_iadj.duty_u16()
+  psu.calibrate_current(10, verbose=False)
+  assert bool(board.word() & board.sr.MASK_CURRENT_EN) == off
+  assert psu.pwm_vreg.duty_u16() == dsave
+  assert psu.pwm_iadj.duty_u16() == isave
+  # 100..400 mA fit the output range across 10 ohms
+  assert len(psu.ilim_ua) == 5
+  for ua, duty in zip(psu.ilim_ua, psu.ilim_duty):
+    assert duty / psu.ISCALE_FACTOR * 1.25 == pytest.approx(ua / 1000, abs=0.5)
+  assert psu.ma2duty(200) == pytest.approx(200 / 1.25 * psu.ISCALE_FACTOR, abs=16)
+  # saved and read back
+  psu.load_table()
+  assert len(psu.ilim_ua) == 5
+
+def test_calibrate_current_too_few_points(psu, board, monkeypatch):
+  trip_model(psu, board, monkeypatch, 1000, 1.0)
+  psu.disable()
+  with pytest.raises(RuntimeError):
+    # 10 V is out of range, one point left
+    psu.calibrate_current(1000, currents=(1, 10), verbose=False)
+  assert board.word() & board.sr.MASK_CURRENT_EN
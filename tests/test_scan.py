@@ -0,0 +1,53 @@
+from array import array
+
+def test_scan_reads_every_channel(board):
+  adc = board.adc
+  for ch in range(12): board.volts[ch] = 1000 * (ch + 1)
+  buf = adc.scan()
+  assert list(buf) == [ board.volts[ch] for ch in adc.AIN ]
+  # deselected at the end
+  assert board.word() & board.sr.MASK_AMUX_EN
+
+def test_scan_commits(board):
+  adc = board.adc
+  buf = array('H', [0] * adc.NCHAN)
+  writes = board.bus.spi.writes
+  adc.scan(buf)
+  # one commit per channel and a single deselect
+  assert board.bus.spi.writes - writes == adc.NCHAN + 1
+  writes = board.bus.spi.writes
+  adc.read_reference(adc.VUSB)
+  assert board.bus.spi.writes - writes == 2
+
+def test_scan_matches_reference(board):
+  adc = board.adc
+  for ch in range(12): board.volts[ch] = 4096 * ch
+  volts = adc.all()
+  for i, ch in enumerate(adc.AIN):
+    assert abs(volts[i] - adc.read_reference(ch)) < 1e-9
+
+def test_read_one_hold(board):
+  adc = board.adc
+  board.volts[adc.VUSB] = 2048 << 4
+  writes = board.bus.spi.writes
+  assert abs(adc.read(adc.VUSB) - 3.3) < 0.01
+  # select and deselect in one hold, pending left as committed
+  assert board.bus.spi.writes - writes == 2
+  assert board.sr.pending == board.sr.outputs == board.word()
+  assert board.word() & board.sr.MASK_AMUX_EN
+
+def test_benchmark(board, monkeypatch):
+  # The reference path spends 40 usec per channel in latch pulses,
+  # which is what scan() saves. Host sleeps that short last far
+  # longer than asked, so they are counted on the clock instead of
+  # slept. Host timings are noisy, best of a few runs.
+  import time
+  slept = [ 0 ]
+  ticks_us = time.ticks_us
+  def sleep_us(us): slept[0] += us
+  monkeypatch.setattr(time, 'sleep_us', sleep_us)
+  monkeypatch.setattr(time, 'ticks_us', lambda: ticks_us() + slept[0])
+  runs = [ board.adc.benchmark(nloops=50, verbose=False) for i in range(3) ]
+  reference, read, scan = [ max(rates) for rates in zip(*runs) ]
+  assert scan >= 5 * reference
+  assert read > reference
@@ -0,0 +1,80 @@
+import pytest
+
+from power import Power
+from softstart import Profile
+
+@pytest.fixture
+def prof(board):
+  psu = Power(board.sr, board.adc)
+  psu.pwm_iadj.duty_u16(psu.ma2duty(300))
+  return Profile(psu)
+
+def enabled(board):
+  return not board.word() & board.sr.MASK_CURRENT_EN
+
+def run(prof, ticks):
+  for i in range(ticks):
+    if not prof.busy(): break
+    prof.tick()
+
+def test_play_to_the_end(board, prof):
+  done = []
+  prof.linear(0.0, 3.3, 10, step=2)
+  assert len(prof.duty) == 6
+  prof.play(callback=done.append)
+  assert prof.busy() and enabled(board)
+  assert prof.psu.pwm_vreg.duty_u16() == prof.duty[0]
+  run(prof, 10)
+  assert done == [ prof ]
+  assert prof.index == 6 and not prof.aborted
+  assert prof.psu.pwm_vreg.duty_u16() == prof.duty[-1]
+  assert enabled(board)
+
+def test_abort_restores_the_limit(board, prof):
+  limit = prof.psu.pwm_iadj.duty_u16()
+  done = []
+  prof.stepped([ 1.0, 2.0, 3.0 ], 4)
+  prof.play(abort=100, callback=done.append)
+  run(prof, 2)
+  board.isense = 0xffff
+  run(prof, 1)
+  assert prof.aborted and prof.disabled
+  assert done == [ prof ] and not prof.busy()
+  assert prof.index == 3
+  assert not enabled(board)
+  assert prof.psu.pwm_iadj.duty_u16() == limit
+
+def test_abort_waits_for_the_bus(board, prof):
+  limit = prof.psu.pwm_iadj.duty_u16()
+  prof.linear(0.0, 3.3, 10)
+  prof.play(abort=100)
+  board.isense = 0xffff
+  with board.sr:
+    run(prof, 3)
+    # cut through the limiter, CURRENT_EN still on
+    assert prof.aborted and not prof.disabled and prof.busy()
+    assert prof.psu.pwm_iadj.duty_u16() == 0
+    assert enabled(board)
+  run(prof, 1)
+  assert prof.disabled and not prof.busy()
+  assert not enabled(board)
+  assert prof.psu.pwm_iadj.duty_u16() == limit
+
+def test_claimed_adc_skips_the_check(board, prof):
+  prof.linear(0.0, 3.3, 4)
+  prof.play(abort=100)
+  board.isense = 0xffff
+  board.adc.claims += 1
+  run(prof, 10)
+  board.adc.claims -= 1
+  assert not prof.aborted and prof.index == 5
+
+@pytest.mark.parametrize('build', [
+  lambda p: p.linear(0.0, 1.0, 10, step=0),
+  lambda p: p.scurve(0.0, 1.0, 10, step=0),
+  lambda p: p.stepped([ 1.0 ], 10, step=0),
+  lambda p: p.table([ 1.0, 2.0 ], step=0),
+])
+def test_step_must_be_positive(prof, build):
+  with pytest.raises(ValueError):
+    build(prof)
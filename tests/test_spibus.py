@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import spibus
+from machine import Pin
+
+@pytest.fixture
+def bus():
+  bus = spibus.SPIBus()
+  bus.device('sr', baudrate=12_500_000)
+  bus.device('disp', baudrate=62_500_000, polarity=1, phase=1)
+  return bus
+
+def test_reconfigure_counting(bus):
+  sr = bus.devices['sr']
+  disp = bus.devices['disp']
+  for dev in (sr, sr, disp, sr, sr):
+    dev.write(b'\x00')
+  assert (bus.reconfigs, bus.avoided) == (3, 2)
+  # nested holds by the same device are not avoided reconfigurations
+  with sr:
+    sr.write(b'\x00')
+    sr.write(b'\x00')
+  assert (bus.reconfigs, bus.avoided) == (3, 3)
+  bus.clear_stats()
+  assert (bus.reconfigs, bus.avoided, bus.collisions) == (0, 0, 0)
+
+def test_sr_send_counts_once(bus):
+  import sr595
+  sr = sr595.SR(bus.devices['sr'])
+  bus.devices['disp'].write(b'\x00')
+  bus.clear_stats()
+  sr.set_bits(sr.MASK_PULLUP_EN)
+  sr.send()
+  sr.clr_bits(sr.MASK_PULLUP_EN)
+  sr.send()
+  assert (bus.reconfigs, bus.avoided) == (1, 1)
+
+def test_burst_parked_from_same_thread(bus):
+  sr = bus.devices['sr']
+  disp = bus.devices['disp']
+  cs = disp.guard(Pin(17, Pin.OUT, value=1))
+  seen = []
+  write = bus.spi.write
+  def spy(buf):
+    seen.append( (bus.active.name, cs.pin.value()) )
+    write(buf)
+  bus.spi.write = spy
+  cs.off()
+  disp.write(b'\x2c')
+  assert bus.depth == 1
+  assert not sr.busy() and sr.held()
+  # e.g. a timer callback committing the shift register mid-burst
+  sr.write(b'\x00\x00')
+  assert bus.parked is None and bus.depth == 1
+  assert cs.pin.value() == 0
+  disp.write(b'\xff')
+  cs.on()
+  assert seen == [ ('disp', 0), ('sr', 1), ('disp', 0) ]
+  assert bus.depth == 0 and bus.holder is None
+  assert bus.collisions == 0
+
+def test_collision_raises(bus):
+  sr = bus.devices['sr']
+  disp = bus.devices['disp']
+  with disp:
+    assert sr.busy()
+    with pytest.raises(RuntimeError):
+      sr.write(b'\x00')
+    assert bus.depth == 1 and bus.active is disp
+  assert bus.collisions == 1
+  assert bus.depth == 0
+  sr.write(b'\x00')
+
+def test_other_thread_waits(bus):
+  sr = bus.devices['sr']
+  disp = bus.devices['disp']
+  done = []
+  def other():
+    sr.write(b'\x00')
+    done.append(bus.active.name)
+  with disp:
+    t = threading.Thread(target=other)
+    t.start()
+    time.sleep(0.05)
+    assert not done
+  t.join(5)
+  assert done == [ 'sr' ]
+  assert bus.collisions == 0
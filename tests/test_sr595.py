@@ -0,0 +1,54 @@
+def test_single_write_commit(board):
+  sr = board.sr
+  spi = board.bus.spi
+  writes = spi.writes
+  sr.set_bits(sr.MASK_PULLUP_EN)
+  sr.send()
+  assert spi.writes == writes + 1
+  assert board.word() == sr.outputs == sr.pending
+  # nothing changed, nothing written
+  sr.send()
+  assert spi.writes == writes + 1
+  sr.send(force=True)
+  assert spi.writes == writes + 2
+
+def test_nested_transaction(board):
+  sr = board.sr
+  spi = board.bus.spi
+  writes = spi.writes
+  saved = sr.saved
+  with sr:
+    sr.set_bits(sr.MASK_PULLUP_EN)
+    sr.send()
+    with sr:
+      sr.clr_bits(sr.MASK_DISPLAY_RESET)
+      sr.send()
+      sr.set_bits(sr.MASK_DISPLAY_BACKLIGHT)
+      sr.send()
+    # the inner end commits nothing
+    assert spi.writes == writes
+    assert sr.get_bit(sr.PULLUP_EN) is None
+  assert spi.writes == writes + 1
+  assert sr.saved == saved + 2
+  word = board.word()
+  assert word & sr.MASK_PULLUP_EN and word & sr.MASK_DISPLAY_BACKLIGHT
+  assert not word & sr.MASK_DISPLAY_RESET
+
+def test_empty_transaction(board):
+  sr = board.sr
+  writes = board.bus.spi.writes
+  with sr:
+    pass
+  assert board.bus.spi.writes == writes
+
+def test_select_inside_transaction(board):
+  # the mux must be switched before the conversion, not at the end
+  adc = board.adc
+  board.volts[adc.VREG_OUT] = 2048 << 4
+  with board.sr:
+    board.sr.set_bits(board.sr.MASK_PULLUP_EN)
+    board.sr.send()
+    assert adc.oversample(adc.VREG_OUT, 16) == 3300 * 16
+    assert adc.read(adc.VREG_OUT) > 3.2
+  assert board.word() & board.sr.MASK_PULLUP_EN
+  assert board.word() & board.sr.MASK_AMUX_EN
@@ -0,0 +1,59 @@
+import random
+import statistics
+
+import pytest
+
+from stats import Stats
+
+SMALL = 1 << 30
+
+def in_range(st):
+  for name in ('count', 'kval', 'sum', 'sum_hi', 'sumsq', 'sumsq_hi'):
+    for v in getattr(st, name):
+      assert -SMALL <= v < SMALL, name
+
+def test_exact_short_run():
+  rng = random.Random(1)
+  st = Stats(2)
+  a = [ rng.randrange(4096) << 4 for i in range(500) ]
+  b = [ (2000 + rng.randrange(-3, 4)) << 4 for i in range(500) ]
+  for x, y in zip(a, b):
+    st.update((x, y))
+  for (n, lo, hi, mean, std), data in zip(st.snapshot(), (a, b)):
+    assert (n, lo, hi) == (len(data), min(data), max(data))
+    assert mean == pytest.approx(statistics.fmean(data))
+    assert std == pytest.approx(statistics.stdev(data))
+
+def test_full_scale_soak_stays_small():
+  # worst case steps between the rails, a plain d * d sum would
+  # leave the small int range within a hundred frames
+  st = Stats(1)
+  data = [ 0xfff0 if i & 1 else 0 for i in range(20_000) ]
+  for x in data:
+    st.update((x,))
+    in_range(st)
+  assert st.sumsq_hi[0] > 0
+  n, lo, hi, mean, std = st.snapshot()[0]
+  assert (n, lo, hi) == (20_000, 0, 0xfff0)
+  assert mean == statistics.fmean(data)
+  assert std == pytest.approx(statistics.stdev(data))
+
+def test_drift_below_first_sample():
+  # negative sums carry too, and the result stays exact
+  st = Stats(1)
+  data = [ (4000 - i // 8) << 4 for i in range(30_000) ]
+  for x in data:
+    st.update((x,))
+  in_range(st)
+  assert st.sum_hi[0] < 0
+  n, lo, hi, mean, std = st.snapshot()[0]
+  assert mean == pytest.approx(statistics.fmean(data))
+  assert std == pytest.approx(statistics.stdev(data))
+
+def test_reset():
+  st = Stats(1)
+  st.update((16,))
+  st.reset()
+  assert st.snapshot() == [ (0, 0, 0, 0.0, 0.0) ]
+  st.update((32,))
+  assert st.snapshot()[0][:3] == (1, 32, 32)
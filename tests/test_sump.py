@@ -0,0 +1,120 @@
+import os
+import struct
+
+import pytest
+
+import sump
+
+class Out:
+  # client end of the link: bytes through a pipe, write sizes kept
+  def __init__(self):
+    self.r, self.w = os.pipe()
+    self.sizes = []
+  def write(self, data):
+    self.sizes.append(len(data))
+    os.write(self.w, bytes(data))
+  def read(self):
+    os.close(self.w)
+    with open(self.r, 'rb') as f:
+      return f.read()
+
+def serve(server, data):
+  r, w = os.pipe()
+  os.write(w, data + b'\x03\x03\x03')
+  os.close(w)
+  with open(r, 'rb', buffering=0) as fin:
+    server.fin = fin
+    server.serve()
+  return server.fout.read()
+
+def long_cmd(cmd, val):
+  return bytes([ cmd ]) + struct.pack('<I', val)
+
+@pytest.fixture
+def server(pio):
+  return sump.Sump(pio([ 0 ] * 4), fout=Out())
+
+def test_id_and_metadata(server):
+  out = serve(server, b'\x00' * 5 + b'\x02\x04')
+  assert out[:4] == b'1ALS'
+  assert out[4:] == b'\x01Bus Pirate 5 MicroPython\x00' \
+                    b'\x20\x00\x00\x00\x08' \
+                    b'\x21\x00\x00\x00\x10' \
+                    b'\x23\x05\xf5\xe1\x00' \
+                    b'\x24\x00\x00\x00\x02' \
+                    b'\x00'
+
+def test_settings(server):
+  out = serve(server,
+              long_cmd(sump.CMD_DIVIDER, 99) +
+              long_cmd(sump.CMD_COUNTS, (8 // 4 - 1) << 16 | (32 // 4 - 1)) +
+              long_cmd(sump.CMD_FLAGS, 0x3c) +
+              long_cmd(sump.CMD_TRIGGER_MASK, 0x181) +
+              long_cmd(sump.CMD_TRIGGER_VALUE, 0x101) +
+              long_cmd(sump.CMD_TRIGGER_CONFIG, 0x08000000))
+  assert out == b''
+  assert server.rate == 1_000_000
+  assert (server.read_count, server.delay_count) == (32, 8)
+  assert server.flags == 0x3c and server.groups() == 1
+  assert (server.trigger_mask, server.trigger_value) == (0x81, 0x01)
+  assert server.trigger_config == 0x08000000
+  # only the divider's 24 bits count
+  server.fout = Out()
+  serve(server, long_cmd(sump.CMD_DIVIDER, 0xff000000 | 9))
+  assert server.rate == 10_000_000
+
+def test_run_sends_newest_first(pio, monkeypatch):
+  monkeypatch.setattr(sump.Sump, 'CHUNK', 8)
+  samples = [ i & 0x3f for i in range(200) ]
+  samples[100] = 0x80
+  server = sump.Sump(pio(samples), fout=Out())
+  # 32 samples asked for, 8 after the trigger; the buffer holds 16.
+  # Group 0 only, one byte per sample
+  out = serve(server,
+              long_cmd(sump.CMD_COUNTS, (8 // 4 - 1) << 16 | (32 // 4 - 1)) +
+              long_cmd(sump.CMD_FLAGS, 0x38) +
+              long_cmd(sump.CMD_TRIGGER_MASK, 0x80) +
+              long_cmd(sump.CMD_TRIGGER_VALUE, 0x80) +
+              b'\x01')
+  assert server.trigger.index == 7
+  window = samples[93:109]
+  assert out == bytes(reversed(window)) + bytes(16)
+  assert server.fout.sizes == [ 8 ] * 4
+
+def test_send_groups(pio, monkeypatch):
+  monkeypatch.setattr(sump.Sump, 'CHUNK', 8)
+  server = sump.Sump(pio([ 0 ] * 4), fout=Out())
+  server.io.buf[:] = bytes(range(1, 17))
+  server.read_count = 16
+  # groups 0 and 1 enabled, the data in group 0
+  server.flags = 0x30
+  server.out = server.fout
+  server.send(16)
+  assert server.fout.read() == \
+         b''.join( bytes([ i, 0 ]) for i in range(16, 0, -1) )
+  assert server.fout.sizes == [ 8 ] * 4
+
+def test_aborts_on_client_bytes(pio, monkeypatch):
+  r, w = os.pipe()
+  fin = open(r, 'rb', buffering=0)
+  fout = open(os.devnull, 'wb')
+  io = pio([ 0 ] * 4000, size=64)
+  server = sump.Sump(io, fin, fout)
+  sent = []
+  monkeypatch.setattr(server, 'send', sent.append)
+  # 10 kS/s, trigger on IO0 high, run; the line stays low and the
+  # client sends the ^C bytes while the capture waits
+  os.write(w, b'\x80' + (9999).to_bytes(4, 'little'))
+  os.write(w, b'\xc0\x01\x00\x00\x00' b'\xc1\x01\x00\x00\x00' b'\x01')
+  os.write(w, b'\x03\x03\x03')
+  try:
+    server.serve()
+  finally:
+    fin.close()
+    fout.close()
+    os.close(w)
+  assert sent == []
+  assert server.trigger.index is None
+  # one slice of the wait, not the whole input
+  assert len(io.words) == 1000 - 125
+
@@ -0,0 +1,125 @@
+import pytest
+
+import logic
+import trigger
+
+def test_edge_on_high_line(pio):
+  # bit 0 high from the start, the first real rising edge at 20
+  samples = [ 1 ] * 10 + [ 0 ] * 10 + [ 1 ] * 10 + [ 0 ] * 10
+  io = pio(samples)
+  t = trigger.Trigger(io)
+  t.edge(0)
+  t.capture(nsamples=16, post=4)
+  assert t.index == 11
+  assert list(io.buf[:io.nsamples]) == samples[9:25]
+  assert not io.overrun
+
+def test_pattern_at_start(pio):
+  # a level pattern already there is seen from the second sample
+  io = pio([ 5, 5, 1, 2 ] + [ 0 ] * 8)
+  t = trigger.Trigger(io)
+  t.pattern(0xff, 5)
+  assert t.capture(nsamples=16, post=2) == 4
+  assert t.index == 1
+
+def test_pulse_in_progress_ignored(pio):
+  # a 4 sample pulse cut to 2 by the start, then a real one of 4
+  samples = [ 1, 1 ] + [ 0 ] * 6 + [ 1 ] * 4 + [ 0 ] * 20
+  io = pio(samples)
+  t = trigger.Trigger(io)
+  t.pulse(0, 1, 2, 3)
+  t.capture(nsamples=16, post=2, timeout_ms=0.028, rate=1_000_000)
+  assert t.index is None
+  io = pio(samples)
+  t = trigger.Trigger(io)
+  t.pulse(0, 1, 4, 4)
+  t.capture(nsamples=16, post=2)
+  assert t.index is not None
+  assert io.buf[t.index - 1] == 1 and io.buf[t.index] == 0
+
+def test_abort_ends_the_wait(pio):
+  io = pio([ 0 ] * 1000)
+  t = trigger.Trigger(io)
+  t.edge(0)
+  calls = []
+  def abort():
+    calls.append(len(io.words))
+    return len(calls) == 3
+  assert t.capture(rate=1000, nsamples=16, abort=abort) == 16
+  assert t.index is None
+  # slices of 50 ms at 1 kS/s, rounded up to FIFO words
+  assert calls == [ 250 - 13, 250 - 26, 250 - 39 ]
+
+def test_wait_sliced_without_abort(pio, monkeypatch):
+  io = pio([ 0 ] * 1000)
+  t = trigger.Trigger(io)
+  t.edge(0)
+  limits = []
+  loop = trigger.trigger_loop
+  def spy(buf, p):
+    limits.append(p[trigger.P_LIMIT])
+    loop(buf, p)
+  monkeypatch.setattr(trigger, 'trigger_loop', spy)
+  # 180 ms at 1 kS/s, back in Python every 50 ms, slices end on
+  # whole FIFO words
+  t.capture(rate=1000, nsamples=16, timeout_ms=180)
+  assert t.index is None
+  assert limits == [ 50, 102, 154, 180 ]
+
+@pytest.mark.parametrize('at, overrun', [ (130, False), (110, True) ])
+def test_history_spans_slices(pio, at, overrun):
+  samples = [ i & 0x7f for i in range(250) ]
+  samples[at] = 0xff
+  io = pio(samples)
+  t = trigger.Trigger(io)
+  t.edge(7)
+  def abort():
+    # samples lost while the slice boundary at 104 is polled
+    if len(io.words) == 250 // 4 + 1 - 26: io.fdebug = 1 << 0
+    return False
+  t.capture(rate=1000, nsamples=16, post=4, abort=abort)
+  assert t.index == 11
+  assert list(io.buf) == samples[at - 11:at + 5]
+  assert io.overrun == overrun
+
+def rle_io(board, pio, monkeypatch, samples, depth=64):
+  fake = pio(samples)
+  io = logic.Logic(board.sr, None, depth=depth)
+  monkeypatch.setattr(io, 'start_sm', fake.start_sm)
+  return io, fake
+
+def runs_of(samples):
+  out = []
+  for s in samples:
+    if out and out[-1][0] == s and out[-1][1] < 65536: out[-1][1] += 1
+    else: out.append([ s, 1 ])
+  return [ tuple(r) for r in out ]
+
+def test_rle_default_is_bounded(board, pio, monkeypatch):
+  io, fake = rle_io(board, pio, monkeypatch, [ 0 ] * 2000)
+  slices = []
+  loop = logic.rle_loop
+  def spy(buf, info):
+    slices.append(info[1])
+    loop(buf, info)
+  monkeypatch.setattr(logic, 'rle_loop', spy)
+  # one second at 1 kS/s, in 50 ms slices of FIFO words
+  assert io.capture(rate=1000, rle=True) == 1000
+  assert list(io.runs()) == [ (0, 1000) ]
+  assert slices == [ 12 ] * 20 + [ 10 ]
+  assert len(fake.words) == 250
+
+def test_rle_runs_span_slices(board, pio, monkeypatch):
+  samples = [ (i // 30) & 3 for i in range(400) ]
+  io, fake = rle_io(board, pio, monkeypatch, samples)
+  assert io.capture(rate=1000, nsamples=400, rle=True) == 400
+  assert list(io.runs()) == runs_of(samples)
+  assert io.sample(95) == 3
+
+def test_rle_stops_when_full(board, pio, monkeypatch):
+  samples = [ i & 1 for i in range(400) ]
+  io, fake = rle_io(board, pio, monkeypatch, samples, depth=32)
+  # ten records of one sample fit
+  assert io.capture(rate=1000, nsamples=400, rle=True) == 10
+  assert io.nbytes == 30
+  assert list(io.runs()) == runs_of(samples[:10])
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from array import array
+
+from ring import Ring
+from worker import Worker
+
+def test_ring_handoff_threads():
+  # one producer thread, the consumer here, no locks
+  ring = Ring(16, 2)
+  total = 5000
+  def produce():
+    n = 0
+    while n < total:
+      frame = ring.slot()
+      if frame is None:
+        time.sleep(0)
+        continue
+      frame[0] = n & 0xffff
+      frame[1] = (n >> 16) & 0xffff
+      ring.push()
+      n += 1
+  t = threading.Thread(target=produce)
+  t.start()
+  expect = 0
+  while expect < total:
+    w = ring.window()
+    for i in range(0, len(w), 2):
+      assert w[i] | (w[i + 1] << 16) == expect
+      expect += 1
+    ring.consume(len(w) // 2)
+    if not len(w): time.sleep(0)
+  t.join()
+  assert ring.available() == 0
+
+def test_worker_runs_and_stops():
+  count = [0]
+  def sample(frame):
+    frame[0] = count[0] & 0xffff
+    count[0] += 1
+  w = Worker(sample, 1, rate=2000, depth=64)
+  w.start()
+  got = []
+  t0 = time.monotonic()
+  while len(got) < 200 and time.monotonic() - t0 < 5:
+    win = w.ring.window()
+    got.extend(win)
+    w.ring.consume(len(win))
+  w.stop()
+  assert not w.running()
+  assert got[:200] == list(range(200))
+
+def test_worker_stop_after_failure(monkeypatch):
+  # the thread's exception goes to sys.unraisablehook, a little
+  # after done is set, wait for it so it isn't reported later on
+  raised = []
+  monkeypatch.setattr(sys, 'unraisablehook',
+                      lambda u: raised.append(u.exc_type))
+  def sample(frame):
+    raise ValueError('sampling failed')
+  w = Worker(sample, 1, rate=1000, depth=4)
+  w.start()
+  t0 = time.monotonic()
+  while w.running() and time.monotonic() - t0 < 5: pass
+  w.stop()
+  assert not w.running()
+  while not raised and time.monotonic() - t0 < 5: time.sleep(0.001)
+  assert raised == [ ValueError ]
+
+def test_worker_plain_cpython():
+  # without the MicroPython time functions of conftest
+  lib = os.path.join(os.path.dirname(__file__), '..', 'flash', 'lib')
+  code = (
+    'import time, worker\n'
+    'assert not hasattr(time, "ticks_us")\n'
+    'w = worker.Worker(lambda f: None, 1, rate=1000, depth=8)\n'
+    'w.start(); time.sleep(0.05); w.stop()\n'
+    'assert not w.running() and w.ring.available() > 0\n' )
+  subprocess.run([ sys.executable, '-c', code ], cwd=lib, check=True,
+                 timeout=20)
+
+def test_step_leaves_pending(board):
+  sr = board.sr
+  adc = board.adc
+  pending = sr.pending
+  buf = array('H', [0] * adc.NCHAN)
+  # the other core changes a bit while the field steps
+  def sample():
+    sr.clr_bits(sr.MASK_CURRENT_EN)
+    return 0
+  sr.step(adc.MASK_AMUX, adc.mux_words, sample, buf)
+  assert sr.pending == pending & ~sr.MASK_CURRENT_EN
+  # the hardware state is tracked, and the change still commits
+  assert sr.outputs == board.word()
+  assert sr.get_bit(sr.CURRENT_EN) is None
+  sr.send()
+  assert board.word() == sr.pending == sr.outputs
+  assert sr.get_bit(sr.CURRENT_EN) == 0